@@ -97,15 +97,16 @@ class S3Backup():
         self.s3.Object(self.bucket_name, most_recent_state_key).delete()
 
 
-# saves screenshot of data_url to specified path. takes 5 sec. can throw exception on load fail
+# saves screenshot of data_url to specified path. waits up to 10 sec for the page to settle. 
+# can throw exception on load fail
 def screenshot_to_path(data_url, path, browser):
     logger.info(f"    1. get content from {data_url}")
     if not browser.navigate(data_url):
         logger.error("  get timed out -> skip")
         return
 
-    logger.info(f"    2. wait for 5 seconds")
-    time.sleep(5)
+    logger.info(f"    2. wait for page to settle")
+    browser.wait_until_ready(max_secs=10.0, quiet_secs=1.0)
 
     logger.info(f"    3. save screenshot to {path}")
     browser.screenshot(path, full_page=True)
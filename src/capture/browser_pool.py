@@ -0,0 +1,122 @@
+#
+# BrowserPool
+#
+#   a set of captive browsers that can render pages at the same time.
+#
+#   browsers are started on demand (up to size) and recycled after 
+#   max_navigations pages or when they use more than max_memory_mb, 
+#   because long running firefox processes bloat.  a browser whose 
+#   driver has died is replaced automatically.
+#
+
+from typing import List
+from loguru import logger
+from contextlib import contextmanager
+import threading
+import atexit
+
+from capture.captive_browser import CaptiveBrowser
+
+
+class BrowserPool:
+    """ shares N CaptiveBrowsers between threads """
+
+    def __init__(self, size: int = 2, headless: bool = True, browser: str = "firefox",
+            max_navigations: int = 100, max_memory_mb: float = 2000.0):
+
+        if size < 1: size = 1
+
+        self.size = size
+        self.headless = headless
+        self.browser = browser
+        self.max_navigations = max_navigations
+        self.max_memory_mb = max_memory_mb
+
+        self._idle: List[CaptiveBrowser] = []
+        self._cnt = 0
+        self._cond = threading.Condition()
+        self._is_closed = False
+
+        atexit.register(self.close)
+
+    def acquire(self) -> CaptiveBrowser:
+        " get a browser, waits if all of them are in use "
+
+        with self._cond:
+            while True:
+                if self._is_closed: raise Exception("Browser pool is closed")
+                if len(self._idle) > 0:
+                    return self._idle.pop()
+                if self._cnt < self.size:
+                    self._cnt += 1
+                    break
+                self._cond.wait()
+
+        # start a new one outside the lock, it takes a few seconds
+        try:
+            logger.info(f"  [start captive browser {self._cnt} of {self.size}]")
+            return CaptiveBrowser(self.headless, self.browser)
+        except Exception:
+            with self._cond:
+                self._cnt -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, captive: CaptiveBrowser, is_broken: bool = False):
+        " return a browser to the pool, recycles it if needed "
+
+        reason = self._should_recycle(captive, is_broken)
+        if reason != None:
+            logger.info(f"  [recycle captive browser: {reason}]")
+            self._close_browser(captive)
+            with self._cond:
+                self._cnt -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if self._is_closed:
+                self._cnt -= 1
+                self._close_browser(captive)
+                return
+            self._idle.append(captive)
+            self._cond.notify()
+
+    @contextmanager
+    def borrow(self):
+        " use a browser in a with statement "
+        captive = self.acquire()
+        is_broken = False
+        try:
+            yield captive
+        except Exception:
+            is_broken = not captive.is_alive()
+            raise
+        finally:
+            self.release(captive, is_broken)
+
+    def _should_recycle(self, captive: CaptiveBrowser, is_broken: bool) -> str:
+        if is_broken: return "driver died"
+        if captive.navigation_count >= self.max_navigations:
+            return f"{captive.navigation_count} navigations"
+        mbs = captive.memory_usage()
+        if mbs != None and mbs > self.max_memory_mb:
+            return f"using {mbs:.0f} MBs"
+        return None
+
+    def _close_browser(self, captive: CaptiveBrowser):
+        try:
+            captive.close()
+        except Exception as ex:
+            logger.warning(f"  close browser failed: {ex}")
+
+    def close(self):
+        " shut down all the idle browsers, busy ones are closed when released "
+        with self._cond:
+            self._is_closed = True
+            idle = self._idle
+            self._idle = []
+            self._cnt -= len(idle)
+            self._cond.notify_all()
+        for captive in idle:
+            self._close_browser(captive)
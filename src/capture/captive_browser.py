@@ -1,10 +1,11 @@
 import requests
 from loguru import logger
-from typing import Callable, Tuple
+from typing import Callable, Tuple, List
 
 from selenium import webdriver
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import TimeoutException
 
 import imageio
 import time
@@ -31,6 +32,43 @@ def are_images_same(buffer1: bytes, buffer2: bytes) -> Tuple[bool, bytes]:
     else:
         return True, None
 
+# installs hooks that track page activity: the time of the last DOM mutation 
+# and the number of XHR/fetch requests in flight.  safe to run more than once.
+_ACTIVITY_SCRIPT = """
+if (!window.__captive_activity) {
+    var s = { mutated: Date.now(), pending: 0 };
+    window.__captive_activity = s;
+
+    var done = function() { s.pending = Math.max(0, s.pending - 1); s.mutated = Date.now(); };
+
+    new MutationObserver(function() { s.mutated = Date.now(); }).observe(document, 
+        { childList: true, subtree: true, attributes: true, characterData: true });
+
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        s.pending++;
+        this.addEventListener("loadend", done);
+        return send.apply(this, arguments);
+    };
+
+    if (window.fetch) {
+        var fetch = window.fetch;
+        window.fetch = function() {
+            s.pending++;
+            return fetch.apply(this, arguments).finally(done);
+        };
+    }
+}
+"""
+
+# returns [readyState, ms since last mutation, pending requests, resources loaded]
+_ACTIVITY_STATUS_SCRIPT = """
+var s = window.__captive_activity;
+var n = window.performance ? window.performance.getEntriesByType("resource").length : 0;
+if (!s) return [document.readyState, 0, 0, n];
+return [document.readyState, Date.now() - s.mutated, s.pending, n];
+"""
+
 class CaptiveBrowser:
 
     def __init__(self, headless = True, browser = "firefox", full_page = True):
@@ -40,6 +78,7 @@ class CaptiveBrowser:
         self.full_page = full_page
 
         self.current_url = None
+        self.navigation_count = 0
 
         logger.debug(f"start {browser}")
 
@@ -74,6 +113,7 @@ class CaptiveBrowser:
     def navigate(self, url: str) -> bool:
         try:
             logger.debug(f"navigate to {url}")
+            self.navigation_count += 1
             self.driver.get(url)
             self.current_url = url
             return True
@@ -83,6 +123,100 @@ class CaptiveBrowser:
             if "Timeout loading page" in s: return False
             raise ex
 
+    def wait_until_ready(self, max_secs: float = 10.0, quiet_secs: float = 0.3, 
+            xpath: str = None) -> float:
+        """ wait for the page to settle, returns the time waited in seconds
+
+        the page is ready when:
+          1. the document has loaded,
+          2. no XHR/fetch requests are in flight,
+          3. the DOM has not changed and no new resources have loaded for quiet_secs,
+          4. the element at xpath (if given) is present.
+
+        gives up after max_secs.  requests started before the hooks are 
+        installed are caught by watching the resource count.
+        """
+
+        start = time.perf_counter()
+        try:
+            self.driver.execute_script(_ACTIVITY_SCRIPT)
+        except Exception as ex:
+            logger.warning(f"  could not install activity hooks: {ex}")
+
+        state = { "resources": -1, "changed_at": start }
+
+        def is_ready(driver) -> bool:
+            ready_state, quiet_ms, pending, resources = driver.execute_script(_ACTIVITY_STATUS_SCRIPT)
+
+            xnow = time.perf_counter()
+            if resources != state["resources"]:
+                state["resources"] = resources
+                state["changed_at"] = xnow
+
+            if ready_state != "complete": return False
+            if pending > 0: return False
+            if quiet_ms < quiet_secs * 1000: return False
+            if xnow - state["changed_at"] < quiet_secs: return False
+            if xpath != None and len(driver.find_elements(By.XPATH, xpath)) == 0: return False
+            return True
+
+        is_timeout = False
+        try:
+            w = WebDriverWait(self.driver, max_secs, poll_frequency=0.1)
+            w.until(is_ready)
+        except TimeoutException:
+            is_timeout = True
+
+        secs = time.perf_counter() - start
+        if is_timeout:
+            logger.info(f"  not ready after {secs:.2f}s (limit) {self.current_url}")
+        else:
+            logger.info(f"  ready after {secs:.2f}s {self.current_url}")
+        return secs
+
+    def is_alive(self) -> bool:
+        " check that the driver still responds "
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def memory_usage(self) -> float:
+        """ memory used by the driver and the browser processes it started in MBs
+
+        returns None if it can't be determined (only works on linux)
+        """
+        try:
+            pid = self.driver.service.process.pid
+        except Exception:
+            return None
+
+        def get_rss(pid: int) -> int:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"): return int(line.split()[1])
+            return 0
+
+        def get_children(pid: int) -> List[int]:
+            result = []
+            task_dir = f"/proc/{pid}/task"
+            for tid in os.listdir(task_dir):
+                with open(os.path.join(task_dir, tid, "children"), "r") as f:
+                    result.extend(int(x) for x in f.read().split())
+            return result
+
+        try:
+            total_kb = 0
+            pids = [pid]
+            while len(pids) > 0:
+                x = pids.pop()
+                total_kb += get_rss(x)
+                pids.extend(get_children(x))
+            return total_kb / 1024.0
+        except Exception:
+            return None
+
     def has_slow_elements(self) -> bool:
         if ".arcgis.com" in self.current_url: return True
 
@@ -170,5 +304,6 @@ class CaptiveBrowser:
         return buffer
 
     def close(self):
-        self.driver.close()
+        # quit (not close) so the driver and browser processes exit
+        self.driver.quit()
 
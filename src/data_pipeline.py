@@ -11,26 +11,37 @@ files are only updated if the cleaned version changes
 """
 
 import os
+import json
 from loguru import logger
 from typing import List, Dict, Tuple
+from datetime import datetime
 import pandas as pd
 
 from shared.directory_cache import DirectoryCache
-from transform.change_list import ChangeList
+from shared.json_store import JsonStore
+from transform.change_list import ChangeList, ChangeItem
 
 from sources.url_manager import UrlManager
+from sources.fetch_engine import FetchEngine, FetchTask, canonical_url, merge_duplicate_urls
+from sources.host_health import HostHealth, is_host_failure
+from shared.stage_timer import StageTimer
+from shared import metrics
+from sources.poll_scheduler import PollScheduler
 
 from sources.url_source import UrlSource, UrlSources
 from sources.url_source_manager import UrlSourceManager
 
-from transform.html_formater import HtmlFormater
-from transform.html_cleaner import HtmlCleaner
-from transform.html_extracter import HtmlExtracter
-from transform.html_converter import HtmlConverter
+from transform.page_transform import PageTransform
+from transform.offline_rebuild import RebuildContext, rebuild_pages
+from transform.rebuild_manifest import RebuildManifest, stage_version
+from transform.field_rules import default_field_rules
+from transform.cleaner_rules import read_cleaner_rules_file
+from transform.cleaner_backends import make_cleaner
 
 from specialized_capture import SpecializedCapture
 
-from shared.util import is_bad_content, get_host
+from shared.util import is_bad_content, get_host, content_hash, configure_session, get_peak_memory, \
+    convert_python_to_json
 from shared import util_git
 from shared import udatetime
 
@@ -46,6 +57,24 @@ class DataPipelineConfig():
 
         self.headless = flags["headless"]
 
+        self.max_workers = flags.get("max_workers", 8)
+        self.max_per_host = flags.get("max_per_host", 2)
+        self.browser_count = flags.get("browser_count", 2)
+        self.max_memory_mb = flags.get("max_memory_mb", 64.0)
+
+        self.timeout = flags.get("timeout", 30)
+        self.retries = flags.get("retries", 2)
+        self.max_size_mb = flags.get("max_size_mb", 20.0)
+
+        # see transform/cleaner_backends.py
+        self.cleaner_backend = flags.get("cleaner_backend", "python")
+
+        # hash the clean pages and extract only their changed subtrees
+        self.incremental_extract = flags.get("incremental_extract", False)
+
+        # processes for the offline format/clean/extract/convert, 0 = one per cpu
+        self.jobs = flags.get("jobs", 1)
+
         if flags.get("firefox"):
             self.browser = "firefox"
         elif flags.get("chrome"):
@@ -53,6 +82,62 @@ class DataPipelineConfig():
         else:
             self.browser = "requests"
 
+class Workspace():
+    """ the caches and per-key state for one subfolder of base_dir
+
+    each UrlSource writes to the workspace for its subfolder,
+    the main states sources use base_dir itself ("").
+    """
+
+    def __init__(self, base_dir: str, subfolder: str):
+        self.subfolder = subfolder if subfolder != None else ""
+
+        work_dir = os.path.join(base_dir, self.subfolder) if self.subfolder != "" else base_dir
+
+        self.cache_raw = DirectoryCache(os.path.join(work_dir, "raw")) 
+        self.cache_clean = DirectoryCache(os.path.join(work_dir, "clean")) 
+        self.cache_extract = DirectoryCache(os.path.join(work_dir, "extract")) 
+        self.cache_convert = DirectoryCache(os.path.join(work_dir, "convert")) 
+
+        self.cache_diff = DirectoryCache(os.path.join(work_dir, "diff")) 
+
+        # SubtreeIndex of each extract, for incremental_extract
+        self.cache_hash = DirectoryCache(os.path.join(work_dir, "hash")) 
+
+        # what each output of a stage was built from, kept in its output cache
+        self.manifests: Dict[str, RebuildManifest] = {
+            "clean": RebuildManifest("clean", self.cache_clean),
+            "extract": RebuildManifest("extract", self.cache_extract),
+            "convert": RebuildManifest("convert", self.cache_convert),
+        }
+
+        # ETag/Last-Modified per key, kept next to change_list.json
+        self.http_validators = JsonStore(self.cache_raw, "http_validators.json")
+
+        # hash of the last downloaded bytes per key, so an identical page 
+        # can be skipped without formatting/cleaning it.
+        #   raw = hash of the downloaded content
+        #   stored = hash of the file in cache_raw it corresponds to
+        self.raw_fingerprints = JsonStore(self.cache_raw, "raw_fingerprints.json")
+
+        # when each location is due to be checked again
+        self.scheduler = PollScheduler(self.cache_raw)
+
+        # set while a run is in progress
+        self.change_list: ChangeList = None
+
+    def start_run(self):
+        self.change_list = ChangeList(self.cache_raw)
+        self.change_list.start_run()
+
+    def save_state(self):
+        " save the per-key state kept next to change_list.json "
+        self.http_validators.save()
+        self.raw_fingerprints.save()
+        self.scheduler.save()
+        for x in self.manifests.values(): x.save()
+
+
 class DataPipeline():
 
     def __init__(self, config: DataPipelineConfig):
@@ -65,14 +150,39 @@ class DataPipeline():
 
         self.cache_sources = DirectoryCache(os.path.join(base_dir, "sources")) 
 
-        self.cache_raw = DirectoryCache(os.path.join(base_dir, "raw")) 
-        self.cache_clean = DirectoryCache(os.path.join(base_dir, "clean")) 
-        self.cache_extract = DirectoryCache(os.path.join(base_dir, "extract")) 
-        self.cache_convert = DirectoryCache(os.path.join(base_dir, "convert")) 
+        # one workspace per source subfolder, created as needed
+        self.workspaces: Dict[str, Workspace] = {}
+
+        # the main workspace, used for the offline format/clean/extract/convert
+        ws = self.get_workspace("")
+        self.cache_raw = ws.cache_raw
+        self.cache_clean = ws.cache_clean
+        self.cache_extract = ws.cache_extract
+        self.cache_convert = ws.cache_convert
+        self.cache_diff = ws.cache_diff
+
+        self.http_validators = ws.http_validators
+        self.raw_fingerprints = ws.raw_fingerprints
+        self.scheduler = ws.scheduler
+
+        # per-location/per-host fixes for the cleaner
+        self.cleaner_rules = read_cleaner_rules_file()
+        make_cleaner(config.cleaner_backend)    # fail now on a bad backend name
 
-        self.cache_diff = DirectoryCache(os.path.join(base_dir, "diff")) 
+        # hosts that keep failing are skipped for a while (shared by all workspaces)
+        self.host_health = HostHealth(self.cache_raw)
 
-        self.url_manager = UrlManager(config.headless, config.browser)
+        # the http pool needs at least one connection per concurrent fetch to a host
+        configure_session(
+            pool_connections=max(32, config.max_workers * 4), 
+            pool_maxsize=max(4, config.max_per_host),
+            timeout=config.timeout,
+            retries=config.retries,
+            max_size=int(config.max_size_mb * 1e6))
+
+        self.url_manager = UrlManager(config.headless, config.browser, config.browser_count,
+            spill_dir=os.path.join(config.temp_dir, "url_manager"), max_memory_mb=config.max_memory_mb,
+            strip_cr=True)
 
         self.sources: UrlSources = None
 
@@ -81,9 +191,8 @@ class DataPipeline():
     def get_capture(self) -> SpecializedCapture:
         if self._capture == None:
             publish_dir = os.path.join(self.config.base_dir, 'captive-browser')
-            driver = self.url_manager._captive.driver if self.url_manager._captive else None
             self._capture = SpecializedCapture(
-                self.config.temp_dir, publish_dir, driver)
+                self.config.temp_dir, publish_dir, self.url_manager.get_pool())
         return self._capture
 
     def shutdown_capture(self):
@@ -98,257 +207,526 @@ class DataPipeline():
         manager = UrlSourceManager(self.cache_sources)
         self.sources = manager.update_sources("scan")
 
+    def get_workspace(self, subfolder: str) -> Workspace:
+        if subfolder == None: subfolder = ""
+        ws = self.workspaces.get(subfolder)
+        if ws == None:
+            ws = Workspace(self.config.base_dir, subfolder)
+            self.workspaces[subfolder] = ws
+        return ws
+
+    def get_scan_sources(self) -> List[UrlSource]:
+        " the sources to scan in this run "
+        if self.sources == None:
+            raise Exception("Sources not provided")
+
+        result = []
+        for src in self.sources.items:
+            if not src.enable_for_run: continue
+            if src.status != "valid":
+                logger.warning(f"  skip source {src.name} b/c status is {src.status}")
+                continue
+            if src.df is None:
+                logger.warning(f"  skip source {src.name} b/c it does not have any data loaded")
+                continue
+            result.append(src)
+
+        if len(result) == 0:
+            raise Exception("No valid URL sources")
+        return result
+
     def process(self) -> Dict[str, str]:
         " run the pipeline "
 
         self.url_manager.reset()
-        self.change_list = ChangeList(self.cache_raw)        
+
+        for ws in self.workspaces.values(): ws.change_list = None
+        main = self.get_workspace("")
+        main.start_run()
+        self.change_list = main.change_list
         
         host = get_host()
         print(f"=== run started on {host} at {udatetime.to_logformat(self.change_list.start_date)}")
 
-        self.change_list.start_run()
         try:
-            if self.sources == None:
-                raise Exception("Sources not provided")
-            src = self.sources.items[0]
-            if src.name != "google-states-csv":
-                raise Exception(f"Expected first source to be google-states-csv, not {src.name}")
-            return self._main_loop(src, self.change_list)
+            sources = self.get_scan_sources()
+            for src in sources:
+                ws = self.get_workspace(src.subfolder)
+                if ws.change_list == None: ws.start_run()
+            return self._main_loop(sources)
         except Exception as ex:
             logger.exception(ex)
-            self.change_list.abort_run(ex)
+            for ws in self.workspaces.values():
+                if ws.change_list != None: ws.change_list.abort_run(ex)
         finally:
-            self.change_list.finish_run()
+            for ws in self.workspaces.values():
+                if ws.change_list != None: ws.change_list.finish_run()
+            self.save_state()
 
             self.shutdown_capture()
 
-            logger.info(f"  [in-memory content cache took {self.url_manager.size*1e-6:.1f} MBs")
+            contents = self.url_manager.contents
+            metrics.content_cache_bytes.set(contents.size)
+            metrics.content_cache_peak_bytes.set(contents.peak_size)
+            metrics.content_cache_spilled.inc(contents.spill_cnt)
+            for ws in self.workspaces.values():
+                if ws.change_list == None: continue
+                for status, cnt in ws.change_list.count_by_status().items():
+                    metrics.pages.inc(cnt, status=status)
+            metrics.runs.inc(result="ok" if self.change_list.error_message == None else "error")
+            metrics.run_seconds.observe(self.change_list.time_lapsed.total_seconds())
+            metrics.last_run_timestamp.set(self.change_list.end_date.timestamp())
+
+            logger.info(f"  [fetched {self.url_manager.size*1e-6:.1f} MBs, in-memory content cache peaked at {contents.peak_size*1e-6:.1f} MBs, spilled {contents.spill_cnt} pages]")
+            peak_memory = get_peak_memory()
+            if peak_memory != None:
+                logger.info(f"  [peak process memory {peak_memory:.1f} MBs]")
             logger.info(f"run finished on {host} at {udatetime.to_logformat(self.change_list.start_date)}")
             
+    def save_state(self):
+        " save the per-key state kept next to change_list.json "
+        for ws in self.workspaces.values():
+            ws.save_state()
+        self.host_health.save()
+
+    def save_progress(self):
+        " save the change lists and state of a run in progress "
+        for ws in self.workspaces.values():
+            if ws.change_list != None: ws.change_list.save_progress()
+        self.save_state()
+
+    def next_due_time(self) -> datetime:
+        " the next time a location is due to be checked (UTC), None if unknown "
+        result = None
+        for ws in self.workspaces.values():
+            if ws.change_list == None: continue
+            dt = ws.scheduler.next_due(ws.change_list)
+            if dt != None and (result == None or dt < result): result = dt
+        return result
+
+    def rebuild_context(self) -> RebuildContext:
+        " what the offline stages need, for rebuild_pages "
+        return RebuildContext(self.cache_raw, self.cache_clean, self.cache_extract, self.cache_convert,
+            self.config.cleaner_backend, self.cleaner_rules)
+
+    def list_rebuild_keys(self, cache: DirectoryCache) -> List[str]:
+        " the pages in a cache the offline stages work on "
+        return [key for key in cache.list_html_files() if key != "index.html" and key != "google_sheet.html"]
+
+    def page_version(self, stage: str, key: str, item: ChangeItem) -> str:
+        " version of the transform that builds a page in a stage, see rebuild_manifest.py "
+        if stage == "clean":
+            rules = self.cleaner_rules.for_page(key, item.url if item != None else None)
+            return stage_version(stage, self.config.cleaner_backend, rules.fingerprint)
+        if stage == "extract":
+            return stage_version(stage, item.name, item.source) if item != None else None
+        if stage == "convert":
+            return stage_version(stage, default_field_rules().for_page(key).fingerprint)
+        return stage_version(stage)
+
+    def rebuild_stage(self, stage: str, cache_in: DirectoryCache, cache_out: DirectoryCache, 
+            pages: List[Tuple[str, ChangeItem]], rerun: bool, incremental: bool):
+        """ build the outputs of a stage that are missing
+
+        incremental also rebuilds the outputs that are out of date: their
+        input or the version of the stage changed since they were built, or
+        they were built before there was a manifest. rerun builds all of them.
+        """
+        manifest = self.get_workspace("").manifests[stage]
+
+        todo = []
+        for key, item in pages:
+            out_key = key.replace(".html", ".json") if stage == "convert" else key
+            if not rerun and cache_out.exists(out_key):
+                if not incremental: continue
+                if manifest.is_current(key, content_hash(cache_in.read(key)), self.page_version(stage, key, item)): continue
+            todo.append((key, item))
+        if len(todo) == 0 and incremental: logger.info(f"  {stage}: {len(pages)} pages are up to date")
+
+        built = set(rebuild_pages(stage, self.rebuild_context(), todo, self.config.jobs))
+        if len(built) == 0: return
+        for key, item in todo:
+            if key in built:
+                manifest.record(key, content_hash(cache_in.read(key)), self.page_version(stage, key, item))
+        manifest.save()
+
     def format_html(self, rerun=False):
-        " format raw html "
-        is_first = False
-        for key in self.cache_raw.list_html_files():
-            if key == "index.html": continue
-            if key == "google_sheet.html": continue
-            if rerun or not self.cache_raw.exists(key):
-                if is_first:
-                    logger.info(f"format existing files...")
-                    is_first = False
-                logger.info(f"  format {key}")
-                local_raw_content =  self.cache_raw.read(key)
-                formater = HtmlFormater()
-                local_clean_content = formater.format(None, local_raw_content)
-                self.cache_raw.write(key, local_clean_content)
-
-    def clean_html(self, rerun=False):
+        """ format raw html
+
+        only with rerun: the raw files are formatted when they are fetched,
+        and formatting a formatted file again changes it.
+        """
+        if not rerun: return
+        keys = self.list_rebuild_keys(self.cache_raw)
+        rebuild_pages("format", self.rebuild_context(), [(key, None) for key in keys], self.config.jobs)
+        self.rebuild_fingerprints()
+
+    def rebuild_fingerprints(self):
+        """ check the raw fingerprints against cache_raw
+
+        entries are dropped if the raw file is missing or has been rewritten.
+        the downloaded bytes are not kept, so dropped entries are filled in 
+        again the next time the page is fetched.
+        """
+        cnt = 0
+        for key in self.raw_fingerprints.keys():
+            x = self.raw_fingerprints.get(key)
+            content = self.cache_raw.read(key)
+            if content == None or content_hash(content) != x.get("stored"):
+                self.raw_fingerprints.remove(key)
+                cnt += 1
+        if cnt > 0: logger.info(f"  removed {cnt} stale raw fingerprints")
+        self.raw_fingerprints.save()
+
+    def clean_html(self, rerun=False, incremental=False):
         " generate clean files from existing raw html "
-        is_first = False
-        for key in self.cache_raw.list_html_files():
-            if key == "index.html": continue
-            if key == "google_sheet.html": continue
-            if rerun or not self.cache_clean.exists(key):
-                if is_first:
-                    logger.info(f"clean existing files...")
-                    is_first = False
-                logger.info(f"  clean {key}")
-                local_raw_content =  self.cache_raw.read(key)
-                cleaner = HtmlCleaner()
-                local_clean_content = cleaner.clean(local_raw_content)
-                self.cache_clean.write(key, local_clean_content)
-
-
-    def extract_html(self, rerun=False):
-        " generate extract files from existing clean html "
 
         self.change_list = ChangeList(self.cache_raw)                
         self.change_list.load()
 
-        is_first = False
-        for key in self.cache_clean.list_html_files():
-            if key == "index.html": continue
-            if key == "google_sheet.html": continue
-
-            if rerun or not self.cache_extract.exists(key):
-                if is_first:
-                    logger.info(f"extract existing files...")
-                    is_first = False
-                logger.info(f"  extract {key}")
-                local_clean_content =  self.cache_clean.read(key)
-
-                item = self.change_list.get_item(key)
-                if item == None:
-                    logger.warning("   skip because it is a new item")
-                    continue
+        pages = [(key, self.change_list.get_item(key)) for key in self.list_rebuild_keys(self.cache_raw)]
+        self.rebuild_stage("clean", self.cache_raw, self.cache_clean, pages, rerun, incremental)
+
+    def extract_html(self, rerun=False, incremental=False):
+        " generate extract files from existing clean html "
+
+        self.change_list = ChangeList(self.cache_raw)                
+        self.change_list.load()
 
-                extracter = HtmlExtracter()
-                local_extract_content = extracter.extract(local_clean_content, item)
-                self.cache_extract.write(key, local_extract_content)
+        pages = [(key, self.change_list.get_item(key)) for key in self.list_rebuild_keys(self.cache_clean)]
+        self.rebuild_stage("extract", self.cache_clean, self.cache_extract, pages, rerun, incremental)
 
-    def convert_to_json(self, rerun=False):
+    def convert_to_json(self, rerun=False, incremental=False):
         " get json data out of extracted html "
 
         self.change_list = ChangeList(self.cache_raw)                
         self.change_list.load()
 
-        is_first = False
-        for key in self.cache_extract.list_html_files():
-            if key == "index.html": continue
-            if key == "google_sheet.html": continue
-
-            xkey = key.replace(".html", ".json")
-            if rerun or not self.cache_convert.exists(xkey):
-                if is_first:
-                    logger.info(f"convert existing files...")
-                    is_first = False
-                logger.info(f"  convert {key}")
-                local_extract_content =  self.cache_extract.read(key)
-
-                item = self.change_list.get_item(key)
-                if item == None:
-                    logger.warning("   skip because it is a new item")
-                    continue
-
-                converter = HtmlConverter()
-                local_convert_content = converter.convert(key, local_extract_content, item)
-                self.cache_convert.write(xkey, local_convert_content)
+        pages = [(key, self.change_list.get_item(key)) for key in self.list_rebuild_keys(self.cache_extract)]
+        self.rebuild_stage("convert", self.cache_extract, self.cache_convert, pages, rerun, incremental)
 
-    def _main_loop(self, source: UrlSource, change_list: ChangeList) -> Dict[str, str]:
+    def _main_loop(self, sources: List[UrlSource]) -> Dict[str, str]:
 
-        def remove_duplicate_if_exists(location: str, source: str, other_state: str):
+        def remove_duplicate_if_exists(ws: Workspace, location: str, source: str, other_state: str):
             key = location + ".html"
 
-            self.cache_raw.remove(key)
-            self.cache_clean.remove(key)
-            change_list.record_duplicate(key, source, f"duplicate of {other_state}")
+            ws.cache_raw.remove(key)
+            ws.cache_clean.remove(key)
+            ws.manifests["clean"].remove(key)
+            ws.http_validators.remove(key)
+            ws.raw_fingerprints.remove(key)
+            ws.change_list.record_duplicate(key, source, f"duplicate of {other_state}")
 
             if self.config.capture_image:
                 c = self.get_capture()
                 c.remove(location)
 
 
-        def fetch_if_changed(location: str, source: str, xurl: str, skip: bool = False) -> bool:
+        def should_fetch(ws: Workspace, location: str, source: str, xurl: str, skip: bool = False) -> bool:
 
             key = location + ".html"
 
             if xurl == "" or xurl == None or xurl == "None": 
-                change_list.record_skip(key, source, xurl, "missing url")
-                return
+                ws.change_list.record_skip(key, source, xurl, "missing url")
+                return False
 
-            mins = change_list.get_minutes_since_last_check(key)
+            mins = ws.change_list.get_minutes_since_last_check(key)
             if self.config.trace: logger.info(f"  checked {key} {mins:.1f} minutes ago")
-            if mins < 15.0: 
+            is_due, reason = ws.scheduler.is_due(key, ws.change_list.get_item(key), ws.change_list.start_date)
+            if not is_due: 
                 if self.config.rerun_now:
-                    logger.info(f"{key}: checked {mins:.1f} mins ago")
+                    logger.info(f"{key}: checked {mins:.1f} mins ago ({reason})")
                 else:
-                    logger.info(f"{key}: checked {mins:.1f} mins ago -> skip b/c < 15 mins")
-                    change_list.temporary_skip(key, source, xurl, "age < 15 mins")
+                    logger.info(f"{key}: checked {mins:.1f} mins ago -> skip b/c not due ({reason})")
+                    ws.change_list.temporary_skip(key, source, xurl, f"not due ({reason})")
                     return False
 
             if skip:
-                change_list.record_skip(key, source, xurl, "skip flag set")
+                ws.change_list.record_skip(key, source, xurl, "skip flag set")
+                return False
+
+            return True
+
+        def make_task(ws: Workspace, key: str, location: str, source: str, xurl: str) -> FetchTask:
+
+            task = FetchTask(key, location, source, xurl)
+            task.context = ws
+
+            # conditional GET only works with requests and
+            # only makes sense if we have the clean version
+            if self.url_manager.browser == "requests":
+                task.cache_info = {}
+                x = ws.http_validators.get(key)
+                if x != None and x.get("url") == xurl and ws.cache_clean.exists(key):
+                    task.cache_info.update(x)
+            return task
+
+        def fetch_page(task: FetchTask) -> Tuple[bytes, int]:
+            if self.config.trace: logger.info(f"fetch {task.url}")
+            return self.url_manager.fetch(task.url, task.cache_info)
+
+        def save_validators(ws: Workspace, task: FetchTask):
+            info = task.cache_info
+            if info == None: return
+
+            if info.get("etag") == None and info.get("last_modified") == None:
+                ws.http_validators.remove(task.key)
+            else:
+                x = { n: info[n] for n in ["etag", "last_modified"] if info.get(n) != None }
+                x["url"] = task.url
+                ws.http_validators.set(task.key, x)
+
+        def save_fingerprint(ws: Workspace, key: str, fingerprint: str, stored_content: bytes):
+            x = ws.raw_fingerprints.get(key)
+            if stored_content != None:
+                stored = content_hash(stored_content)
+            elif x != None:
+                stored = x.get("stored")
+            else:
+                stored = content_hash(ws.cache_raw.read(key))
+            ws.raw_fingerprints.set(key, { "raw": fingerprint, "stored": stored })
+
+        def update_host_health(task: FetchTask):
+            if is_host_failure(task.status, task.error):
+                reason = str(task.error) if task.error != None else f"HTTP status {task.status}"
+                self.host_health.record_failure(task.host, reason)
+            else:
+                self.host_health.record_success(task.host)
+
+        def record_built(ws: Workspace, stage: str, key: str, item: ChangeItem, input_content: bytes):
+            " so the offline rebuild knows the page is current "
+            ws.manifests[stage].record(key, content_hash(input_content), self.page_version(stage, key, item))
+
+        def process_if_changed(ws: Workspace, task: FetchTask, timer: StageTimer) -> bool:
+
+            key, location, source, xurl = task.key, task.location, task.source, task.url
+            remote_raw_content, status = task.content, task.status
+
+            if status == 304:
+                ws.change_list.record_unchanged(key, source, xurl, "not modified")
+                return False
+
+            info = task.cache_info if task.cache_info != None else {}
+            if info.get("fetch_error") != None:
+                ws.change_list.record_failed(key, source, xurl, info["fetch_error"])
                 return False
 
-            if self.config.trace: logger.info(f"fetch {xurl}")
-            remote_raw_content, status = self.url_manager.fetch(xurl)
-            
             is_bad, msg = is_bad_content(remote_raw_content)
             if is_bad:
-                change_list.record_failed(key, source, xurl, msg)
+                ws.change_list.record_failed(key, source, xurl, msg)
                 return False
 
             if status > 300:
-                change_list.record_failed(location, source, xurl, f"HTTP status {status}")
+                ws.change_list.record_failed(key, source, xurl, f"HTTP status {status}")
                 return False
 
-            remote_raw_content = remote_raw_content.replace(b"\r", b"")
+            # requests strips CRs and hashes while downloading
+            fingerprint = info.get("content_hash")
+            if fingerprint == None:
+                with timer.stage("hash"):
+                    remote_raw_content = remote_raw_content.replace(b"\r", b"")
+                    fingerprint = content_hash(remote_raw_content)
+
+            # same bytes as last time -> skip the format/clean
+            x = ws.raw_fingerprints.get(key)
+            if x != None and x.get("raw") == fingerprint and ws.cache_clean.exists(key):
+                ws.change_list.record_unchanged(key, source, xurl, "same content")
+                save_validators(ws, task)
+                return False
 
-            formater = HtmlFormater()
-            remote_raw_content = formater.format(xurl, remote_raw_content)
+            page = PageTransform(xurl, self.cleaner_rules.for_page(key, xurl), self.config.cleaner_backend)
+            with timer.stage("format"):
+                remote_raw_content = page.format(remote_raw_content)
 
-            local_clean_content =  self.cache_clean.read(key)
-            cleaner = HtmlCleaner()
-            remote_clean_content = cleaner.clean(remote_raw_content)
+            with timer.stage("read"):
+                local_clean_content =  ws.cache_clean.read(key)
+            with timer.stage("clean"):
+                remote_clean_content = page.clean()
 
             if local_clean_content != remote_clean_content:
 
-                self.cache_raw.write(key, remote_raw_content)
-                self.cache_clean.write(key, remote_clean_content)
-                change_list.record_changed(key, source, xurl)
-
-                item = change_list.get_item(key)
-
-                formatter = HtmlFormater()
-                remote_raw_content = formatter.format(xurl, remote_raw_content)
+                with timer.stage("write"):
+                    ws.cache_raw.write(key, remote_raw_content)
+                    ws.cache_clean.write(key, remote_clean_content)
+                save_fingerprint(ws, key, fingerprint, remote_raw_content)
+                ws.change_list.record_changed(key, source, xurl)
+
+                item = ws.change_list.get_item(key)
+                record_built(ws, "clean", key, item, remote_raw_content)
+
+                # before extract, it changes the tree
+                with timer.stage("diff"):
+                    diff = page.diff(local_clean_content)
+                diff_key = key.replace(".html", ".json")
+                if diff != None:
+                    item.diff = diff.summary()
+                    x = diff.to_dict()
+                    x["key"] = key
+                    x["at"] = udatetime.now_as_utc()
+                    with timer.stage("write"):
+                        ws.cache_diff.write(diff_key, json.dumps(convert_python_to_json(x), indent=2).encode())
+                else:
+                    ws.cache_diff.remove(diff_key)
+
+                if self.config.incremental_extract:
+                    hash_key = key.replace(".html", ".json")
+                    with timer.stage("read"):
+                        local_extract_content = ws.cache_extract.read(key)
+                        local_index = ws.cache_hash.read(hash_key)
+                    with timer.stage("extract"):
+                        remote_extract_content = page.extract_indexed(item, local_index, local_extract_content)
+                    with timer.stage("write"):
+                        ws.cache_extract.write(key, remote_extract_content)
+                        if page.subtree_index != None:
+                            ws.cache_hash.write(hash_key, page.subtree_index.to_bytes())
+                        else:
+                            ws.cache_hash.remove(hash_key)
+                    if page.changed != None and len(page.changed) > 0:
+                        more = " ..." if len(page.changed) > 5 else ""
+                        logger.info(f"  changed {key}: {' '.join(page.changed[:5])}{more}")
+                else:
+                    local_extract_content = None
+                    with timer.stage("extract"):
+                        remote_extract_content = page.extract(item)
+                    with timer.stage("write"):
+                        ws.cache_extract.write(key, remote_extract_content)
+                record_built(ws, "extract", key, item, remote_clean_content)
 
-                extracter = HtmlExtracter()
-                remote_extract_content = extracter.extract(remote_clean_content, item)
-                self.cache_extract.write(key, remote_extract_content)
+                # the converter only reads the extract
+                if local_extract_content == None or local_extract_content != remote_extract_content \
+                        or not ws.cache_convert.exists(key):
+                    with timer.stage("convert"):
+                        remote_convert_content = page.convert(key, item)
+                    with timer.stage("write"):
+                        ws.cache_convert.write(key, remote_convert_content)
+                    record_built(ws, "convert", key, item, remote_extract_content)
 
-                converter = HtmlConverter()
-                remote_convert_content = converter.convert(key, remote_extract_content, item)
-                self.cache_convert.write(key, remote_convert_content)
 
+                save_validators(ws, task)
 
                 if self.config.capture_image:
-                    c = self.get_capture()
-                    c.screenshot(key, f"Screenshot for {location}", xurl)
+                    with timer.stage("screenshot"):
+                        c = self.get_capture()
+                        c.screenshot(key, f"Screenshot for {location}", xurl)
+                return True
             else:
-                change_list.record_unchanged(key, source, xurl)
+                ws.change_list.record_unchanged(key, source, xurl)
+                save_validators(ws, task)
+                save_fingerprint(ws, key, fingerprint, None)
                 return False
 
-        # -- get urls to hit
-        if source.status != "valid":
-            raise Exception(f"URL source {source.name} status is not valid")
+        # -- build one list of pages to fetch from all the sources
+        #      a key belongs to the first source that lists it
+        skip = False
+        tasks = []
+
+        # the fragment is a different page for a browser (hash-routed dashboards)
+        keep_fragment = self.url_manager.browser != "requests"
+
+        owners: Dict[Tuple[str, str], str] = {}
+        def claim(ws: Workspace, key: str, source: str) -> bool:
+            x = owners.get((ws.subfolder, key))
+            if x == None:
+                owners[(ws.subfolder, key)] = source
+                return True
+            if self.config.trace:
+                logger.info(f"  {key} from {source} -> skip b/c already listed by {x}")
+            return False
+
+        for src in sources:
+            ws = self.get_workspace(src.subfolder)
+            logger.info(f"  plan {src.name} ({src.df.shape[0]} locations) into {ws.cache_raw.work_dir}")
+
+            for idx, r in src.df.iterrows():
+                location = r["location"]
+                source = r["source_name"]
+                general_url = r["main_page"]
+                data_url = r["data_page"]
+
+                if general_url == None and data_url == None:
+                    logger.warning(f"  no urls for {location} -> skip")
+                    ws.change_list.record_skip(location)
+                    continue
 
-        df_config = source.df
-        if df_config is None:
-            raise Exception(f"URL source {source.name} does not have any data loaded")
+                if general_url != None and claim(ws, location + ".html", source):
+                    if should_fetch(ws, location, source, general_url, skip=skip):
+                        tasks.append(make_task(ws, location + ".html", location, source, general_url))
+
+                if data_url != None and claim(ws, location + "_data.html", source):
+                    if general_url == data_url or (general_url != None
+                            and canonical_url(general_url, keep_fragment) == canonical_url(data_url, keep_fragment)):
+                        remove_duplicate_if_exists(ws, location + "_data", source, location)
+                    elif should_fetch(ws, location + "_data", source, data_url, skip=skip):
+                        tasks.append(make_task(ws, location + "_data.html", location, source, data_url))
+
+        # -- fetch each page once, even if several keys list it
+        tasks, saved_cnt = merge_duplicate_urls(tasks, keep_fragment)
+        if saved_cnt > 0:
+            logger.info(f"  dedup saved {saved_cnt} fetches")
+        metrics.fetches_saved.inc(saved_cnt)
+        for ws in self.workspaces.values():
+            if ws.change_list != None: ws.change_list.record_run_stat("Fetches Saved by Dedup", saved_cnt)
+
+        # -- fetch pages 
+        #      results come back in the order they complete, 
+        #      all processing happens on this thread
+        if self.url_manager.browser == "requests":
+            engine = FetchEngine(self.config.max_workers, self.config.max_per_host, trace=self.config.trace)
+        else:
+            # one fetch per captive browser
+            engine = FetchEngine(self.config.browser_count, self.config.max_per_host, trace=self.config.trace)
 
-        # -- fetch pages
-        skip = False
+        cnt = 0
         err_cnt = 0
+        for task in engine.run(tasks, fetch_page, self.host_health.is_open):
+
+            cnt += 1
+            if cnt % 10 == 1: 
+                self.save_progress()
 
-        for idx, r in df_config.iterrows():
-            location = r["location"]
-            source = r["source_name"]
-            general_url = r["main_page"]
-            data_url = r["data_page"]
+            ws: Workspace = task.context
 
-            if general_url == None and data_url == None:
-                logger.warning(f"  no urls for {location} -> skip")
-                change_list.record_skip(location)
+            if task.skipped:
+                failures, open_until = self.host_health.get_status(task.host)
+                ws.change_list.record_circuit_open(task.key, task.source, task.url, 
+                    f"{task.host} failed {failures} times, retry after {open_until}")
                 continue
 
-            if idx % 10 == 1: change_list.save_progress()
-
-            if general_url != None:
-                try:
-                    fetch_if_changed(location, source, general_url, skip=skip)
-                except Exception as ex:
-                    err_cnt += 1
-                    if err_cnt > 10: break
-                    change_list.record_failed(location, source, general_url, "Exception in code")
-                    logger.exception(ex)
-                    logger.error("    error -> continue to next page")
-
-            if data_url != None:
-                if general_url == data_url:
-                    remove_duplicate_if_exists(location + "_data", source, location)
-                else:
-                    try:
-                        fetch_if_changed(location + "_data", source, data_url, skip=skip)
-                    except Exception as ex:
-                        err_cnt += 1
-                        if err_cnt > 10: break
-                        change_list.record_failed(location, source, general_url, "Exception in code")
-                        logger.exception(ex)
-                        logger.error("    error -> continue to next page")
+            timer = StageTimer()
+            if task.primary == None:
+                timer.add("fetch", task.wall_secs, task.cpu_secs)
+
+                metrics.fetch_seconds.observe(task.wall_secs, host=task.host)
+                metrics.fetch_responses.inc(host=task.host, status=task.status if task.error == None else "error")
+                if task.content != None: metrics.fetch_bytes.inc(len(task.content), host=task.host)
+
+                # fetch errors are the host's problem, they don't count towards aborting the run
+                update_host_health(task)
+            if task.error != None:
+                ws.change_list.record_failed(task.key, task.source, task.url, f"fetch failed: {task.error}")
+                ws.change_list.record_timings(task.key, timer.to_dict())
+                task.release()
+                continue
+
+            try:
+                process_if_changed(ws, task, timer)
+                ws.scheduler.record(ws.change_list.get_item(task.key))
+            except Exception as ex:
+                err_cnt += 1
+                if err_cnt > 10: break
+                ws.change_list.record_failed(task.key, task.source, task.url, "Exception in code")
+                logger.exception(ex)
+                logger.error("    error -> continue to next page")
+            ws.change_list.record_timings(task.key, timer.to_dict())
+
+            # tasks is kept until the end of the run, the pages are not
+            task.release()
 
         if err_cnt > 10:
             logger.error(f"  abort run due to {err_cnt} errors")        
 
-        change_list.write_html_to_cache(self.cache_raw, "RAW")
-        change_list.write_html_to_cache(self.cache_clean, "CLEAN")
-        change_list.write_html_to_cache(self.cache_extract, "EXTRACT")
+        for ws in self.workspaces.values():
+            if ws.change_list == None: continue
+            ws.change_list.write_html_to_cache(ws.cache_raw, "RAW")
+            ws.change_list.write_html_to_cache(ws.cache_clean, "CLEAN")
+            ws.change_list.write_html_to_cache(ws.cache_extract, "EXTRACT")
@@ -21,11 +21,13 @@ from loguru import logger
 from typing import List, Dict, Tuple
 
 from data_pipeline import DataPipeline, DataPipelineConfig
+from transform.cleaner_backends import CLEANER_BACKENDS
 from specialized_capture import SpecializedCapture, special_cases
 
 from shared.util import get_host, read_config_file
 from shared import udatetime
 from shared import util_git
+from shared import metrics
 
 # ----------------------
 def load_args(config):
@@ -66,9 +68,45 @@ def load_args(config):
     parser.add_argument('--chrome', dest='use_chrome', action='store_true', default=False,
         help='capture using chrome')
 
+    parser.add_argument('--browsers', dest='browser_count', type=int, default=2,
+        help='number of captive browsers to run at the same time')
+
+    parser.add_argument('--cache_mb', dest='max_memory_mb', type=float, default=64.0,
+        help='MBs of fetched pages to keep in memory during a run (the rest spill to temp_dir)')
+
     parser.add_argument('--show_browser', dest='show_browser', action='store_true', default=False,
         help='show browser while running')
 
+    parser.add_argument('--workers', dest='max_workers', type=int, default=8,
+        help='number of pages to fetch at the same time')
+    parser.add_argument('--max_per_host', dest='max_per_host', type=int, default=2,
+        help='number of pages to fetch at the same time from one host')
+
+    parser.add_argument('--timeout', dest='timeout', type=int, default=30,
+        help='http timeout in seconds')
+    parser.add_argument('--max_size', dest='max_size_mb', type=float, default=20.0,
+        help='MBs, larger pages are abandoned while downloading')
+    parser.add_argument('--retries', dest='retries', type=int, default=2,
+        help='http retries for connection errors and 502/503/504')
+
+    parser.add_argument('--metrics_port', dest='metrics_port', type=int, default=0,
+        help='serve Prometheus metrics on this local port (0 = off)')
+    parser.add_argument('--metrics_file', dest='metrics_file', default=None,
+        help='write Prometheus metrics to this file after each run (for the textfile collector)')
+
+    parser.add_argument('--cleaner', dest='cleaner_backend', choices=list(CLEANER_BACKENDS.keys()),
+        default=config.get("CLEANER", "backend", fallback="python"),
+        help='html cleaner implementation (default from [CLEANER] backend in the .ini file)')
+    parser.add_argument('--incremental', dest='incremental_extract', action='store_true',
+        default=config.getboolean("EXTRACT", "incremental", fallback=False),
+        help='only extract the changed subtrees of a changed page (default from [EXTRACT] incremental in the .ini file)')
+
+    parser.add_argument('--force', dest='force', action='store_true', default=False,
+        help='with -c/-x/-j, rebuild every page instead of the out of date ones')
+    parser.add_argument('--jobs', dest='jobs', type=int,
+        default=config.getint("REBUILD", "jobs", fallback=1),
+        help='processes for the offline format/clean/extract/convert, 0 = one per cpu (default from [REBUILD] jobs in the .ini file)')
+
     parser.add_argument('-i', '--image', dest='capture_image', action='store_true', default=False,
         help='capture image after each change')
 
@@ -102,11 +140,22 @@ def next_time() -> datetime:
     t = datetime(t.year, t.month, t.day, t.hour, xmin, 0)
     return t
 
-def init_specialized_capture(args: Namespace) -> SpecializedCapture:
-    " prepare for specialized 'one-off' image captures "
+def next_run_time(scanner: DataPipeline) -> datetime:
+    " next scheduled run, earlier if a location is due before then "
+    t = next_time()
+
+    t_due = scanner.next_due_time()
+    if t_due != None:
+        t_due = t_due.astimezone().replace(tzinfo=None)
+        t_min = datetime.now() + timedelta(minutes=10)
+        if t_due < t: t = max(t_due, t_min)
+    return t
+
+def init_specialized_capture(args: Namespace, scanner: DataPipeline) -> SpecializedCapture:
+    " prepare for specialized 'one-off' image captures (shares the scanner's browsers) "
     temp_dir = args.temp_dir
     publish_dir = os.path.join(args.base_dir, "captive-browser")
-    capture = SpecializedCapture(temp_dir, publish_dir)
+    capture = SpecializedCapture(temp_dir, publish_dir, scanner.url_manager.get_pool())
     return capture
 
 def do_specialized_capture(capture: SpecializedCapture):
@@ -115,9 +164,28 @@ def do_specialized_capture(capture: SpecializedCapture):
     except Exception as ex:
         logger.error(ex)
         logger.error("*** continue after exception in specialized capture")
+    finally:
+        # give the browser back to the pool
+        capture.close()
+
+
+def push_changes(scanner: DataPipeline, msg: str):
+    " push to the git repo "
+    start = time.perf_counter()
+    try:
+        util_git.push(scanner.config.base_dir, msg)
+    finally:
+        metrics.git_push_seconds.observe(time.perf_counter() - start)
+
+def write_metrics(metrics_file: str):
+    if metrics_file == None: return
+    try:
+        metrics.registry.write_textfile(metrics_file)
+    except Exception as ex:
+        logger.error(f"could not write metrics to {metrics_file}: {ex}")
 
 
-def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push: bool):
+def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push: bool, metrics_file: str = None):
     " run in continuous mode twice an hour "
 
     # check for new source code (return if found so watchdog can reload the main loop)
@@ -140,13 +208,14 @@ def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push
         if capture: do_specialized_capture(capture)
 
         # push to the git repo
-        if auto_push: util_git.push(scanner.config.base_dir, f"{udatetime.to_logformat(scanner.change_list.start_date)} on {host}")
+        if auto_push: push_changes(scanner, f"{udatetime.to_logformat(scanner.change_list.start_date)} on {host}")
+        write_metrics(metrics_file)
 
         # check for new source again
         if util_git.monitor_check(): return
 
         cnt = 1
-        t = next_time()
+        t = next_run_time(scanner)
 
         # run twice per hour forever
         #    on error, rety twice before going back to sleep until next cycle
@@ -154,6 +223,7 @@ def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push
         while True:
             time.sleep(15)
             if datetime.now() < t: continue
+            metrics.sleep_drift_seconds.observe((datetime.now() - t).total_seconds())
 
             if util_git.monitor_check(): break
 
@@ -166,9 +236,10 @@ def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push
                 scanner.update_sources()
                 scanner.process()
                 if capture: do_specialized_capture(capture)
-                if auto_push: util_git.push(scanner.config.base_dir, f"{udatetime.to_displayformat(scanner.change_list.start_date)} on {host}")
+                if auto_push: push_changes(scanner, f"{udatetime.to_displayformat(scanner.change_list.start_date)} on {host}")
             except Exception as ex:
                 logger.exception(ex)
+                write_metrics(metrics_file)
                 
                 if retry_cnt < 2:
                     print(f"run failed, wait 5 minutes and try again")
@@ -176,16 +247,18 @@ def run_continuous(scanner: DataPipeline, capture: SpecializedCapture, auto_push
                     retry_cnt += 1
                 continue
 
+            write_metrics(metrics_file)
+
             print("==================================")
             print("")
-            t = next_time()
+            t = next_run_time(scanner)
             print(f"sleep until {t}")                        
             cnt += 1
     finally:
         if capture: capture.close()
 
 
-def run_once(scanner: DataPipeline, capture: SpecializedCapture, auto_push: bool):
+def run_once(scanner: DataPipeline, capture: SpecializedCapture, auto_push: bool, metrics_file: str = None):
     " run the scanner once "
     scanner.update_sources()
     scanner.process()
@@ -194,7 +267,8 @@ def run_once(scanner: DataPipeline, capture: SpecializedCapture, auto_push: bool
 
     if auto_push:
         host = get_host()
-        util_git.push(scanner.config.base_dir, f"{udatetime.to_logformat(scanner.change_list.start_date)} on {host}")
+        push_changes(scanner, f"{udatetime.to_logformat(scanner.change_list.start_date)} on {host}")
+    write_metrics(metrics_file)
 
 
 def main(args_list=None):
@@ -221,26 +295,38 @@ def main(args_list=None):
         "firefox": args.use_firefox,
         "chrome": args.use_chrome,
         "headless": not args.show_browser,
+        "max_workers": args.max_workers,
+        "max_per_host": args.max_per_host,
+        "timeout": args.timeout,
+        "retries": args.retries,
+        "max_size_mb": args.max_size_mb,
+        "browser_count": args.browser_count,
+        "max_memory_mb": args.max_memory_mb,
+        "cleaner_backend": args.cleaner_backend,
+        "incremental_extract": args.incremental_extract,
+        "jobs": args.jobs,
     })
 
     scanner = DataPipeline(config)
-    capture = init_specialized_capture(args)
+    capture = init_specialized_capture(args, scanner)
+
+    if args.metrics_port: metrics.registry.start_server(args.metrics_port)
 
     if args.clean_html or args.extract_html or args.format_html or args.convert_to_json:
         if args.format_html: scanner.format_html(rerun=True)
-        if args.clean_html: scanner.clean_html(rerun=True)
-        if args.extract_html: scanner.extract_html(rerun=True)
-        if args.convert_to_json: scanner.convert_to_json(rerun=True)
+        if args.clean_html: scanner.clean_html(rerun=args.force, incremental=True)
+        if args.extract_html: scanner.extract_html(rerun=args.force, incremental=True)
+        if args.convert_to_json: scanner.convert_to_json(rerun=args.force, incremental=True)
     elif args.continuous:
         scanner.format_html()
         scanner.clean_html()
         scanner.extract_html()
-        run_continuous(scanner, capture, auto_push = args.auto_push)  
+        run_continuous(scanner, capture, auto_push = args.auto_push, metrics_file = args.metrics_file)  
     else:        
         scanner.format_html()
         scanner.clean_html()
         scanner.extract_html()
-        run_once(scanner, capture, auto_push = args.auto_push)
+        run_once(scanner, capture, auto_push = args.auto_push, metrics_file = args.metrics_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,75 @@
+#
+# ContentLru
+#
+#   holds page bodies in memory up to a byte budget.
+#
+#   the least recently used bodies are spilled to a DirectoryCache when the
+#   budget is exceeded and read back from disk when they are needed again.
+#
+
+from typing import Union
+from loguru import logger
+from collections import OrderedDict
+import threading
+
+from shared.directory_cache import DirectoryCache
+
+
+class ContentLru:
+    """ byte-budgeted LRU of content with disk spill """
+
+    def __init__(self, max_bytes: int, spill: DirectoryCache):
+        self.max_bytes = max_bytes
+        self.spill = spill
+
+        self.size = 0
+        self.peak_size = 0
+        self.spill_cnt = 0
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _spill_key(self, key: str) -> str:
+        return key + ".bin"
+
+    def put(self, key: str, content: bytes):
+        " add content, spills older content if over budget "
+        if content == None: return
+
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return
+
+            self._items[key] = content
+            self.size += len(content)
+            if self.size > self.peak_size: self.peak_size = self.size
+
+            # always keep the newest item, even if it is over budget by itself.
+            # spill while holding the lock so a get never misses it
+            while self.size > self.max_bytes and len(self._items) > 1:
+                k, v = self._items.popitem(last=False)
+                self.size -= len(v)
+                self.spill.write(self._spill_key(k), v)
+                self.spill_cnt += 1
+
+    def get(self, key: str) -> Union[bytes, None]:
+        " get content, reads it back from disk if it was spilled "
+        with self._lock:
+            content = self._items.get(key)
+            if content != None:
+                self._items.move_to_end(key)
+                return content
+
+        content = self.spill.read(self._spill_key(key))
+        if content == None:
+            logger.warning(f"  content {key} is missing from the spill cache")
+        return content
+
+    def reset(self):
+        with self._lock:
+            self._items = OrderedDict()
+            self.size = 0
+            self.peak_size = 0
+            self.spill_cnt = 0
+        self.spill.reset()
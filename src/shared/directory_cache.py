@@ -8,7 +8,7 @@ from datetime import datetime, timezone
 from loguru import logger
 import pytz
 
-from typing import Union, List, Tuple, Dict
+from typing import Union, List, Tuple, Dict, BinaryIO, Callable
 #import subprocess
 
 from shared import udatetime
@@ -169,6 +169,28 @@ class DirectoryCache:
         with open(xpath, "wb") as f:
             f.write(content)
 
+    def open_read(self, key: str) -> Union[BinaryIO, None]:
+        " open a cached file for reading in chunks, None if it doesn't exist "
+
+        xpath = os.path.join(self.work_dir, self.encode_key(key))
+        if not os.path.isfile(xpath): return None
+        if self.trace: logger.debug(f"open {xpath}")
+        return open(xpath, "rb")
+
+    def write_stream(self, key: str, writer: Callable[[BinaryIO], bool]):
+        " write a file through writer(f), the old file is kept if writer returns False "
+
+        xpath = os.path.join(self.work_dir, self.encode_key(key))
+        xpath_tmp = xpath + ".tmp"
+
+        if self.trace: logger.debug(f"write {xpath}")
+        with open(xpath_tmp, "wb") as f:
+            ok = writer(f)
+        if ok:
+            os.replace(xpath_tmp, xpath)
+        else:
+            os.remove(xpath_tmp)
+
     def remove(self, key: str):
 
         file_name = self.encode_key(key)
@@ -0,0 +1,83 @@
+#
+# JsonStore
+#
+#   a small persistent key/value store kept as a json file
+#   in a cache directory (next to change_list.json).
+#
+#   writes go to a temp file that is renamed into place so a
+#   restart never sees a half-written file.
+#
+
+import os
+import json
+from loguru import logger
+from typing import Dict, List, Union
+
+from shared.directory_cache import DirectoryCache
+
+
+class JsonStore:
+    """ per-key values that survive restarts """
+
+    def __init__(self, cache: DirectoryCache, name: str):
+        self.cache = cache
+        self.name = name
+
+        self._is_loaded = False
+        self._is_dirty = False
+        self._items: Dict[str, Union[Dict, List, str, int, float]] = {}
+
+    def _path(self) -> str:
+        return os.path.join(self.cache.work_dir, self.name)
+
+    def load(self):
+        if self._is_loaded: return
+        self._is_loaded = True
+
+        fn = self._path()
+        self._items = {}
+        if not os.path.exists(fn): return
+
+        try:
+            with open(fn, "r") as f:
+                self._items = json.load(f)
+        except Exception as ex:
+            logger.error(f"could not load {fn}: {ex}")
+            self._items = {}
+
+    def save(self):
+        if not self._is_dirty: return
+
+        fn = self._path()
+        fn_temp = fn + ".tmp"
+        with open(fn_temp, "w") as f:
+            json.dump(self._items, f, indent=2, sort_keys=True)
+        if os.path.exists(fn): os.remove(fn)
+        os.rename(fn_temp, fn)
+        self._is_dirty = False
+
+    def get(self, key: str):
+        self.load()
+        return self._items.get(key)
+
+    def set(self, key: str, val):
+        self.load()
+        if self._items.get(key) == val: return
+        self._items[key] = val
+        self._is_dirty = True
+
+    def remove(self, key: str):
+        self.load()
+        if not key in self._items: return
+        del self._items[key]
+        self._is_dirty = True
+
+    def keys(self) -> List[str]:
+        self.load()
+        return list(self._items.keys())
+
+    def clear(self):
+        self.load()
+        if len(self._items) == 0: return
+        self._items = {}
+        self._is_dirty = True
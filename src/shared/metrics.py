@@ -0,0 +1,222 @@
+#
+# metrics
+#
+#   counters, gauges and histograms for monitoring the scanner,
+#   exposed in the Prometheus text format.
+#
+#   the metrics can be served on a local port (/metrics) and/or written
+#   to a file for the node_exporter textfile collector.
+#
+#   all updates are thread-safe.
+#
+
+from typing import Dict, List, Tuple
+from loguru import logger
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import math
+import os
+
+# seconds
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(x: float) -> str:
+    if x == math.inf: return "+Inf"
+    if x == -math.inf: return "-Inf"
+    if x == int(x): return str(int(x))
+    return repr(x)
+
+def _format_labels(names: Tuple[str], values: Tuple[str], extra: Tuple[str, str] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra != None: pairs.append(extra)
+    if len(pairs) == 0: return ""
+    s = ",".join(f'{n}="{_escape(v)}"' for n, v in pairs)
+    return "{" + s + "}"
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metric:
+    """ base class, one value (or histogram) per combination of label values """
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str]:
+        if len(labels) != len(self.labels) or any(not n in labels for n in self.labels):
+            raise Exception(f"{self.name} expects labels {self.labels}, got {list(labels.keys())}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key in sorted(self._values):
+                lines.extend(self._render_value(key, self._values[key]))
+        return lines
+
+    def _render_value(self, key: Tuple[str], val) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(val)}"]
+
+
+class Counter(Metric):
+    """ a value that only goes up """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0: raise Exception(f"counter {self.name} cannot go down")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """ a value that can go up and down """
+
+    kind = "gauge"
+
+    def set(self, val: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(val)
+
+
+class Histogram(Metric):
+    """ counts observations in buckets """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str] = (), buckets: Tuple[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, val: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            x = self._values.get(key)
+            if x == None:
+                x = { "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0 }
+                self._values[key] = x
+            for i, b in enumerate(self.buckets):
+                if val <= b:
+                    x["counts"][i] += 1
+                    break
+            x["sum"] += val
+            x["count"] += 1
+
+    def _render_value(self, key: Tuple[str], val) -> List[str]:
+        lines = []
+        total = 0
+        for b, cnt in zip(self.buckets, val["counts"]):
+            total += cnt
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', _format_value(b)))} {total}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(val['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {val['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """ the set of metrics to expose """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, m: Metric) -> Metric:
+        with self._lock:
+            x = self._metrics.get(m.name)
+            if x != None: return x
+            self._metrics[m.name] = m
+            return m
+
+    def counter(self, name: str, help: str, labels: Tuple[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str] = (), buckets: Tuple[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        " all metrics in the Prometheus text format "
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        " write the metrics for the textfile collector (atomically) "
+        fn_temp = path + ".tmp"
+        with open(fn_temp, "w") as f:
+            f.write(self.render())
+        os.replace(fn_temp, path)
+
+    def start_server(self, port: int, addr: str = "127.0.0.1") -> ThreadingHTTPServer:
+        " serve /metrics on a background thread "
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((addr, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"serving metrics on http://{addr}:{server.server_port}/metrics")
+        return server
+
+
+registry = MetricsRegistry()
+
+# -- scanner metrics
+
+fetch_seconds = registry.histogram("scanner_fetch_seconds",
+    "time to fetch a page", ("host",))
+fetch_bytes = registry.counter("scanner_fetch_bytes_total",
+    "bytes downloaded", ("host",))
+fetch_responses = registry.counter("scanner_fetch_responses_total",
+    "fetches by http status (999 = timeout or connection error)", ("host", "status"))
+
+fetches_saved = registry.counter("scanner_fetches_saved_total",
+    "fetches skipped because another key lists the same page")
+pages = registry.counter("scanner_pages_total",
+    "pages processed by result (CHANGED, unchanged, FAILED, ...)", ("status",))
+
+content_cache_bytes = registry.gauge("scanner_content_cache_bytes",
+    "bytes of fetched pages held in memory at the end of the last run")
+content_cache_peak_bytes = registry.gauge("scanner_content_cache_peak_bytes",
+    "most bytes of fetched pages held in memory during the last run")
+content_cache_spilled = registry.counter("scanner_content_cache_spilled_total",
+    "fetched pages spilled to disk")
+
+runs = registry.counter("scanner_runs_total",
+    "runs by result (ok, error)", ("result",))
+run_seconds = registry.histogram("scanner_run_seconds",
+    "duration of a run", buckets=(30, 60, 120, 300, 600, 900, 1200, 1800, 3600))
+last_run_timestamp = registry.gauge("scanner_last_run_timestamp_seconds",
+    "unix time the last run finished")
+
+sleep_drift_seconds = registry.histogram("scanner_sleep_drift_seconds",
+    "how late a run started compared to its scheduled time", buckets=(1, 5, 15, 30, 60, 120, 300, 900))
+git_push_seconds = registry.histogram("scanner_git_push_seconds",
+    "time to push to the git repo", buckets=(1, 2.5, 5, 10, 30, 60, 120, 300))
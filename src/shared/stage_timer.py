@@ -0,0 +1,96 @@
+#
+# StageTimer
+#
+#   wall and cpu time per processing stage of one page
+#   (fetch, format, clean, write, ...).
+#
+#   cpu time is for the current thread so work done on other
+#   threads at the same time is not counted.
+#
+#   summarize_timings rolls the timings of a run up into
+#   percentiles per stage for metrics.json
+#
+
+from typing import Dict, List, Tuple
+from contextlib import contextmanager
+import time
+
+# number of slowest keys to list per stage
+OUTLIER_COUNT = 5
+
+
+class StageTimer:
+    """ accumulates timings per stage """
+
+    __slots__ = ("stages")
+
+    def __init__(self):
+        # name -> [wall secs, cpu secs]
+        self.stages: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        " time a block of code "
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add(self, name: str, wall_secs: float, cpu_secs: float):
+        " add time measured elsewhere (e.g. on another thread) "
+        if wall_secs == None: return
+        x = self.stages.get(name)
+        if x == None:
+            self.stages[name] = [wall_secs, cpu_secs if cpu_secs != None else 0.0]
+        else:
+            x[0] += wall_secs
+            if cpu_secs != None: x[1] += cpu_secs
+
+    def to_dict(self) -> Dict:
+        " {stage: {wall, cpu}} in seconds "
+        return { n: { "wall": round(v[0], 4), "cpu": round(v[1], 4) } for n, v in self.stages.items() }
+
+
+def _percentile(vals: List[float], pct: float) -> float:
+    " nearest-rank percentile of sorted values "
+    if len(vals) == 0: return None
+    idx = int(round(pct / 100.0 * (len(vals) - 1)))
+    return vals[idx]
+
+def _describe(vals: List[float]) -> Dict:
+    vals = sorted(vals)
+    return {
+        "p50": _percentile(vals, 50),
+        "p95": _percentile(vals, 95),
+        "max": vals[-1],
+        "total": round(sum(vals), 4),
+    }
+
+def summarize_timings(timings: List[Tuple[str, Dict]]) -> Dict:
+    """ roll up (key, StageTimer.to_dict()) pairs into per-stage statistics
+
+    a "total" stage is added with the sum of all the stages of each key.
+    """
+
+    by_stage: Dict[str, List[Tuple[str, float, float]]] = {}
+    for key, stages in timings:
+        if stages == None or len(stages) == 0: continue
+        wall, cpu = 0.0, 0.0
+        for n, v in stages.items():
+            by_stage.setdefault(n, []).append((key, v["wall"], v["cpu"]))
+            wall += v["wall"]
+            cpu += v["cpu"]
+        by_stage.setdefault("total", []).append((key, round(wall, 4), round(cpu, 4)))
+
+    result = {}
+    for n, items in by_stage.items():
+        slowest = sorted(items, key=lambda x: x[1], reverse=True)[:OUTLIER_COUNT]
+        result[n] = {
+            "count": len(items),
+            "wall": _describe([x[1] for x in items]),
+            "cpu": _describe([x[2] for x in items]),
+            "slowest": [ { "name": x[0], "wall": x[1] } for x in slowest ],
+        }
+    return result
@@ -7,27 +7,191 @@ from typing import Tuple, List, Dict, Callable
 from datetime import datetime
 from requests.packages import urllib3
 import configparser
+import hashlib
+import threading
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from shared import udatetime
 
 urllib3.disable_warnings() 
 
-def fetch_with_requests(page: str) -> [bytes, int]:
-    " check data using requests "
+# -----
+#   shared http session
+#
+#   one requests.Session for the whole process so connections (and the TLS
+#   handshakes) are reused across fetches.  the adapter keeps a pool per host.
+#
+
+session_config = {
+    "pool_connections": 32,     # number of hosts to keep pools for
+    "pool_maxsize": 4,          # connections per host
+    "timeout": 30,              # seconds
+    "retries": 2,               # connect/status retries (read timeouts are not retried)
+    "backoff": 0.5,             # seconds, doubles each retry
+    "max_size": 20000000,       # bytes, larger responses are abandoned
+    "chunk_size": 65536,        # bytes read at a time
+}
+
+# content that means the site blocked us, (marker, message)
+bad_content_markers = [
+    (b"Request unsuccessful. Incapsula incident", "Site uses Incapsula"),
+]
+# markers are only looked for in the start of a streamed response
+marker_window = 16384
+
+_session: requests.Session = None
+_session_lock = threading.Lock()
+
+def configure_session(**kwargs):
+    " change the shared session settings, the session is rebuilt on next use "
+    global _session
+
+    for n in kwargs:
+        if not n in session_config: raise Exception(f"Unknown session setting: {n}")
+        if kwargs[n] != None: session_config[n] = kwargs[n]
+
+    with _session_lock:
+        if _session != None: _session.close()
+        _session = None
+
+def get_session() -> requests.Session:
+    " get the shared session (thread-safe) "
+    global _session
+
+    with _session_lock:
+        if _session == None:
+            retry = Retry(
+                total=session_config["retries"],
+                connect=session_config["retries"],
+                read=0,
+                status=session_config["retries"],
+                status_forcelist=[502, 503, 504],
+                backoff_factor=session_config["backoff"],
+                raise_on_status=False,
+                respect_retry_after_header=False)
+            adapter = HTTPAdapter(
+                pool_connections=session_config["pool_connections"],
+                pool_maxsize=session_config["pool_maxsize"],
+                max_retries=retry)
+
+            session = requests.Session()
+            session.verify = False
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def fetch_with_requests(page: str, cache_info: Dict = None, strip_cr: bool = False) -> [bytes, int]:
+    """ check data using requests 
+
+    if cache_info is provided, its etag/last_modified values are sent as
+    If-None-Match/If-Modified-Since and it is updated from the response.
+    
+    the response is streamed so oversized or blocked responses are abandoned 
+    early.  if cache_info is provided, it also gets:
+        content_hash = content_hash() of the returned content
+        fetch_error = why the download was abandoned (None if it wasn't)
+
+    if strip_cr is set, carriage returns are removed while downloading.
+
+    returns None, 304 if the page has not been modified.
+    """
     try:
-        resp = requests.get(page, verify=False, timeout=30)
-        return resp.content, resp.status_code
+        headers = make_conditional_headers(cache_info)
+        with get_session().get(page, headers=headers, verify=False, 
+                timeout=session_config["timeout"], stream=True) as resp:
+            if cache_info != None:
+                update_cache_info(cache_info, resp.headers, resp.status_code == 304)
+            if resp.status_code == 304: return None, 304
+
+            content, xhash, msg = read_streamed_response(resp, strip_cr)
+            if msg != None:
+                logger.warning(f"  {page}: {msg}")
+            if cache_info != None:
+                cache_info["content_hash"] = xhash
+                cache_info["fetch_error"] = msg
+            return content, resp.status_code
     except Exception as ex:
         logger.error(f"Exception: {ex}")
         return None, 999
 
+def read_streamed_response(resp: requests.Response, strip_cr: bool) -> Tuple[bytes, str, str]:
+    """ read a response in chunks, returns content, content_hash, error message
+
+    stops as soon as the response is too big (content is None) 
+    or a bad content marker shows up (content is what was read so far).
+    """
+    max_size = session_config["max_size"]
+    too_big = f"Response is larger than {max_size * 1e-6:.1f} MBs"
+
+    n = resp.headers.get("Content-Length")
+    if max_size and n != None and n.isdigit() and int(n) > max_size:
+        return None, None, too_big
+
+    h = hashlib.blake2b(digest_size=16)
+    chunks = []
+    size = 0
+    head = b""
+    for chunk in resp.iter_content(chunk_size=session_config["chunk_size"]):
+        if strip_cr: chunk = chunk.replace(b"\r", b"")
+        size += len(chunk)
+        if max_size and size > max_size:
+            return None, None, too_big
+
+        h.update(chunk)
+        chunks.append(chunk)
+
+        if len(head) < marker_window:
+            head += chunk[:marker_window - len(head)]
+            msg = find_bad_marker(head)
+            if msg != None:
+                content = b"".join(chunks)
+                return content, content_hash(content), msg
+
+    return b"".join(chunks), h.hexdigest(), None
+
+def make_conditional_headers(cache_info: Dict) -> Dict:
+    " convert saved validators into conditional GET headers "
+    headers = {}
+    if cache_info == None: return headers
+
+    etag = cache_info.get("etag")
+    if etag != None: headers["If-None-Match"] = etag
+    last_modified = cache_info.get("last_modified")
+    if last_modified != None: headers["If-Modified-Since"] = last_modified
+    return headers
+
+def update_cache_info(cache_info: Dict, headers: Dict, is_not_modified: bool):
+    " save the validators from a response "
+    # a 304 may omit them, so keep the ones we sent
+    if not is_not_modified:
+        cache_info.pop("etag", None)
+        cache_info.pop("last_modified", None)
+
+    etag = headers.get("ETag")
+    if etag != None: cache_info["etag"] = etag
+    last_modified = headers.get("Last-Modified")
+    if last_modified != None: cache_info["last_modified"] = last_modified
+
+def content_hash(content: bytes) -> str:
+    " fast fingerprint of some content "
+    if content == None: return None
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def find_bad_marker(content: bytes) -> str:
+    " check for content that means the site blocked us, returns a message or None "
+    for marker, msg in bad_content_markers:
+        if content.find(marker) >= 0: return msg
+    return None
+
 def is_bad_content(content: bytes) -> [bool, str]:
     " checks if content returned from requests looks bad "
 
     if content == None: return True, "Empty Response"
     if len(content) < 600: return True, f"Response is {len(content)} bytes"
-    if re.search(b"Request unsuccessful. Incapsula incident", content):
-        return True, f"Site uses Incapsula"
+    msg = find_bad_marker(content)
+    if msg != None: return True, msg
     return False, None
 
 
@@ -114,6 +278,19 @@ def convert_python_to_json(x):
 
 # -----
 
+def get_peak_memory() -> float:
+    " peak memory used by this process in MBs, None if not available "
+    try:
+        import resource
+    except ImportError:
+        return None
+    x = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes except on mac
+    if sys.platform == "darwin": x /= 1024
+    return x / 1024.0
+
+# -----
+
 def get_host():
     " get the name of the hosting computer "
     host = os.environ.get("HOST")
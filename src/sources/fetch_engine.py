@@ -0,0 +1,255 @@
+#
+# FetchEngine
+#
+#   fetch many pages at once on a thread pool.
+#
+#   the number of concurrent requests to any one host is capped so
+#   we don't hammer a single state's web server.
+#
+#   results are handed back to the caller (on the caller's thread)
+#   as they complete, so bookkeeping like the ChangeList does not
+#   need to be thread-safe.
+#
+#   the caller can block a host (e.g. its circuit opened); the tasks
+#   for that host that have not started are handed back as skipped.
+#
+#   tasks whose urls are the same page (see canonical_url) can be merged
+#   so the page is fetched once and the result is handed back for each.
+#
+
+from typing import List, Callable, Iterator, Tuple, Dict
+from loguru import logger
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from collections import deque
+import urllib.parse
+import time
+import re
+
+
+def get_url_host(url: str) -> str:
+    " get the host part of a url (lower case) "
+    if url == None: return ""
+    try:
+        return urllib.parse.urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+
+
+# query parameters that only track the visitor
+_tracking_params = re.compile(r"^(utm_.*|fbclid|gclid|dclid|mc_cid|mc_eid|_ga|_gl|ref_src)$", re.IGNORECASE)
+
+def canonical_url(url: str, keep_fragment: bool = False) -> str:
+    """ a key that is the same for urls that are the same page
+
+    ignores the scheme (http vs https), default ports, a trailing slash, 
+    the fragment, tracking parameters and the order of the parameters.
+    google redirect links (google.com/url?q=...) are unwrapped.
+
+    keep_fragment is for the captive browser, where a hash-routed
+    dashboard (index.html#/abc vs #/def) renders different pages.
+    """
+    if url == None: return ""
+    url = url.strip()
+    try:
+        x = urllib.parse.urlsplit(url)
+    except ValueError:
+        return url
+
+    host = (x.hostname or "").lower()
+    port = x.port if x.port != None and x.port not in [80, 443] else None
+    query = urllib.parse.parse_qsl(x.query, keep_blank_values=True)
+
+    if re.match(r"^(www\.)?google\.[a-z.]+$", host) and x.path == "/url":
+        for n, v in query:
+            if n == "q" and v != "": return canonical_url(v, keep_fragment)
+
+    query = sorted((n, v) for n, v in query if not _tracking_params.match(n))
+    path = x.path.rstrip("/")
+
+    result = host + (f":{port}" if port != None else "") + path
+    if len(query) > 0: result += "?" + urllib.parse.urlencode(query)
+    if keep_fragment and x.fragment != "": result += "#" + x.fragment
+    return result
+
+
+class FetchTask:
+    " a page to fetch and the result of the fetch "
+
+    __slots__ = (
+        "key", "location", "source", "url", "host",
+        "cache_info",
+        "content", "status", "error", "skipped",
+        "wall_secs", "cpu_secs",
+        "context", "followers", "primary"
+    )
+
+    def __init__(self, key: str, location: str, source: str, url: str):
+        self.key = key
+        self.location = location
+        self.source = source
+        self.url = url
+        self.host = get_url_host(url)
+
+        # conditional GET validators (None to always fetch)
+        self.cache_info: Dict = None
+
+        # caller's data, not used by the engine
+        self.context = None
+
+        # tasks for the same page that get this task's result
+        self.followers: List["FetchTask"] = []
+        # the task that was fetched for a follower
+        self.primary: "FetchTask" = None
+
+        # filled in by the engine
+        self.content: bytes = None
+        self.status: int = None
+        self.error: Exception = None
+        self.skipped = False
+
+        # time spent in fetch (cpu is for the worker thread)
+        self.wall_secs: float = None
+        self.cpu_secs: float = None
+
+    def release(self):
+        " drop the page once its result is processed, so the run doesn't keep every page "
+        self.content = None
+
+
+def merge_duplicate_urls(tasks: List[FetchTask], keep_fragment: bool = False) -> Tuple[List[FetchTask], int]:
+    """ merge tasks that are for the same page (by canonical_url)
+
+    the first task for a page is fetched, the others become its followers.
+    validators are only sent if every task for the page has the same ones.
+
+    returns the tasks to fetch and the number of fetches saved
+    """
+    result = []
+    by_url: Dict[str, FetchTask] = {}
+    for t in tasks:
+        curl = canonical_url(t.url, keep_fragment)
+        primary = by_url.get(curl)
+        if primary == None:
+            by_url[curl] = t
+            result.append(t)
+        else:
+            primary.followers.append(t)
+
+    def validators(t: FetchTask) -> Tuple:
+        if t.cache_info == None: return None
+        return (t.cache_info.get("etag"), t.cache_info.get("last_modified"))
+
+    for t in result:
+        if len(t.followers) == 0 or t.cache_info == None: continue
+        v = validators(t)
+        if any(validators(x) != v for x in t.followers):
+            t.cache_info = {}
+
+    return result, len(tasks) - len(result)
+
+
+class FetchEngine:
+    """ runs fetches concurrently with a per-host limit """
+
+    def __init__(self, max_workers: int = 8, max_per_host: int = 2, trace: bool = False):
+        if max_workers < 1: max_workers = 1
+        if max_per_host < 1: max_per_host = 1
+
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.trace = trace
+
+    def _run_one(self, task: FetchTask, fetch: Callable[[FetchTask], Tuple[bytes, int]]) -> FetchTask:
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            task.content, task.status = fetch(task)
+        except Exception as ex:
+            task.error = ex
+        task.wall_secs = time.perf_counter() - wall
+        task.cpu_secs = time.thread_time() - cpu
+        return task
+
+    def _fan_out(self, task: FetchTask) -> List[FetchTask]:
+        " copy the result of a task to its followers "
+        for x in task.followers:
+            x.content, x.status, x.error = task.content, task.status, task.error
+            x.skipped = task.skipped
+            x.primary = task
+            if task.cache_info != None:
+                x.cache_info = dict(task.cache_info)
+        return task.followers
+
+    def run(self, tasks: List[FetchTask], fetch: Callable[[FetchTask], Tuple[bytes, int]],
+            is_blocked: Callable[[str], bool] = None) -> Iterator[FetchTask]:
+        """ fetch all the tasks
+
+        yields each task as soon as it completes, so the order is not the
+        same as the input order.  exceptions raised by fetch are stored
+        in task.error.  the followers of a task are yielded right after it
+        with a copy of its result, so the caller can release() each task
+        once it is done with it.
+
+        is_blocked(host) is checked before each fetch is started; tasks for a
+        blocked host are yielded with task.skipped set and are not fetched.
+
+        if the caller stops iterating, fetches that have not started
+        are cancelled.
+        """
+
+        # one queue per host, in plan order
+        queues: Dict[str, deque] = {}
+        for t in tasks:
+            q = queues.get(t.host)
+            if q == None:
+                q = deque()
+                queues[t.host] = q
+            q.append(t)
+
+        active: Dict[str, int] = {}
+        running: Dict[Future, FetchTask] = {}
+
+        logger.info(f"  fetch {len(tasks)} pages from {len(queues)} hosts using {self.max_workers} workers")
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+        try:
+            while len(queues) > 0 or len(running) > 0:
+
+                # drop the hosts the caller blocked
+                skipped = []
+                if is_blocked != None:
+                    for host in list(queues.keys()):
+                        if not is_blocked(host): continue
+                        skipped.extend(queues.pop(host))
+                for t in skipped:
+                    t.skipped = True
+                    followers = self._fan_out(t)
+                    yield t
+                    for x in followers: yield x
+
+                # start as many fetches as the limits allow
+                for host in list(queues.keys()):
+                    if len(running) >= self.max_workers: break
+
+                    q = queues[host]
+                    while len(q) > 0 and active.get(host, 0) < self.max_per_host:
+                        if len(running) >= self.max_workers: break
+                        t = q.popleft()
+                        if self.trace: logger.info(f"  start fetch {t.key} from {host}")
+                        f = executor.submit(self._run_one, t, fetch)
+                        running[f] = t
+                        active[host] = active.get(host, 0) + 1
+                    if len(q) == 0: del queues[host]
+
+                if len(running) == 0: continue
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for f in done:
+                    t = running.pop(f)
+                    active[t.host] -= 1
+                    # before the caller sees it, it may release the content
+                    followers = self._fan_out(t)
+                    yield t
+                    for x in followers: yield x
+        finally:
+            for f in running: f.cancel()
+            executor.shutdown(wait=True)
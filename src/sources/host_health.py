@@ -0,0 +1,87 @@
+#
+# HostHealth
+#
+#   per-host circuit breaker.
+#
+#   a host that fails (timeout, connection error, 5xx) several times in a row
+#   is skipped until its backoff expires.  the backoff doubles each time the
+#   circuit opens again, so a dead server costs one probe per backoff period
+#   instead of a 30s timeout per url every run.
+#
+#   the state is kept next to change_list.json so it carries across runs.
+#
+
+from typing import Dict, Tuple
+from loguru import logger
+from datetime import datetime, timedelta
+
+from shared.directory_cache import DirectoryCache
+from shared.json_store import JsonStore
+from shared import udatetime
+
+# consecutive failures before the circuit opens
+FAILURE_THRESHOLD = 3
+
+BASE_BACKOFF = timedelta(minutes=30)
+MAX_BACKOFF = timedelta(hours=12)
+
+
+def is_host_failure(status: int, error: Exception) -> bool:
+    " did the fetch fail because of the host (as opposed to the content) "
+    if error != None: return True
+    if status == None: return True
+    # 999 = timeout or connection error in fetch_with_requests
+    return status >= 500
+
+
+class HostHealth:
+    """ consecutive failures and backoff per host """
+
+    def __init__(self, cache: DirectoryCache):
+        self.store = JsonStore(cache, "host_health.json")
+
+    def save(self):
+        self.store.save()
+
+    def is_open(self, host: str, xnow: datetime = None) -> bool:
+        " should fetches to this host be skipped "
+        x = self.store.get(host)
+        if x == None or x.get("open_until") == None: return False
+        if xnow == None: xnow = udatetime.now_as_utc()
+        return xnow < udatetime.from_json(x["open_until"])
+
+    def get_status(self, host: str) -> Tuple[int, str]:
+        " consecutive failures and when the circuit closes (None if closed) "
+        x = self.store.get(host)
+        if x == None: return 0, None
+        return x["failures"], x.get("open_until")
+
+    def record_success(self, host: str):
+        x = self.store.get(host)
+        if x == None: return
+        if x.get("trips", 0) > 0:
+            logger.info(f"  host {host} recovered after {x['failures']} failures")
+        self.store.remove(host)
+
+    def record_failure(self, host: str, reason: str, xnow: datetime = None):
+        if xnow == None: xnow = udatetime.now_as_utc()
+
+        x = self.store.get(host)
+        x = dict(x) if x != None else { "failures": 0, "trips": 0 }
+        x["failures"] += 1
+        x["reason"] = reason
+
+        # fetches that were already running when the circuit opened
+        if self.is_open(host, xnow):
+            self.store.set(host, x)
+            return
+
+        # a failed probe after the backoff expired re-opens right away
+        if x["failures"] >= FAILURE_THRESHOLD or x["trips"] > 0:
+            x["trips"] += 1
+            backoff = BASE_BACKOFF * (2 ** (x["trips"] - 1))
+            if backoff > MAX_BACKOFF: backoff = MAX_BACKOFF
+            x["open_until"] = udatetime.to_json(xnow + backoff)
+            logger.warning(f"  host {host} failed {x['failures']} times ({reason}) -> skip for {udatetime.format_mins(backoff.total_seconds() / 60.0)}")
+
+        self.store.set(host, x)
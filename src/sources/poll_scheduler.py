@@ -0,0 +1,151 @@
+#
+# PollScheduler
+#
+#   decides when each location is due to be fetched again.
+#
+#   it learns each location's change cadence from the times it changed
+#   (ChangeItem.updated) and:
+#     1. polls every MIN_INTERVAL near the times of day the page usually changes
+#        (e.g. a daily 5pm update),
+#     2. otherwise polls at a quarter of the typical time between changes,
+#        so pages that rarely change are rarely fetched.
+#
+#   locations without enough history are polled every regular (half hour) run.
+#
+
+from typing import List, Dict, Tuple
+from loguru import logger
+from datetime import datetime, timedelta
+import statistics
+
+from shared.directory_cache import DirectoryCache
+from shared.json_store import JsonStore
+from shared import udatetime
+from transform.change_list import ChangeItem, ChangeList
+
+MIN_INTERVAL = timedelta(minutes=15)
+# skips the extra runs the scanner adds for update windows
+DEFAULT_INTERVAL = timedelta(minutes=25)
+MAX_INTERVAL = timedelta(hours=6)
+
+# how many changes to remember per location
+MAX_HISTORY = 30
+# how many changes are needed before the schedule is used
+MIN_HISTORY = 3
+
+# a change time-of-day within this many minutes of now puts us in an update window
+WINDOW_MINS = 45
+# fraction of past changes that need to be in the window
+WINDOW_FRACTION = 0.25
+
+
+class PollScheduler:
+    """ adaptive per-location polling schedule """
+
+    def __init__(self, cache: DirectoryCache):
+        self.store = JsonStore(cache, "poll_schedule.json")
+
+    def save(self):
+        self.store.save()
+
+    def get_changes(self, key: str) -> List[datetime]:
+        x = self.store.get(key)
+        if x == None: return []
+        return [udatetime.from_json(s) for s in x["changes"]]
+
+    def record(self, item: ChangeItem):
+        " remember when the item last changed "
+        if item == None or item.updated == None: return
+
+        x = self.store.get(item.name)
+        changes = list(x["changes"]) if x != None else []
+
+        s = udatetime.to_json(item.updated)
+        if s in changes: return
+        changes.append(s)
+        changes.sort()
+        self.store.set(item.name, { "changes": changes[-MAX_HISTORY:] })
+
+    def get_interval(self, key: str, xnow: datetime) -> Tuple[timedelta, str]:
+        " get the time between checks and why "
+
+        changes = self.get_changes(key)
+        if len(changes) < MIN_HISTORY:
+            return DEFAULT_INTERVAL, "learning"
+
+        # in an update window?
+        xnow_mins = self._time_of_day(xnow)
+        cnt = 0
+        for dt in changes:
+            delta = abs(self._time_of_day(dt) - xnow_mins)
+            delta = min(delta, 24*60 - delta)
+            if delta <= WINDOW_MINS: cnt += 1
+        if cnt >= 2 and cnt >= WINDOW_FRACTION * len(changes):
+            return MIN_INTERVAL, "update window"
+
+        # typical time between changes, longer if it has been quiet for a while
+        gaps = [(changes[i] - changes[i-1]).total_seconds() for i in range(1, len(changes))]
+        typical = statistics.median(gaps)
+        typical = max(typical, (xnow - changes[-1]).total_seconds())
+
+        interval = timedelta(seconds=typical / 4)
+        if interval < MIN_INTERVAL: interval = MIN_INTERVAL
+        if interval > MAX_INTERVAL: interval = MAX_INTERVAL
+        return interval, f"every {udatetime.format_mins(interval.total_seconds() / 60.0)}"
+
+    def is_due(self, key: str, item: ChangeItem, xnow: datetime) -> Tuple[bool, str]:
+        " check if a location should be fetched now "
+
+        if item != None and item.updated != None and len(self.get_changes(key)) == 0:
+            self.record(item)
+
+        if item == None or item.checked == None:
+            return True, "never checked"
+
+        interval, reason = self.get_interval(key, xnow)
+        if xnow - item.checked < interval:
+            return False, reason
+        return True, reason
+
+    def next_window(self, key: str, xnow: datetime) -> datetime:
+        """ when the next update window of a location opens, None if it has none 
+
+        a window opens WINDOW_MINS before one of the past change times of day, 
+        so the earliest of those that is a window is the next one.
+        """
+        changes = self.get_changes(key)
+        if len(changes) < MIN_HISTORY: return None
+
+        xnow_mins = self._time_of_day(xnow)
+        result = None
+        for dt in changes:
+            mins = (self._time_of_day(dt) - WINDOW_MINS - xnow_mins) % (24*60)
+            if mins == 0: continue
+            t = xnow.replace(second=0, microsecond=0) + timedelta(minutes=mins)
+            if result != None and t >= result: continue
+            _, reason = self.get_interval(key, t)
+            if reason == "update window": result = t
+        return result
+
+    def next_due(self, change_list: ChangeList, xnow: datetime = None) -> datetime:
+        " the earliest time a location will be due because of an update window, None if there are none "
+
+        if xnow == None: xnow = udatetime.now_as_utc()
+        result = None
+        for key in self.store.keys():
+            item = change_list.get_item(key)
+            if item == None or item.checked == None: continue
+            interval, reason = self.get_interval(key, xnow)
+            if reason == "update window":
+                dt = item.checked + interval
+            else:
+                dt = self.next_window(key, xnow)
+                if dt == None: continue
+                dt = max(dt, item.checked + MIN_INTERVAL)
+            if result == None or dt < result: result = dt
+        return result
+
+    def _time_of_day(self, dt: datetime) -> int:
+        " minutes after midnight, eastern time "
+        x = dt.astimezone(udatetime.eastern_tz)
+        return x.hour * 60 + x.minute
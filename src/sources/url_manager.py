@@ -3,22 +3,42 @@
 #
 #   make sure we don't hit the same URL twice
 #
+#   history only keeps an index of url -> (content hash, status, validators).
+#   the page bodies are kept in a byte-budgeted LRU that spills to disk.
+#
 
-from typing import Tuple
+from typing import Tuple, Dict
 from loguru import logger
 import time
+import threading
+
+import os
+import tempfile
 
-from shared.util import fetch_with_requests
-from capture.captive_browser import CaptiveBrowser
+from shared.util import fetch_with_requests, content_hash
+from shared.directory_cache import DirectoryCache
+from shared.content_lru import ContentLru
+from capture.browser_pool import BrowserPool
 
 class UrlManager:
 
-    def __init__(self, headless=True, browser="requests"):
+    def __init__(self, headless=True, browser="requests", browser_count=2,
+            spill_dir: str = None, max_memory_mb: float = 64.0, strip_cr: bool = False):
         self.history = {}
         self.size = 0
         self.browser = browser
+        # remove carriage returns while downloading (requests only)
+        self.strip_cr = strip_cr
         self.headless = headless
-        self._captive = None
+        self.browser_count = browser_count
+        self._pool = None
+
+        # fetch can be called from several threads at once
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        if spill_dir == None: spill_dir = os.path.join(tempfile.gettempdir(), "url_manager")
+        self.contents = ContentLru(int(max_memory_mb * 1e6), DirectoryCache(spill_dir))
 
     def is_repeat(self, url: str) -> bool:
         return url in self.history
@@ -26,34 +46,89 @@ class UrlManager:
     def reset(self):
         self.history = {}
         self.size = 0
+        self.contents.reset()
 
     def shutdown(self):
-        if self._captive != None:
-            self._captive.close()
-            self._captive = None
+        if self._pool != None:
+            self._pool.close()
+            self._pool = None
+
+    def get_pool(self) -> BrowserPool:
+        " the captive browsers, also used for screenshots "
+        with self._lock:
+            if self._pool == None:
+                browser = self.browser if self.browser != "requests" else "firefox"
+                self._pool = BrowserPool(self.browser_count, self.headless, browser)
+            return self._pool
 
     def fetch_with_captive(self, url: str) -> Tuple[bytes, int]:
-        if self._captive == None:
-            self._captive = CaptiveBrowser(self.headless, self.browser)
-        self._captive.navigate(url)
-        if self._captive.has_slow_elements():
-            logger.debug(f"  found slow elements, wait for 5 seconds")
-            time.sleep(5)
-        return self._captive.page_source(), self._captive.status_code()
+        with self.get_pool().borrow() as captive:
+            captive.navigate(url)
+            if captive.has_slow_elements():
+                logger.debug(f"  found slow elements, wait for page to settle")
+                captive.wait_until_ready(max_secs=10.0, quiet_secs=1.0)
+            else:
+                captive.wait_until_ready(max_secs=5.0)
+            return captive.page_source(), captive.status_code()
 
 
-    def fetch(self, url: str) -> Tuple[bytes, int]:
+    def _from_history(self, url: str, cache_info: Dict) -> Tuple[bytes, int]:
+        content_key, status, info = self.history[url]
+        if cache_info != None:
+            cache_info.clear()
+            cache_info.update(info)
+        content = self.contents.get(content_key) if content_key != None else None
+        return content, status
 
-        if url in self.history:
-            return self.history[url]
+    def fetch(self, url: str, cache_info: Dict = None) -> Tuple[bytes, int]:
+        """ get a page, only hits each url once per run 
+        
+        cache_info holds the conditional GET validators (requests only).
+        a not-modified response returns None, 304 and is not kept in history 
+        because it is only meaningful for the caller's validators.
+        """
 
-        if self.browser == "requests":
-            content, status = fetch_with_requests(url)
-        else:
-            content, status = self.fetch_with_captive(url)
+        # if another thread is already fetching this url, wait for it
+        with self._lock:
+            if url in self.history:
+                return self._from_history(url, cache_info)
+            event = self._pending.get(url)
+            is_owner = event == None
+            if is_owner:
+                event = threading.Event()
+                self._pending[url] = event
 
-        self.history[url] = (content, status)
-        if content != None:
-            self.size += len(content)
-        return content, status
+        if not is_owner:
+            event.wait()
+            with self._lock:
+                if url in self.history:
+                    return self._from_history(url, cache_info)
+            return self.fetch(url, cache_info)
+
+        try:
+            info = dict(cache_info) if cache_info != None else None
+            if self.browser == "requests":
+                content, status = fetch_with_requests(url, info, self.strip_cr)
+            else:
+                content, status = self.fetch_with_captive(url)
+
+            # replace, not merge: the validators a 200 didn't send are gone
+            if info != None:
+                cache_info.clear()
+                cache_info.update(info)
+            if status == 304:
+                return content, status
+
+            content_key = info.get("content_hash") if info != None else None
+            if content_key == None: content_key = content_hash(content)
+            self.contents.put(content_key, content)
+            with self._lock:
+                self.history[url] = (content_key, status, info if info != None else {})
+                if content != None:
+                    self.size += len(content)
+            return content, status
+        finally:
+            with self._lock:
+                del self._pending[url]
+            event.set()
 
@@ -7,12 +7,14 @@ import numpy as np
 import shutil
 from loguru import logger
 import atexit
+from contextlib import contextmanager
 
 # change the the imports will work rather than failing mysteriously
 from __init__ import check_path
 check_path() 
 
 from capture.captive_browser import CaptiveBrowser, are_images_same
+from capture.browser_pool import BrowserPool
 from shared.directory_cache import DirectoryCache
 
 from shared.util import get_host
@@ -21,7 +23,7 @@ from shared import udatetime
 
 class SpecializedCapture():
 
-    def __init__(self, temp_dir: str, publish_dir: str, driver: CaptiveBrowser = None):
+    def __init__(self, temp_dir: str, publish_dir: str, pool: BrowserPool = None):
         self.temp_dir = temp_dir
         self.publish_dir = publish_dir
 
@@ -29,10 +31,11 @@ class SpecializedCapture():
         self.cache = DirectoryCache(os.path.join(publish_dir))
 
         self.changed = False
-        self._is_internal_browser = driver is None
-        self._browser: CaptiveBrowser = driver
+        self._pool = pool
+        self._browser: CaptiveBrowser = None
 
     def get_browser(self) -> CaptiveBrowser:
+        " get the browser of a capture without a pool, started on first use "
         if self._browser != None: return self._browser
 
         logger.info("  [start captive browser]")
@@ -40,12 +43,27 @@ class SpecializedCapture():
         atexit.register(self._browser.close)
         return self._browser
 
+    @contextmanager
+    def borrow_browser(self):
+        """ a browser for one screenshot
+
+        with a pool, it is borrowed per screenshot so the fetch workers
+        aren't left waiting for it and the pool can recycle it.
+        """
+        if self._pool != None:
+            with self._pool.borrow() as captive:
+                yield captive
+        else:
+            yield self.get_browser()
+
     def close(self):
-        if self._browser and self._is_internal_browser:
-            logger.info("  [stop captive browser]")
-            self._browser.close()
-            atexit.unregister(self._browser.close)
-            self._browser = None
+        " stop the browser (the pool's browsers are closed by the pool) "
+        if self._browser == None: return
+
+        logger.info("  [stop captive browser]")
+        self._browser.close()
+        atexit.unregister(self._browser.close)
+        self._browser = None
 
     def publish(self):
         if not self.changed: 
@@ -77,18 +95,19 @@ class SpecializedCapture():
         xpath_prev = os.path.join(self.temp_dir,  f"{key}_prev.png")
         xpath_diff = os.path.join(self.temp_dir,  f"{key}_diff.png")
 
-        browser = self.get_browser()
-        if browser == None: raise Exception("Could not get browser")
+        with self.borrow_browser() as browser:
+            if browser == None: raise Exception("Could not get browser")
+
+            logger.info(f"    1. get content from {url}")
+            if not browser.navigate(url):
+                logger.info("  page timed out -> skip")
+
+            logger.info(f"    2. wait for page to settle")
+            browser.wait_until_ready(max_secs=10.0, quiet_secs=1.0)
 
-        logger.info(f"    1. get content from {url}")
-        if not browser.navigate(url):
-            logger.info("  page timed out -> skip")
-        
-        logger.info(f"    2. wait for 5 seconds")
-        time.sleep(5)
+            logger.info(f"    3. save screenshot to {xpath}")
+            buffer_new = browser.screenshot(xpath_temp, full_page=True)
 
-        logger.info(f"    3. save screenshot to {xpath}")
-        buffer_new = browser.screenshot(xpath_temp, full_page=True)        
         if buffer_new is None:
             logger.error("      *** could not capture image")
             return
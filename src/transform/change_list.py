@@ -8,6 +8,7 @@ from lxml import html
 from shared.directory_cache import DirectoryCache
 from shared.util import convert_json_to_python, convert_python_to_json
 from shared import udatetime
+from shared.stage_timer import summarize_timings
 from transform import html_helpers
 
 class ChangeItem:
@@ -16,7 +17,8 @@ class ChangeItem:
     __slots__ = (
         "name", "source", "status", "url", 
         "msg", "complete",
-        "added", "checked", "updated", "failed"
+        "added", "checked", "updated", "failed",
+        "timings", "diff"
     )
 
     def __init__(self, vals: Dict = None):
@@ -32,6 +34,11 @@ class ChangeItem:
         self.updated:datetime = None
         self.failed:datetime = None
 
+        # {stage: {wall, cpu}} for the last time it was processed (None if it wasn't this run)
+        self.timings: Dict = None
+        # summary of the tree diff when it last changed
+        self.diff: str = None
+
         if vals != None:
             self.from_dict(vals)
 
@@ -41,7 +48,9 @@ class ChangeItem:
             "added": udatetime.require_utc(self.added), 
             "checked": udatetime.require_utc(self.checked), 
             "updated": udatetime.require_utc(self.updated), 
-            "failed": udatetime.require_utc(self.failed) 
+            "failed": udatetime.require_utc(self.failed),
+            "timings": self.timings,
+            "diff": self.diff
         }
         return y
 
@@ -61,6 +70,8 @@ class ChangeItem:
         self.checked = udatetime.require_utc(y["checked"])
         self.updated = udatetime.require_utc(y["updated"])
         self.failed = udatetime.require_utc(y["failed"])
+        self.timings = y.get("timings")
+        self.diff = y.get("diff")
 
 
 class ChangeList:
@@ -75,6 +86,7 @@ class ChangeList:
         'time_lapsed',
         'error_message',
         'complete',
+        'run_stats',
 
         '_is_loaded',
         '_items',
@@ -92,6 +104,8 @@ class ChangeList:
         self.time_lapsed = self.end_date - self.start_date
         self.error_message = None
         self.complete = False
+        # label -> value, shown in the run information
+        self.run_stats = {}
 
         self.last_timestamp = ""
 
@@ -115,6 +129,7 @@ class ChangeList:
         
         self.error_message = None
         self.complete = False
+        self.run_stats = {}
         for x in self._items: x.complete = False
 
 
@@ -125,10 +140,15 @@ class ChangeList:
         self._write_json()
         self._write_text()
         self._write_urls()
+        self._write_metrics()
 
     def abort_run(self, ex: Exception):
         self.error_message = str(ex)
 
+    def record_run_stat(self, label: str, val):
+        " add a number to the run information "
+        self.run_stats[label] = val
+
     def finish_run(self):
         self.complete = True
         self.save_progress()
@@ -171,6 +191,7 @@ class ChangeList:
             y.url = xurl
             y.msg = msg
             y.complete = True
+            y.timings = None
             self._items[idx] = y
             
         return y, x, xnow
@@ -219,6 +240,13 @@ class ChangeList:
             y.status = x.status
             y.msg = x.msg
 
+    def record_circuit_open(self, name: str, source: str, xurl: str, msg: str = ""):
+        " host is being skipped after repeated failures, keeps the last check/update times "
+        status = "circuit-open"
+        logger.info(f"  {name}: {status} {msg}")
+
+        self.update_status(name, source, status, xurl, msg)
+
     def record_changed(self, name: str, source: str, xurl: str, msg: str = ""):
 
         status = "CHANGED"
@@ -228,9 +256,24 @@ class ChangeList:
         y.checked = xnow
         y.updated = xnow
         y.failed = None
+        y.diff = None
 
         self.last_timestamp = xnow
 
+    def count_by_status(self) -> Dict[str, int]:
+        " number of items with each status in this run "
+        result = {}
+        for x in self._items:
+            if not x.complete: continue
+            result[x.status] = result.get(x.status, 0) + 1
+        return result
+
+    def record_timings(self, name: str, timings: Dict):
+        " keep the stage timings for an item processed in this run "
+        idx = self._lookup.get(name)
+        if idx == None: return
+        self._items[idx].timings = timings
+
     def _remove_text_files(self):
         for n in ["change_list.txt", "urls.txt"]:
             fn = os.path.join(self.cache.work_dir, n)
@@ -255,6 +298,8 @@ class ChangeList:
             f_changes.write(f"  end\t{udatetime.to_displayformat(self.end_date)}\n")
             f_changes.write(f"  previous\t{udatetime.to_displayformat(self.previous_date)}\n")
             f_changes.write(f"  lapsed\t{self.time_lapsed}\n")
+            for n in self.run_stats:
+                f_changes.write(f"  {n}\t{self.run_stats[n]}\n")
             f_changes.write(f"\n")
 
             status = {}
@@ -299,6 +344,8 @@ class ChangeList:
         self._add_html_info_row(t, "Ended At", udatetime.to_displayformat(self.end_date))
         self._add_html_info_row(t, "Lapse Time (mins)", str(self.time_lapsed))
         self._add_html_info_row(t, "Previous Run At", udatetime.to_displayformat(self.previous_date))
+        for n in self.run_stats:
+            self._add_html_info_row(t, n, str(self.run_stats[n]))
         self._add_html_info_row(t, "Error Message", self.error_message, 
             "err" if self.error_message else None)
         t[-1].tail = "\n    "
@@ -368,6 +415,16 @@ class ChangeList:
         tr.append(td)
         t.append(tr)
 
+        # Diff
+        td = html.Element("td")
+        td.tail = prefix
+        if x.diff != None:
+            a = html.Element("a")
+            a.attrib["href"] = "../diff/" + name.replace(".html", ".json")
+            a.text = x.diff
+            td.append(a)
+        tr.append(td)
+
         # Live Page
         url = x.url
         td = html.Element("td")
@@ -419,7 +476,7 @@ class ChangeList:
   <body>
     <h3>{title}</h3>
     <table id="data" class="data-table">
-        <tr><th>Name</th><th>Status</th><th>Changed At</th><th>Delta</th><th>Source</th><th>Pipeline</th></tr>    
+        <tr><th>Name</th><th>Status</th><th>Changed At</th><th>Delta</th><th>Diff</th><th>Source</th><th>Pipeline</th></tr>    
     </table>
     <br>
     <hr>
@@ -450,6 +507,7 @@ class ChangeList:
         result["time_lapsed"] = str(self.time_lapsed)
         result["complete"] = self.complete 
         result["error_message"] = self.error_message 
+        result["run_stats"] = dict(self.run_stats)
 
         result["items"] = [ x.to_dict() for x in self._items ] 
 
@@ -503,6 +561,7 @@ class ChangeList:
         self.previous_date = result["previous_date"] 
         self.time_lapsed = self.end_date - self.start_date
         self.error_message = result["error_message"] 
+        self.run_stats = result.get("run_stats", {})
 
         self._items = [ChangeItem(x) for x in result["items"]]
 
@@ -513,6 +572,26 @@ class ChangeList:
             n = self._items[idx].name
             self._lookup[n] = idx
 
+    def _write_metrics(self):
+        " per stage timings for the items processed in this run "
+        fn = os.path.join(self.cache.work_dir, "metrics.json")
+        fn_temp = fn + ".tmp"
+
+        timings = [(x.name, x.timings) for x in self._items if x.complete and x.timings != None]
+        result = {
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "time_lapsed": self.time_lapsed.total_seconds(),
+            "count": len(timings),
+            "stages": summarize_timings(timings),
+        }
+        convert_python_to_json(result)
+
+        with open(fn_temp, "w") as f:
+            json.dump(result, f, indent=2)
+        if os.path.exists(fn): os.remove(fn)
+        os.rename(fn_temp, fn)
+
     def _write_urls(self):
         fn = os.path.join(self.cache.work_dir, "urls.txt")
         with open(fn, "w") as furl:
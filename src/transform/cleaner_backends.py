@@ -0,0 +1,41 @@
+#
+# Cleaner Backends
+#
+#   HtmlCleaner implementations that can be picked by name (--cleaner).
+#   they all take the same CleanerRules and must give the same output,
+#   x_cleaner_compare.py reports any differences on a raw/ folder.
+#
+#     python -- HtmlCleaner, every node is handled in Python
+#
+#     stream -- empties the removed tags while the page is parsed in chunks,
+#               for pages with megabytes of inline script/json
+#               (see streaming_cleaner.py)
+#
+#   there is no C-level (lxml/XSLT) backend. one that stripped the tags
+#   and attributes with lxml's strip_elements/strip_attributes before the
+#   walk was tried and dropped: it was no faster (the Python walk over
+#   div/span/a dominates either way), and removing elements before the
+#   walk changes checks that look at siblings that haven't been cleaned
+#   yet (the twitter cluster, keep_attribs="child"), so it didn't give
+#   the python output.
+#
+
+from typing import Dict
+
+from transform.html_cleaner import HtmlCleaner
+from transform.streaming_cleaner import StreamingHtmlCleaner
+from transform.cleaner_rules import CleanerRules
+
+
+CLEANER_BACKENDS: Dict[str, type] = {
+    "python": HtmlCleaner,
+    "stream": StreamingHtmlCleaner,
+}
+
+def make_cleaner(backend: str = None, trace: bool = False, rules: CleanerRules = None) -> HtmlCleaner:
+    " create a cleaner for a backend name "
+    if backend == None: backend = "python"
+    cls = CLEANER_BACKENDS.get(backend)
+    if cls == None:
+        raise Exception(f"unknown cleaner backend {backend}, expected one of {list(CLEANER_BACKENDS.keys())}")
+    return cls(trace=trace, rules=rules)
@@ -0,0 +1,245 @@
+#
+# CleanerRules
+#
+#   what HtmlCleaner removes and rewrites, declared as data.
+#
+#   DEFAULT_RULES applies to every page. cleaner_rules.json (next to
+#   data_pipeline.ini, cleaner_rules.local.json wins) adds rules for
+#   a location (AZ, CA_data, ...) or a host, so false positive changes
+#   can be fixed without code changes:
+#
+#       {
+#           "default": { ... },
+#           "locations": { "AZ": { "remove_elements": [ ... ] } },
+#           "hosts": { "www.cdph.ca.gov": { "remove_attribs": [ ... ] } }
+#       }
+#
+#   each section has the same keys as DEFAULT_RULES. sets are merged and
+#   the specific rule lists are checked before the default ones.
+#
+#   rules are compiled once per combination into hash sets and
+#   precompiled regexes keyed by tag/attribute. each combination has a
+#   fingerprint of its spec, so a rebuild can tell when a page's rules
+#   changed (see rebuild_manifest.py).
+#
+
+from typing import Dict, List, Tuple, Union
+from loguru import logger
+import urllib.parse
+import json
+import re
+import os
+
+from shared.util import content_hash
+
+GUID = "[0-9a-f]{8}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{12}"
+
+DEFAULT_RULES = {
+    # removed with everything in them
+    "remove_tags": ["script", "noscript", "style", "meta", "input", "iframe", "select", "link", "font"],
+
+    # removed from every element
+    "remove_attribs": [
+        "cellpadding", "cellspacing", "width", "height", "align", "valign", "border",
+        "class", "style", "onload", "target", "onmouseout", "onmouseover", "onclick", "onkeydown",
+        "role", "scrolling", "tabindex",
+        "webpartid", "webpartid2", "allowfullscreen", "rel", "accesskey", "focusable", "bgcolor",
+    ],
+    "remove_attrib_prefixes": ["data-", "aria-"],
+
+    # removed from some elements before their children are cleaned
+    "remove_tag_attribs": { "form": ["action", "onsubmit"] },
+
+    # removed when they have no children and no text
+    "remove_empty_tags": ["div", "span"],
+
+    # links that start a twitter cluster (tweet links followed by "x min ago")
+    "twitter_links": ["https://twitter.com", "http://twitter.com", "https://t.co"],
+
+    # elements removed (with their tail) if an attribute matches
+    #   { "tag": "img", "attrib": "src", "match": "regex" }, tag "*" is any tag
+    "remove_elements": [],
+
+    # rewrite attribute values, the first rule that matches an attribute wins.
+    #   match is searched in the value, text (optional) in the element's text.
+    #   the action is one of
+    #     "set": "new value"
+    #     "sub": ["regex", "replacement"] (first match only)
+    #     "remove_element": true
+    "attrib_rewrites": [
+        { "attrib": "id", "match": GUID, "set": "[guid]" },
+        { "attrib": "href", "match": "^#.*" + GUID, "set": "#" },
+        { "attrib": "href", "match": "^https://www\\.google\\.com/url\\?q=", "sub": ["(?s)&ust=.*", ""] },
+        { "attrib": "href", "match": "^https://twitter\\.com", "text": "^@", "remove_element": True },
+        { "attrib": "src", "match": "^https://www\\.youtube\\.com/", "set": "https://www.youtube.com" },
+    ],
+    # never removed, even if a remove rule lists them
+    "keep_attribs": ["a", "div", "iframe"],
+
+    # checked in order for div/span/a once their children are clean.
+    #   "subs": [["regex", "replacement"], ...] rewrites the attribute and goes on to the next rule
+    #   "keep_attribs": "self" or "first_child" stops at this rule. the attributes of the
+    #   element are left alone if that element has children.
+    "element_rules": [
+        { "tag": "div", "attrib": "id", "match": "^google_translate_element$", "keep_attribs": "first_child" },
+        { "tag": "div", "attrib": "id", "subs": [["^[0-9a-fA-F]+-(.*)", "\\1"], ["(.*)-[a-z]?[0-9a-fA-F]+$", "\\1"]] },
+        { "tag": "div", "attrib": "fb-xfbml-state", "match": ".", "keep_attribs": "self" },
+    ],
+}
+
+SET_KEYS = ["remove_tags", "remove_attribs", "remove_attrib_prefixes", "remove_empty_tags", "twitter_links", "keep_attribs"]
+LIST_KEYS = ["remove_elements", "attrib_rewrites", "element_rules"]
+
+
+class AttribRewrite:
+    " a compiled attrib_rewrites rule "
+
+    __slots__ = ("match", "text", "value", "sub", "remove_element")
+
+    def __init__(self, spec: Dict):
+        self.match = re.compile(spec["match"])
+        self.text = re.compile(spec["text"]) if "text" in spec else None
+        self.value = spec.get("set")
+        self.sub = re.compile(spec["sub"][0]) if "sub" in spec else None
+        if self.sub != None: self.value = spec["sub"][1]
+        self.remove_element = spec.get("remove_element", False)
+
+    def matches(self, v: str, text: str) -> bool:
+        if self.match.search(v) == None: return False
+        if self.text != None and (text == None or self.text.search(text) == None): return False
+        return True
+
+
+class ElementRule:
+    " a compiled element_rules rule "
+
+    __slots__ = ("attrib", "match", "subs", "keep_attribs")
+
+    def __init__(self, spec: Dict):
+        self.attrib = spec["attrib"]
+        self.match = re.compile(spec["match"]) if "match" in spec else None
+        self.subs = [(re.compile(p), r) for p, r in spec.get("subs", [])]
+        self.keep_attribs = spec.get("keep_attribs")
+        if not self.keep_attribs in [None, "self", "first_child"]:
+            raise Exception(f"element rule has invalid keep_attribs {self.keep_attribs}")
+
+
+class CleanerRules:
+    """ rules compiled into lookup tables for HtmlCleaner """
+
+    def __init__(self, spec: Dict = None):
+        if spec == None: spec = DEFAULT_RULES
+
+        self.fingerprint = content_hash(json.dumps(spec, sort_keys=True).encode())
+
+        self.remove_tags = frozenset(spec.get("remove_tags", []))
+        self.remove_attribs = frozenset(spec.get("remove_attribs", []))
+        self.remove_attrib_prefixes = tuple(spec.get("remove_attrib_prefixes", []))
+        self.remove_tag_attribs = { t: tuple(x) for t, x in spec.get("remove_tag_attribs", {}).items() }
+        self.remove_empty_tags = frozenset(spec.get("remove_empty_tags", []))
+        self.twitter_links = tuple(spec.get("twitter_links", []))
+
+        # tag -> [(attrib, regex)]
+        self.remove_elements: Dict[str, List[Tuple[str, re.Pattern]]] = {}
+        for x in spec.get("remove_elements", []):
+            self.remove_elements.setdefault(x.get("tag", "*"), []).append((x["attrib"], re.compile(x["match"])))
+        self.remove_any_elements = self.remove_elements.get("*", [])
+
+        # attrib -> [AttribRewrite]
+        self.attrib_rewrites: Dict[str, List[AttribRewrite]] = {}
+        for x in spec.get("attrib_rewrites", []):
+            self.attrib_rewrites.setdefault(x["attrib"], []).append(AttribRewrite(x))
+        self.keep_attribs = frozenset(spec.get("keep_attribs", [])) | frozenset(self.attrib_rewrites.keys())
+
+        # tag -> [ElementRule]
+        self.element_rules: Dict[str, List[ElementRule]] = {}
+        for x in spec.get("element_rules", []):
+            self.element_rules.setdefault(x["tag"], []).append(ElementRule(x))
+
+    def should_remove_attrib(self, n: str) -> bool:
+        if n in self.keep_attribs: return False
+        return n in self.remove_attribs or n.startswith(self.remove_attrib_prefixes)
+
+
+def merge_rules(base: Dict, extra: Dict) -> Dict:
+    " combine two rule specs, the rules in extra are checked first "
+    result = {}
+    for n in SET_KEYS:
+        x = list(base.get(n, []))
+        for v in extra.get(n, []):
+            if not v in x: x.append(v)
+        result[n] = x
+    for n in LIST_KEYS:
+        result[n] = list(extra.get(n, [])) + list(base.get(n, []))
+
+    x = { t: list(v) for t, v in base.get("remove_tag_attribs", {}).items() }
+    for t, v in extra.get("remove_tag_attribs", {}).items():
+        x[t] = x.get(t, []) + [a for a in v if not a in x.get(t, [])]
+    result["remove_tag_attribs"] = x
+
+    unknown = [n for n in extra if not n in result]
+    if len(unknown) > 0: raise Exception(f"unknown cleaner rule keys {unknown}")
+    return result
+
+
+def page_names(key: str) -> List[str]:
+    " location names to look up for a page key, e.g. CA_data.html -> [CA_data, CA] "
+    if key == None: return []
+    name = key[:-5] if key.endswith(".html") else key
+    names = [name]
+    if name.endswith("_data"): names.append(name[:-5])
+    return names
+
+
+class CleanerRuleBook:
+    """ the default rules plus per-location and per-host rules """
+
+    def __init__(self, config: Dict = None):
+        if config == None: config = {}
+        self.default = merge_rules(DEFAULT_RULES, config.get("default", {}))
+        self.locations: Dict[str, Dict] = config.get("locations", {})
+        self.hosts: Dict[str, Dict] = config.get("hosts", {})
+
+        # check the sections up front so a typo fails at startup
+        for x in list(self.locations.values()) + list(self.hosts.values()):
+            merge_rules(self.default, x)
+
+        self._compiled: Dict[Tuple, CleanerRules] = {}
+
+    def for_page(self, key: str = None, url: str = None) -> CleanerRules:
+        " the rules for a page, e.g. for_page('CA_data.html', 'https://www.cdph.ca.gov/...') "
+        sections = []
+        for n in page_names(key):
+            if n in self.locations: sections.append(("location", n))
+        if url != None and len(self.hosts) > 0:
+            host = urllib.parse.urlparse(url).netloc.lower()
+            if host in self.hosts: sections.append(("host", host))
+
+        sections = tuple(sections)
+        rules = self._compiled.get(sections)
+        if rules == None:
+            spec = self.default
+            for kind, n in reversed(sections):
+                spec = merge_rules(spec, self.locations[n] if kind == "location" else self.hosts[n])
+            rules = CleanerRules(spec)
+            self._compiled[sections] = rules
+        return rules
+
+
+def read_cleaner_rules_file(ini_dir: str = None) -> CleanerRuleBook:
+    " read cleaner_rules.json from the base repo dir, defaults only if there isn't one "
+
+    if ini_dir == None:
+        ini_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+    for fn in ["cleaner_rules.local.json", "cleaner_rules.json"]:
+        p = os.path.join(ini_dir, fn)
+        if os.path.exists(p):
+            logger.info(f"read cleaner rules from {p}")
+            with open(p, encoding="utf-8") as f:
+                return CleanerRuleBook(json.load(f))
+
+    return CleanerRuleBook()
+
+
+default_rules = CleanerRules()
@@ -3,46 +3,47 @@ from lxml import html
 from loguru import logger
 import re
 
+from transform.text_index import TextIndex
+
+case_pattern = re.compile("[Cc]ase")
+
 class ContentText():
 
-    def __init__(self, elem: html.Element, text: str, tail: str):
+    def __init__(self, elem: html.Element, text: str, tail: str, index: TextIndex = None):
         self.elem = elem
 
         self.text = text
         self.tail = tail
-        self.child_text = self.__extract_child(elem)
 
-    def __extract_child(self, elem: html.Element) -> str:
+        # the extracter shares one index for the page
+        if index == None: index = TextIndex(case_pattern)
+        self.index = index
 
-        if elem.tag == "table": return ""        
-        if elem.tag == "iframe": return ""        
-        #if elem.tag == "div": return ""        
-        if len(self.elem) == 0: 
+    def __is_leaf(self) -> bool:
+        elem = self.elem
+        if elem.tag == "table": return False
+        if elem.tag == "iframe": return False
+        return len(elem) == 0
+
+    @property
+    def child_text(self) -> str:
+        if self.__is_leaf():
             t1 = self.elem.text
             t3 = self.elem.tail
             t1 = t1.strip() if t1 != None else ""
             t3 = t3.strip() if t3 != None else ""
             return (t1 + " " + t3).strip()
+        return self.index.child_text(self.elem)
 
-        result = ""
-        for ch in elem:
-            t1 = ch.text
-            t2 = self.__extract_child(ch) if len(ch) > 0 else ""
-            t3 = ch.tail
-
-            t1 = t1.strip() if t1 != None else ""
-            t3 = t3.strip() if t3 != None else ""
-            
-            if t1 != "": result += " " + t1
-            if t2 != "": result += " " + t2
-            if t3 != "": result += " " + t3
-
-        return result.strip()
+    def __child_text_has_case(self) -> bool:
+        if self.__is_leaf() or self.index.mark != case_pattern:
+            return case_pattern.search(self.child_text) != None
+        return self.index.child_text_marked(self.elem)
 
     def contains_data(self) -> bool:
-        if re.search("[Cc]ase", self.text): return True
-        if re.search("[Cc]ase", self.child_text): return True
-        if re.search("[Cc]ase", self.tail): return True
+        if case_pattern.search(self.text): return True
+        if self.__child_text_has_case(): return True
+        if case_pattern.search(self.tail): return True
 
     def as_element(self) -> html.Element:
         div = html.Element("div")
@@ -57,7 +58,7 @@ class ContentText():
             div.text += " " + self.tail
         return div
 
-def make_content_text(elem: html.Element) -> ContentText:
+def make_content_text(elem: html.Element, index: TextIndex = None) -> ContentText:
     text, tail = elem.text, elem.tail
     if text == None: text = ""
     if tail == None or tail == "\n": tail = ""
@@ -83,4 +84,4 @@ def make_content_text(elem: html.Element) -> ContentText:
     #     return None
 
     #logger.info(f"make_content_text MATCH >>\n{html.tostring(elem)}<<\n")
-    return ContentText(elem, text, tail)
+    return ContentText(elem, text, tail, index)
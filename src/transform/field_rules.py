@@ -0,0 +1,179 @@
+#
+# FieldRules
+#
+#   where the known fields (positive, tests, deaths, ...) are in the
+#   tables of a page, declared as data like the cleaner rules.
+#
+#   converter_rules.json (next to data_pipeline.ini, converter_rules.local.json
+#   wins) lists rules for a location, they are checked before the
+#   default ones:
+#
+#       {
+#           "default": [ ... ],
+#           "locations": { "GA": [ ... ] }
+#       }
+#
+#   a rule finds one number, the first rule that finds a field wins:
+#
+#       { "field": "deaths", "table": 0, "row": "^Deaths$", "column": "^No\\. Cases" }
+#
+#     table    index of the table (optional, else the first table that matches)
+#     row      regex for the row label (the first text column)
+#     column   regex for the column name (a numeric column)
+#     sum      true to add up the column
+#
+#   with only a row, it is the first number in that row. with only a
+#   column, it is the sum, the total row or the only row. regexes
+#   ignore case.
+#
+
+from typing import Dict, List, Tuple, Union
+from loguru import logger
+import numpy as np
+import json
+import re
+import os
+
+from shared.util import content_hash
+from transform.cleaner_rules import page_names
+from transform.table_columns import TableColumns
+
+DEFAULT_FIELD_RULES = [
+    { "field": "positive", "row": "^(total )?(positive|confirmed)( cases)?$" },
+    { "field": "positive", "row": "^(total )?cases$" },
+    { "field": "deaths", "row": "^(total )?deaths?$" },
+    { "field": "tests", "row": "^(total )?(tests?|tested)( performed| completed)?$" },
+    { "field": "positive", "column": "^(total )?((positive|confirmed)( cases)?|cases)$" },
+    { "field": "deaths", "column": "^(total )?deaths?$" },
+    { "field": "tests", "column": "^(total )?(tests?|tested)( performed| completed)?$" },
+]
+
+RULE_KEYS = ["field", "table", "row", "column", "sum"]
+
+TOTAL_ROW = re.compile("^total", re.IGNORECASE)
+
+
+class FieldRule:
+    " one rule, compiled "
+
+    __slots__ = ("field", "table", "row", "column", "sum")
+
+    def __init__(self, spec: Dict):
+        unknown = [n for n in spec if not n in RULE_KEYS]
+        if len(unknown) > 0: raise Exception(f"unknown field rule keys {unknown}")
+        if not "row" in spec and not "column" in spec:
+            raise Exception(f"field rule for {spec.get('field')} needs a row or a column")
+
+        self.field: str = spec["field"]
+        self.table: int = spec.get("table")
+        self.row = re.compile(spec["row"], re.IGNORECASE) if "row" in spec else None
+        self.column = re.compile(spec["column"], re.IGNORECASE) if "column" in spec else None
+        self.sum = spec.get("sum", False)
+
+    def find(self, tables: List[TableColumns]) -> Union[int, float, None]:
+        " the value in the first table that has it "
+        if self.table != None:
+            tables = tables[self.table:self.table + 1]
+        for t in tables:
+            x = self._find_in(t)
+            if x != None: return x
+        return None
+
+    def _find_in(self, t: TableColumns) -> Union[int, float, None]:
+        columns = [n for n in t.names if n in t.numbers and (self.column == None or self.column.search(n))]
+        if len(columns) == 0: return None
+
+        labels = t.labels()
+        if self.row != None:
+            if labels == None: return None
+            for i, label in enumerate(labels):
+                if label == None or not self.row.search(label): continue
+                for n in columns:
+                    x = t.numbers[n][i]
+                    if not np.isnan(x): return self._value(t, n, x)
+            return None
+
+        n = columns[0]
+        values = t.numbers[n]
+        if self.sum:
+            return self._value(t, n, np.nansum(values)) if (~np.isnan(values)).any() else None
+        if len(values) == 1:
+            return self._value(t, n, values[0]) if not np.isnan(values[0]) else None
+        if labels != None:
+            for i, label in enumerate(labels):
+                if label != None and TOTAL_ROW.search(label) and not np.isnan(values[i]):
+                    return self._value(t, n, values[i])
+        return None
+
+    def _value(self, t: TableColumns, name: str, x: float) -> Union[int, float]:
+        return int(x) if t.types[t.names.index(name)] == "int" else float(x)
+
+
+class FieldRules:
+    " the rules for one page "
+
+    __slots__ = ("rules", "fingerprint")
+
+    def __init__(self, specs: List[Dict]):
+        self.rules = [FieldRule(x) for x in specs]
+        self.fingerprint = content_hash(json.dumps(specs, sort_keys=True).encode())
+
+    def find_fields(self, tables: List[TableColumns]) -> Dict[str, Union[int, float]]:
+        " the known fields found in the tables of a page "
+        result = {}
+        for r in self.rules:
+            if r.field in result: continue
+            x = r.find(tables)
+            if x != None: result[r.field] = x
+        return result
+
+
+class FieldRuleBook:
+    """ the default rules plus per-location rules """
+
+    def __init__(self, config: Dict = None):
+        if config == None: config = {}
+        self.default: List[Dict] = list(config.get("default", [])) + DEFAULT_FIELD_RULES
+        self.locations: Dict[str, List[Dict]] = config.get("locations", {})
+
+        # check the rules up front so a typo fails at startup
+        for x in [self.default] + list(self.locations.values()):
+            FieldRules(x)
+
+        self._compiled: Dict[Tuple, FieldRules] = {}
+
+    def for_page(self, key: str = None) -> FieldRules:
+        " the rules for a page, e.g. for_page('GA.html') "
+        names = tuple(n for n in page_names(key) if n in self.locations)
+        rules = self._compiled.get(names)
+        if rules == None:
+            specs = []
+            for n in names: specs.extend(self.locations[n])
+            rules = FieldRules(specs + self.default)
+            self._compiled[names] = rules
+        return rules
+
+
+def read_field_rules_file(ini_dir: str = None) -> FieldRuleBook:
+    " read converter_rules.json from the base repo dir, defaults only if there isn't one "
+
+    if ini_dir == None:
+        ini_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+    for fn in ["converter_rules.local.json", "converter_rules.json"]:
+        p = os.path.join(ini_dir, fn)
+        if os.path.exists(p):
+            logger.info(f"read converter rules from {p}")
+            with open(p, encoding="utf-8") as f:
+                return FieldRuleBook(json.load(f))
+
+    return FieldRuleBook()
+
+
+_default_book: FieldRuleBook = None
+
+def default_field_rules() -> FieldRuleBook:
+    " the rules from converter_rules.json, read once per process "
+    global _default_book
+    if _default_book == None: _default_book = read_field_rules_file()
+    return _default_book
@@ -1,54 +1,36 @@
-from typing import List, Union
+from typing import BinaryIO, List, Union
 from lxml import html, etree
-import re
 from loguru import logger
 
+from transform.cleaner_rules import CleanerRules, ElementRule, AttribRewrite, default_rules
 
 class HtmlCleaner:
 
-    def __init__(self, trace=False):
+    def __init__(self, trace=False, rules: CleanerRules = None):
         self.trace = trace
+        self.rules = rules if rules != None else default_rules
         self.to_remove = []
 
-    def mark_special_case(self, elem: html.Element) -> bool:
-        " edit or return element to remove "
-        # -- stupid special cases for CA
-        #if elem.tag == "div":
-        #    xid = elem.get("id")
-        #    if xid == "DeltaPlaceHolderPageDescription" or xid == "DeltaPlaceHolderPageTitleInTitleArea": 
-        #        logger.debug("special case: remove deltaplaceholder")
-        #        self.to_remove.append(elem.getparent())
-        #        return True
-        #elif elem.tag == "a":        
-        #    href = elem.get("href")
-        #    if href == "#ctl00_ctl65_SkipLink": 
-        #        logger.debug("special case: remove skiplink")
-        #        self.to_remove.append(elem.getparent())
-        #        return True
-
-        if elem.tag == "div":
-            xid = elem.attrib.get("id")
-            if xid == "google_translate_element" and len(elem)>0:
-                logger.debug("special case: google_translate_element")
-                return elem[0]
-            if xid != None:
-                xid2 = re.sub("^[0-9a-fA-F]+-(.*)",  "\\1", xid) 
-                xid2 = re.sub("(.*)-[a-z]?[0-9a-fA-F]+$",  "\\1", xid2) 
-                if xid != xid2: 
-                    logger.debug("special case: hex data in id")
-                    elem.attrib["id"] = xid2
-
-            if elem.attrib.get("fb-xfbml-state"):
-                logger.debug("special case: fb")
-                return elem
-
-
+    def apply_element_rules(self, elem: html.Element, rules: List[ElementRule]) -> bool:
+        " special cases for an element, returns True to leave its attributes alone "
+        for r in rules:
+            v = elem.attrib.get(r.attrib)
+            if v == None: continue
+            if r.match != None and r.match.search(v) == None: continue
+
+            if r.keep_attribs != None:
+                target = elem if r.keep_attribs == "self" else (elem[0] if len(elem) > 0 else None)
+                if target == None: continue
+                logger.debug(f"special case: {r.attrib}={v}")
+                return len(target) > 0
+
+            v2 = v
+            for p, repl in r.subs: v2 = p.sub(repl, v2)
+            if v2 != v:
+                logger.debug(f"special case: rewrite {r.attrib}")
+                elem.attrib[r.attrib] = v2
         return False
 
-    def is_guid(self, xid: str) -> bool:
-        if xid == None: return False
-        return re.search("[0-9a-f]{8}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{4}[\\-_][0-9a-f]{12}", xid) != None
-
     def is_empty(self, elem: html.Element) -> bool:
 
         if len(elem) > 0: return False
@@ -60,55 +42,42 @@ class HtmlCleaner:
 
         return False
 
-    def regularize_attrib(self, elem: html.Element, n: str):
+    def regularize_attrib(self, elem: html.Element, n: str, rewrites: List[AttribRewrite]):
         v = elem.attrib[n]
         if v == None: return
-        
-        if n == "id":
-            if self.is_guid(v): elem.attrib[n] = "[guid]"
-        elif n == "href":
-            if v.startswith("#") and self.is_guid(v): 
-                elem.attrib[n] = "#"
-            elif v.startswith("https://www.google.com/url?q="):
-                if self.trace: logger.info(f"google >>{v}<<")
-                idx = v.find("&ust=")
-                if idx > 0: 
-                    if self.trace: logger.info("removed ust")
-                    elem.attrib[n] = v[0:idx]
-            elif v.startswith("https://twitter.com") and elem.text != None and elem.text.startswith("@"):
+
+        for r in rewrites:
+            if not r.matches(v, elem.text): continue
+            if self.trace: logger.info(f"rewrite {n} >>{v}<<")
+            if r.remove_element:
                 elem.getparent().remove(elem)
-        elif n == "src":
-            if v.startswith("https://www.youtube.com/"):
-                elem.attrib[n] = "https://www.youtube.com"
+            elif r.sub != None:
+                elem.attrib[n] = r.sub.sub(r.value, v, count=1)
+            else:
+                elem.attrib[n] = r.value
+            return
 
     def clean_attributes(self, elem: html.Element):
         
+        attrib = elem.attrib
+        if len(attrib) == 0: return
+
+        rules = self.rules
         to_delete = []
-        for n in elem.attrib:
+        for n in attrib:
 
-            if n in ["a", "div", "id", "href", "src", "iframe"]:
-                self.regularize_attrib(elem, n)
+            rewrites = rules.attrib_rewrites.get(n)
+            if rewrites != None:
+                self.regularize_attrib(elem, n, rewrites)
                 continue
 
-            if n in ["cellpadding", "cellspacing", "width", "height", "align", "valign", "border"]:
-                to_delete.append(n)
-                continue
-            if n in ["class", "style", "onload", "target", "onmouseout", "onmouseover", "onclick", "onkeydown"]:
-                to_delete.append(n)
-                continue
-            if n in ["role", "scrolling", "tabindex"]:
-                to_delete.append(n)
-                continue
-            if n in ["webpartid", "webpartid2", "allowfullscreen", "rel", "accesskey", "focusable", "bgcolor"]:
-                to_delete.append(n)
-                continue
-            if n.startswith("data-") or n.startswith("aria-"):
+            if rules.should_remove_attrib(n):
                 to_delete.append(n)
                 continue
             #logger.error(f"unexpected attribute: {n}")
 
         for n in to_delete:
-            del elem.attrib[n]
+            del attrib[n]
 
     def remove_twitter_cluster(self, elem: html.Element):
 
@@ -126,9 +95,7 @@ class HtmlCleaner:
             if href == None: 
                 if self.trace: logger.info(f"  twitter: child no href")
                 return
-            if not (href.startswith("http://twitter.com") or
-                href.startswith("https://twitter.com") or 
-                href.startswith("https://t.co")):
+            if not href.startswith(self.rules.twitter_links):
                 if self.trace: logger.info(f"  twitter: child bad link")
                 return
         p = elem.getparent()
@@ -158,48 +125,87 @@ class HtmlCleaner:
 
 
     def clean_element(self, elem : html.Element):
+        """ clean an element and everything below it
+
+        walks the tree depth first with an explicit stack instead of recursion
+        so deep pages don't run out of stack. the steps happen in the same order
+        as a recursive walk: enter_element before the children, leave_element after.
+        """
+
+        enter_element, leave_element = self.enter_element, self.leave_element
+
+        if not enter_element(elem): return
+        stack = [(elem, iter(elem))]
+        while stack:
+            parent, children = stack[-1]
+            for ch in children:
+                if enter_element(ch):
+                    stack.append((ch, iter(ch)))
+                    break
+            else:
+                stack.pop()
+                leave_element(parent)
+
+    def is_removed_by_rule(self, elem : html.Element) -> bool:
+        " check the remove_elements rules for the page "
+        rules = self.rules
+        checks = rules.remove_elements.get(elem.tag)
+        for x in [checks, rules.remove_any_elements]:
+            if x == None: continue
+            for n, regex in x:
+                v = elem.attrib.get(n)
+                if v != None and regex.search(v) != None:
+                    if self.trace: logger.info(f"  remove {elem.tag} with {n}={v}")
+                    return True
+        return False
+
+    def enter_element(self, elem : html.Element) -> bool:
+        " first half of cleaning an element, returns False if it was removed "
 
+        rules = self.rules
         tag = elem.tag
-        if tag in ["script", "noscript", "style", "meta", "input", "iframe", "select", "link", "font"]:
+        if tag in rules.remove_tags:
             elem.getparent().remove(elem)
-            return
+            return False
         if tag == etree.Comment:
             elem.getparent().remove(elem)
-            return
+            return False
         if tag == etree.ProcessingInstruction:
             elem.getparent().remove(elem)
-            return
+            return False
 
-        if tag == "form":
-            a = elem.attrib.get("action")
-            if a != None: del elem.attrib["action"] 
-            x = elem.attrib.get("onsubmit")
-            if x != None: del elem.attrib["onsubmit"] 
+        if len(rules.remove_elements) > 0 and self.is_removed_by_rule(elem):
+            elem.getparent().remove(elem)
+            return False
+
+        names = rules.remove_tag_attribs.get(tag)
+        if names != None:
+            for n in names:
+                if n in elem.attrib: del elem.attrib[n]
 
         if tag == "a":
             href = elem.attrib.get("href")
-            if href != None and (
-                href.startswith("https://twitter.com") or 
-                href.startswith("http://twitter.com") or
-                href.startswith("https://t.co")
-                ):                
+            if href != None and href.startswith(rules.twitter_links):
                 self.remove_twitter_cluster(elem.getparent())
 
         if tag == "svg":
             while len(elem): del elem[0]
-        else:
-            for ch in elem: self.clean_element(ch)
+        return True
 
-        if tag in ["div", "span"]:
-            if self.is_empty(elem):
-                elem.getparent().remove(elem)
-                return
-            if self.mark_special_case(elem):
-                return
-        elif tag in ["a"]:
-            if self.mark_special_case(elem):
-                return
-            
+    def leave_element(self, elem : html.Element):
+        " second half of cleaning an element, after its children are clean "
+
+        rules = self.rules
+        tag = elem.tag
+        if tag in rules.remove_empty_tags and self.is_empty(elem):
+            elem.getparent().remove(elem)
+            return
+
+        element_rules = rules.element_rules.get(tag)
+        if element_rules != None and self.apply_element_rules(elem, element_rules):
+            return
+
+        if tag == "a":
             # strip spaces from simple links
             if len(elem) > 0:
                 elem[-1].tail = None
@@ -224,11 +230,56 @@ class HtmlCleaner:
     def _clean(self, content: Union[bytes,str]) -> bytes:
         if self.trace: logger.info(f"input ===>\n{content}<===\n")
 
-        self.to_remove = []
-
         if content == None: return b''
 
-        doc = html.fromstring(content)
+        doc = self.parse(content)
+        doc = self.clean_tree(doc)
+
+        try:
+            out_content = html.tostring(doc)
+        except Exception as ex:
+            logger.error(ex)
+            logger.error("lxml failed on converting document to text")
+            return b''
+
+        if type(content) == str:
+            out_content = out_content.decode()
+
+        if self.trace: logger.info(f"output ===>\n{out_content}<===\n")
+        return out_content
+
+    def clean_file(self, f_in: BinaryIO, f_out: BinaryIO) -> bool:
+        " clean from one binary file into another, same bytes as clean(). False if it failed "
+
+        try:
+            doc = self.parse_file(f_in)
+            doc = self.clean_tree(doc)
+        except Exception as ex:
+            logger.exception(ex)
+            logger.error("clean failed")
+            return False
+
+        try:
+            with etree.htmlfile(f_out) as xf:
+                xf.write(doc)
+        except Exception as ex:
+            logger.error(ex)
+            logger.error("lxml failed on converting document to text")
+            return False
+        return True
+
+    def parse(self, content: Union[bytes,str]) -> html.Element:
+        " parse a page for clean_tree "
+        return html.fromstring(content)
+
+    def parse_file(self, f: BinaryIO) -> html.Element:
+        " parse a page from a binary file "
+        return self.parse(f.read())
+
+    def clean_tree(self, doc: html.Element) -> html.Element:
+        " clean a parsed page in place "
+
+        self.to_remove = []
         self.clean_element(doc)
 
         for x in self.to_remove:
@@ -245,19 +296,7 @@ class HtmlCleaner:
             if x.tag == "body":
                 if len(x) == 0:
                     logger.warning("  cleaned document's body is empty")
-
-        try:
-            out_content = html.tostring(doc)
-        except Exception as ex:
-            logger.error(ex)
-            logger.error("lxml failed on converting document to text")
-            return b''
-
-        if type(content) == str:
-            out_content = out_content.decode()
-
-        if self.trace: logger.info(f"output ===>\n{out_content}<===\n")
-        return out_content
+        return doc
 
 
 
@@ -4,17 +4,32 @@ import re
 from loguru import logger
 from typing import Tuple
 from datetime import datetime
+import copy
+import itertools
 
 from shared import udatetime
 from transform.change_list import ChangeItem
 from transform.content_table import ContentTable
-from transform.content_text import ContentText, make_content_text
+from transform.content_text import ContentText, make_content_text, case_pattern
+from transform.text_index import TextIndex
+from transform.subtree_hash import SubtreeIndex, SubtreeHashes, Counts
 from transform import html_helpers
 
 class HtmlExtracter:
 
     def __init__(self, trace: bool = False):
         self.trace = trace
+        self.text_index = None
+
+        # set by extract_indexed
+        self.subtree_index: SubtreeIndex = None
+        self.changed: List[str] = None
+        self.copied = 0
+
+        self._hashes: SubtreeHashes = None
+        self._previous: SubtreeIndex = None
+        self._previous_rows: List[List[html.Element]] = None
+        self._unmatched: List[bool] = None
 
         self.link_container = html.Element("table")
         self.link_container.attrib["id"] = "links" 
@@ -38,21 +53,8 @@ class HtmlExtracter:
         self.text_container.tail = "\n    "
 
     def extract_text(self, elem: html.Element) -> str:
-        t = elem.text
-        t = t.strip() if t != None else ""
-
-        for ch in elem:
-            tx = self.extract_text(ch)
-            if tx != "": 
-                t += " "
-                t += tx
-        
-        tx = elem.tail
-        tx = tx.strip() if tx != None else ""
-        if tx != "": 
-            t += " "
-            t += tx
-        return t        
+        index = self.text_index if self.text_index != None else TextIndex()
+        return index.link_text(elem)
 
     def extract_link(self, elem: html.Element) -> Tuple[str, str, str]:
         href = elem.attrib.get("href")
@@ -201,39 +203,136 @@ class HtmlExtracter:
             ch.tail = xprefix
         t[-1].tail = prefix
 
+    def add_link_row(self, tr: html.Element):
+        tr.tail = "\n      "
+        self.link_container.append(tr)
+
+    def add_data_table(self, t: html.Element):
+        if len(self.table_container) == 0:
+            self.table_container.text = "\n      "
+        else:
+            self.table_container.text = "\n      "
+        self.table_container.append(t)
+
+    def add_content(self, div: html.Element):
+        div.tail = "\n      "
+        if len(self.text_container) == 0:
+            self.text_container.tail = "\n    "
+        else:
+            self.text_container.text = "\n      "
+        self.text_container.append(div)
+
+    def counts(self) -> Counts:
+        " number of link rows, tables and content divs so far "
+        return (len(self.link_container), len(self.table_container), len(self.text_container))
+
     def process_element(self, elem: html.Element):
 
+        if self._hashes != None:
+            h = self._hashes.elements.get(elem)
+            if h != None:
+                self.process_hashed_element(elem, h)
+                return
+        self.extract_element(elem)
+
+    def extract_element(self, elem: html.Element):
+        " add the link/table/text of an element and process its children "
+
         if elem.tag == "a" or elem.tag == "iframe":
             x = self.extract_link(elem)
             if x != None:
                tr = self.make_link_row(x)
-               self.link_container.append(tr)
+               self.add_link_row(tr)
         elif elem.tag == "table":
             ct = ContentTable(elem)
             if ct.contains_data():
                t = ct.reformat()
                if t != None:
                    self.indent_data_table(t)
-                   if len(self.table_container) == 0:
-                       self.table_container.text = "\n      "
-                   else:
-                       self.table_container.text = "\n      "
-                   self.table_container.append(t)
+                   self.add_data_table(t)
             return
         else:
-            ct = make_content_text(elem)
+            ct = make_content_text(elem, self.text_index)
             if ct != None and ct.contains_data():
                 div = ct.as_element()
-                div.tail = "\n      "
-                if len(self.text_container) == 0:
-                    self.text_container.tail = "\n    "
-                else:
-                    self.text_container.text = "\n      "
-                self.text_container.append(div)
+                self.add_content(div)
 
+        runs = self._hashes.runs.get(elem) if self._hashes != None else None
+        if runs != None:
+            self.process_runs(elem, runs)
+            return
         for ch in elem:
             self.process_element(ch)
 
+    def process_runs(self, elem: html.Element, runs: List[Tuple[int, int, str]]):
+        " process the children of an element that has hashed runs of leaves "
+        children = elem.iterchildren()
+        i = 0
+        for first, n, h in runs:
+            for ch in itertools.islice(children, first - i):
+                self.process_element(ch)
+
+            j = self._previous.find(h) if self._previous != None else -1
+            if j >= 0:
+                self.copy_previous(j)
+                for _ in itertools.islice(children, n): pass
+            else:
+                k = self.subtree_index.begin(h, self.counts())
+                for ch in itertools.islice(children, n):
+                    self.extract_element(ch)
+                self.subtree_index.end(k, self.counts())
+            i = first + n
+
+        for ch in children:
+            self.process_element(ch)
+
+    def process_hashed_element(self, elem: html.Element, h: str):
+        " copy what an unchanged subtree added to the previous extract, or process it and index it "
+
+        if self._previous != None:
+            i = self._previous.find(h)
+            if i >= 0:
+                self.copy_previous(i)
+                return
+
+        # changed: the deepest changed elements are the ones without a changed subtree below
+        if len(self._unmatched) > 0: self._unmatched[-1] = True
+        self._unmatched.append(False)
+
+        i = self.subtree_index.begin(h, self.counts())
+        self.extract_element(elem)
+        self.subtree_index.end(i, self.counts())
+
+        has_changes = self._unmatched.pop()
+        if not has_changes and self.changed != None:
+            self.changed.append(elem.getroottree().getpath(elem))
+
+    def copy_previous(self, i: int):
+        " copy the rows/tables/divs of entry i of the previous index "
+        self.subtree_index.copy_entries(self._previous, i, self.counts())
+
+        start, stop = self._previous.starts[i], self._previous.stops[i]
+        links, tables, texts = self._previous_rows
+        for x in links[start[0]:stop[0]]:
+            self.add_link_row(self.copy_extracted(x))
+        for x in tables[start[1]:stop[1]]:
+            self.add_data_table(self.copy_extracted(x))
+        for x in texts[start[2]:stop[2]]:
+            self.add_content(self.copy_extracted(x))
+        self.copied += 1
+
+    def copy_extracted(self, elem: html.Element) -> html.Element:
+        """ copy an element read back from an extract 
+
+        the empty text/tails we set (so pretty_print doesn't indent) are
+        None when read back, set them again.
+        """
+        elem = copy.deepcopy(elem)
+        for x in elem.iter():
+            if x.text == None and len(x) > 0: x.text = ""
+            if x.tail == None and not x is elem: x.tail = ""
+        return elem
+
 
     def extract(self, content: Union[bytes,str], item: ChangeItem) -> bytes:
         " Get Interesting Content from the HTML and reorganize it "
@@ -252,7 +351,54 @@ class HtmlExtracter:
         if content == None or len(content) == 0: return b''
 
         doc = html.fromstring(content)
+        doc_out = self.extract_tree(doc, item)
+
+        out_content = html.tostring(doc_out, pretty_print=True)
+        if type(content) == str:
+            out_content = out_content.decode()
+
+        if self.trace: logger.info(f"output ===>\n{out_content}<===\n")
+        return out_content
+
+    def extract_indexed(self, doc: html.Element, item: ChangeItem, 
+            previous: SubtreeIndex = None, previous_content: bytes = None) -> html.Element:
+        """ build the extract document and its SubtreeIndex 
+
+        with the index and extract of the previous version of the page, 
+        unchanged subtrees are copied from it and the paths of the deepest
+        changed elements are in self.changed (None without them).
+        """
+
+        self._previous, self._previous_rows = None, None
+        if previous != None and previous_content != None and previous.matches(previous_content):
+            self._previous_rows = self.read_extract_rows(previous_content)
+            if self._previous_rows != None: self._previous = previous
+
+        self.subtree_index = SubtreeIndex()
+        self.changed = [] if self._previous != None else None
+        self.copied = 0
+        self._unmatched = []
+        self._hashes = SubtreeHashes(doc)
+        try:
+            return self.extract_tree(doc, item)
+        finally:
+            self._hashes, self._previous, self._previous_rows, self._unmatched = None, None, None, None
+
+    def read_extract_rows(self, content: bytes) -> List[List[html.Element]]:
+        " link rows, data tables and content divs of an extract, None if it doesn't look like one "
+        doc = html.fromstring(content)
+        body = doc.find("body")
+        if body == None or len(body) < 3: return None
+        tables, texts, links = body[-3], body[-2], body[-1]
+        if tables.get("id") != "data" or texts.get("id") != "content" or links.get("id") != "links": return None
+        return [list(links), list(tables), list(texts)]
+
+    def extract_tree(self, doc: html.Element, item: ChangeItem) -> html.Element:
+        " build the extract document from a clean page "
+
+        self.text_index = TextIndex(case_pattern)
         self.process_element(doc)
+        self.text_index = None
 
         if len(self.text_container):
             self.text_container[-1].tail = "\n    "
@@ -273,13 +419,7 @@ class HtmlExtracter:
         doc_out[0].append(self.table_container)
         doc_out[0].append(self.text_container)
         doc_out[0].append(self.link_container)
-        
-        out_content = html.tostring(doc_out, pretty_print=True)
-        if type(content) == str:
-            out_content = out_content.decode()
-
-        if self.trace: logger.info(f"output ===>\n{out_content}<===\n")
-        return out_content
+        return doc_out
 
 
 
@@ -44,8 +44,13 @@ class HtmlFormater():
         base.attrib["ref"] = xurl
         tree.insert(0, base)
 
-    def format(self, xurl: str, content: bytes) -> bytes:
-        tree = html.fromstring(content)
+    def format_tree(self, xurl: str, tree: html.Element) -> html.Element:
+        " format a parsed page in place "
         self._inject_extra_elements(tree, xurl)
         self._indent_elem(tree, 1)        
+        return tree
+
+    def format(self, xurl: str, content: bytes) -> bytes:
+        tree = html.fromstring(content)
+        self.format_tree(xurl, tree)
         return html.tostring(tree)
@@ -0,0 +1,178 @@
+#
+# Offline Rebuild
+#
+#   runs one of the offline stages (format, clean, extract, convert) over
+#   the pages of the archive, e.g. after the cleaner rules change.
+#
+#   each page only reads its own input file and writes its own output
+#   file, so the pages can be spread over a process pool (lxml holds the
+#   GIL, threads don't help). the results are logged in key order as they
+#   come back, so a run with jobs > 1 logs and writes the same as a serial
+#   one.
+#
+#   the keys are sent to the workers in chunks, small enough that a few
+#   large pages don't leave the other workers idle at the end.
+#
+
+from typing import List, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+import time
+import os
+
+from shared.directory_cache import DirectoryCache
+from transform.change_list import ChangeItem
+from transform.cleaner_rules import CleanerRuleBook
+from transform.cleaner_backends import make_cleaner
+from transform.html_formater import HtmlFormater
+from transform.html_extracter import HtmlExtracter
+from transform.html_converter import HtmlConverter
+
+
+class RebuildContext:
+    " the caches and settings the stages need, sent once to each worker "
+
+    __slots__ = ("cache_raw", "cache_clean", "cache_extract", "cache_convert",
+        "cleaner_backend", "cleaner_rules")
+
+    def __init__(self, cache_raw: DirectoryCache, cache_clean: DirectoryCache,
+            cache_extract: DirectoryCache, cache_convert: DirectoryCache,
+            cleaner_backend: str, cleaner_rules: CleanerRuleBook):
+        self.cache_raw = cache_raw
+        self.cache_clean = cache_clean
+        self.cache_extract = cache_extract
+        self.cache_convert = cache_convert
+        self.cleaner_backend = cleaner_backend
+        self.cleaner_rules = cleaner_rules
+
+
+# -- the stages, one page each. returns a message if the page was skipped
+
+def format_page(ctx: RebuildContext, key: str, item: ChangeItem) -> str:
+    local_raw_content = ctx.cache_raw.read(key)
+    formater = HtmlFormater()
+    ctx.cache_raw.write(key, formater.format(None, local_raw_content))
+    return None
+
+def clean_page(ctx: RebuildContext, key: str, item: ChangeItem) -> str:
+    f_raw = ctx.cache_raw.open_read(key)
+    if f_raw == None: return "skip because the raw file is missing"
+
+    rules = ctx.cleaner_rules.for_page(key, item.url if item != None else None)
+    cleaner = make_cleaner(ctx.cleaner_backend, rules=rules)
+    with f_raw:
+        ctx.cache_clean.write_stream(key, lambda f_clean: cleaner.clean_file(f_raw, f_clean))
+    return None
+
+def extract_page(ctx: RebuildContext, key: str, item: ChangeItem) -> str:
+    if item == None: return "skip because it is a new item"
+    local_clean_content = ctx.cache_clean.read(key)
+    extracter = HtmlExtracter()
+    ctx.cache_extract.write(key, extracter.extract(local_clean_content, item))
+    return None
+
+def convert_page(ctx: RebuildContext, key: str, item: ChangeItem) -> str:
+    if item == None: return "skip because it is a new item"
+    local_extract_content = ctx.cache_extract.read(key)
+    converter = HtmlConverter()
+    xkey = key.replace(".html", ".json")
+    ctx.cache_convert.write(xkey, converter.convert(key, local_extract_content, item))
+    return None
+
+STAGES = {
+    "format": format_page,
+    "clean": clean_page,
+    "extract": extract_page,
+    "convert": convert_page,
+}
+
+
+# -- worker process
+
+_context: RebuildContext = None
+
+def _init_worker(ctx: RebuildContext):
+    global _context
+    _context = ctx
+
+def _run_page(job: Tuple[str, str, ChangeItem]) -> str:
+    stage, key, item = job
+    return STAGES[stage](_context, key, item)
+
+
+class RebuildProgress:
+    " logs how far a rebuild is, at most every interval seconds "
+
+    __slots__ = ("stage", "total", "done", "interval", "start", "last")
+
+    def __init__(self, stage: str, total: int, interval: float = 5.0):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = self.start
+
+    def update(self, n: int = 1):
+        self.done += n
+        t = time.perf_counter()
+        if self.done < self.total and t - self.last < self.interval: return
+        self.last = t
+
+        elapsed = t - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        msg = f"  {self.stage}: {self.done}/{self.total} pages ({self.done * 100 // max(1, self.total)}%), {rate:.1f} pages/sec"
+        if self.done < self.total and rate > 0:
+            msg += f", ETA {format_seconds((self.total - self.done) / rate)}"
+        else:
+            msg += f", took {format_seconds(elapsed)}"
+        logger.info(msg)
+
+def format_seconds(x: float) -> str:
+    " e.g. 1:05:09, 5:09 "
+    x = int(x + 0.5)
+    h, m, s = x // 3600, (x // 60) % 60, x % 60
+    return f"{h}:{m:02d}:{s:02d}" if h > 0 else f"{m}:{s:02d}"
+
+def job_count(jobs: int) -> int:
+    " number of processes for --jobs N, 0 means one per cpu "
+    if jobs == None or jobs < 0: return 1
+    if jobs == 0: return os.cpu_count() or 1
+    return jobs
+
+
+def rebuild_pages(stage: str, ctx: RebuildContext, pages: List[Tuple[str, Union[ChangeItem, None]]], 
+        jobs: int = 1) -> List[str]:
+    """ run a stage over (key, item) pairs with up to jobs processes
+
+    returns the keys that were built (not skipped). exceptions are raised
+    in the caller, same as a serial run.
+    """
+    if not stage in STAGES: raise Exception(f"Invalid stage: {stage}")
+    if len(pages) == 0: return []
+
+    jobs = min(job_count(jobs), len(pages))
+    progress = RebuildProgress(stage, len(pages))
+    logger.info(f"{stage} {len(pages)} pages with {jobs} process{'es' if jobs > 1 else ''}")
+
+    built = []
+    def report(key: str, msg: str):
+        logger.info(f"  {stage} {key}")
+        if msg != None: 
+            logger.warning(f"   {msg}")
+        else:
+            built.append(key)
+        progress.update()
+
+    if jobs == 1:
+        fn = STAGES[stage]
+        for key, item in pages:
+            report(key, fn(ctx, key, item))
+        return built
+
+    chunk_size = max(1, min(16, len(pages) // (jobs * 8)))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(ctx,)) as executor:
+        results = executor.map(_run_page, [(stage, key, item) for key, item in pages], chunksize=chunk_size)
+        for (key, _), msg in zip(pages, results):
+            report(key, msg)
+    return built
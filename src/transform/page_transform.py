@@ -0,0 +1,147 @@
+#
+# PageTransform
+#
+#   runs format -> clean -> extract -> convert for one fetched page
+#   parsing the html as few times as possible.
+#
+#   the formatted bytes are what we store in the raw cache and the
+#   cleaner is defined on those bytes (libxml2 moves the injected <base>
+#   into <head> when they are read back) so they are parsed once more.
+#   that tree is then cleaned, serialized and handed to the extracter
+#   in memory.
+#
+#   the extract document is rebuilt from a template with broken markup
+#   so the converter still reads the extracted bytes.
+#
+#   extract_indexed also hashes the clean tree (see subtree_hash.py) and
+#   copies what unchanged subtrees added to the previous extract.
+#
+#   diff compares the cleaned tree with the previous clean page (see
+#   tree_diff.py), it has to run before extract changes the tree.
+#
+
+from typing import Union
+from loguru import logger
+from lxml import html
+
+from transform.change_list import ChangeItem
+from transform.html_formater import HtmlFormater
+from transform.html_extracter import HtmlExtracter
+from transform.html_converter import HtmlConverter
+from transform.cleaner_rules import CleanerRules
+from transform.cleaner_backends import make_cleaner
+from transform.subtree_hash import SubtreeIndex
+from transform.tree_diff import TreeDiff, TreeDiffResult
+from shared.util import content_hash
+
+
+class PageTransform:
+    """ the transform stages of one page, sharing the parsed tree """
+
+    __slots__ = ("xurl", "rules", "cleaner_backend", "raw_content", "clean_content", "extract_content", 
+        "subtree_index", "changed", "_tree")
+
+    def __init__(self, xurl: str, rules: CleanerRules = None, cleaner_backend: str = None):
+        self.xurl = xurl
+        self.rules = rules
+        self.cleaner_backend = cleaner_backend
+        self.raw_content = None
+        self.clean_content = None
+        self.extract_content = None
+        self.subtree_index: SubtreeIndex = None
+        self.changed = None
+        self._tree = None
+
+    def format(self, content: bytes) -> bytes:
+        " format the downloaded page, same as HtmlFormater.format "
+        formater = HtmlFormater()
+        tree = html.fromstring(content)
+        formater.format_tree(self.xurl, tree)
+        self.raw_content = html.tostring(tree)
+        return self.raw_content
+
+    def clean(self) -> Union[bytes, None]:
+        " clean the formatted page, same as HtmlCleaner.clean "
+        self._tree = None
+        cleaner = make_cleaner(self.cleaner_backend, rules=self.rules)
+        try:
+            if self.raw_content == None:
+                self.clean_content = b''
+                return self.clean_content
+            tree = cleaner.parse(self.raw_content)
+            tree = cleaner.clean_tree(tree)
+        except Exception as ex:
+            logger.exception(ex)
+            logger.error("clean failed")
+            self.clean_content = None
+            return self.clean_content
+
+        try:
+            self.clean_content = html.tostring(tree)
+            self._tree = tree
+        except Exception as ex:
+            logger.error(ex)
+            logger.error("lxml failed on converting document to text")
+            self.clean_content = b''
+        return self.clean_content
+
+    def diff(self, previous_content: bytes) -> Union[TreeDiffResult, None]:
+        " what changed since the previous clean page, None if there is nothing to compare "
+        if self._tree == None or previous_content == None or len(previous_content) == 0: return None
+        try:
+            previous = html.fromstring(previous_content)
+            return TreeDiff().diff(previous, self._tree)
+        except Exception as ex:
+            logger.exception(ex)
+            logger.error("diff failed")
+            return None
+
+    def extract(self, item: ChangeItem) -> Union[bytes, None]:
+        " extract from the cleaned tree, same as HtmlExtracter.extract on the clean bytes "
+        tree, self._tree = self._tree, None
+        extracter = HtmlExtracter()
+        if tree == None or self.clean_content == None or len(self.clean_content) == 0:
+            self.extract_content = extracter.extract(self.clean_content, item)
+            return self.extract_content
+        try:
+            doc_out = extracter.extract_tree(tree, item)
+            self.extract_content = html.tostring(doc_out, pretty_print=True)
+        except Exception as ex:
+            logger.exception(ex)
+            logger.error("extract failed")
+            self.extract_content = None
+        return self.extract_content
+
+    def extract_indexed(self, item: ChangeItem, 
+            previous_index: bytes = None, previous_content: bytes = None) -> Union[bytes, None]:
+        """ extract from the cleaned tree and index it, same output as extract 
+
+        unchanged subtrees are copied from the previous extract if previous_index
+        is its index. sets subtree_index (None if the page couldn't be indexed)
+        and changed (the paths of the changed elements, None without a usable
+        previous extract).
+        """
+        self.subtree_index, self.changed = None, None
+        if self._tree == None: return self.extract(item)
+
+        tree, self._tree = self._tree, None
+        extracter = HtmlExtracter()
+        try:
+            previous = SubtreeIndex.from_bytes(previous_index)
+            doc_out = extracter.extract_indexed(tree, item, previous, previous_content)
+            self.extract_content = html.tostring(doc_out, pretty_print=True)
+        except Exception as ex:
+            logger.exception(ex)
+            logger.error("extract failed")
+            self.extract_content = None
+            return self.extract_content
+
+        self.subtree_index = extracter.subtree_index
+        self.subtree_index.extract_hash = content_hash(self.extract_content)
+        self.changed = extracter.changed
+        return self.extract_content
+
+    def convert(self, key: str, item: ChangeItem) -> Union[bytes, None]:
+        " convert the extracted page to json "
+        converter = HtmlConverter()
+        return converter.convert(key, self.extract_content, item)
@@ -0,0 +1,91 @@
+#
+# Rebuild Manifest
+#
+#   what each output of an offline stage was built from: the hash of its
+#   input and the version of the transform that wrote it (a hash of the
+#   code of the stage, plus the settings and rules for the page). with
+#   -c/-x/-j the offline rebuild only redoes the outputs whose input or
+#   version changed, like make. the startup path only builds the missing
+#   outputs.
+#
+#     clean:   raw -> clean
+#     extract: clean -> extract
+#     convert: extract -> convert
+#
+#   format has no manifest: it rewrites raw in place and formatting a
+#   formatted file again changes it, so it only runs when asked (-f).
+#
+#   there is one manifest per output cache (rebuild_manifest.json). the
+#   pipeline records the pages it writes while fetching too, so they
+#   aren't built again by the next offline run. outputs from before the
+#   manifest have no entry, so the first -c/-x/-j rebuilds them.
+#
+
+from typing import Dict, List
+import inspect
+
+from shared.directory_cache import DirectoryCache
+from shared.json_store import JsonStore
+from shared.util import content_hash
+from transform import html_cleaner, streaming_cleaner, cleaner_backends, cleaner_rules
+from transform import html_extracter, content_table, content_text, text_index, html_helpers
+from transform import html_converter, table_columns, field_rules
+
+# the code each stage's output depends on
+STAGE_MODULES = {
+    "clean": [html_cleaner, streaming_cleaner, cleaner_backends, cleaner_rules],
+    "extract": [html_extracter, content_table, content_text, text_index, html_helpers],
+    "convert": [html_converter, content_table, table_columns, field_rules],
+}
+
+_code_hashes: Dict[str, str] = {}
+
+def code_hash(stage: str) -> str:
+    " hash of the source of the modules of a stage "
+    h = _code_hashes.get(stage)
+    if h == None:
+        if not stage in STAGE_MODULES: raise Exception(f"Invalid stage: {stage}")
+        parts = [inspect.getsource(m) for m in STAGE_MODULES[stage]]
+        h = content_hash("\x00".join(parts).encode())
+        _code_hashes[stage] = h
+    return h
+
+def stage_version(stage: str, *settings: str) -> str:
+    """ version of a stage's transform for a page
+
+    settings are what else the output depends on, e.g. the cleaner
+    backend and the fingerprint of the page's rules.
+    """
+    if len(settings) == 0: return code_hash(stage)
+    return content_hash("\x00".join([code_hash(stage)] + [str(x) for x in settings]).encode())
+
+
+class RebuildManifest:
+    """ input hash and version of each output of a stage """
+
+    __slots__ = ("stage", "store")
+
+    def __init__(self, stage: str, cache: DirectoryCache):
+        " cache is the output cache of the stage "
+        self.stage = stage
+        self.store = JsonStore(cache, "rebuild_manifest.json")
+
+    def is_current(self, key: str, input_hash: str, version: str) -> bool:
+        x = self.store.get(key)
+        return x != None and x.get("input") == input_hash and x.get("version") == version
+
+    def has_entry(self, key: str) -> bool:
+        return self.store.get(key) != None
+
+    def record(self, key: str, input_hash: str, version: str):
+        " an output was built from an input with this hash "
+        if input_hash == None:
+            self.store.remove(key)
+        else:
+            self.store.set(key, { "input": input_hash, "version": version })
+
+    def remove(self, key: str):
+        self.store.remove(key)
+
+    def save(self):
+        self.store.save()
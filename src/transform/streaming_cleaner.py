@@ -0,0 +1,179 @@
+#
+# StreamingHtmlCleaner
+#
+#   HtmlCleaner that parses a page in chunks and empties the removed tags,
+#   comments and processing instructions while the page is being parsed,
+#   so a page with megabytes of inline script/json never has all of it
+#   in one tree.
+#
+#   uses lxml's HTMLPullParser (the same libxml2 tree builder as
+#   html.fromstring, so the kept part of the tree is identical). the
+#   parser only reports the start/end of the tags we remove.
+#
+#     - libxml2's html push parser keeps all the input it was fed, so the
+#       content of a removed <script>/<style> is not fed at all. once the
+#       parser is inside one and a whole chunk went by without an end tag,
+#       the bytes up to the next </script (or </style) are skipped. the
+#       element is still parsed, it just has less text.
+#     - while a removed element is still open, everything parsed into it
+#       so far is freed after each chunk. only the text node libxml2 is
+#       appending to is left (it starts a new one when that is gone).
+#     - a removed element is emptied when it ends but stays in the tree,
+#       with its tail, as a placeholder. the walk removes it like any
+#       other, so the twitter cluster check sees the same siblings as
+#       HtmlCleaner. an element the check could match ("> ago" in it) is
+#       kept whole, or gets " ago" as its text if part of it was freed.
+#       the one case that can still differ is a "> ago" split by the edge
+#       of a freed part inside a removed element bigger than a chunk.
+#
+#   the reduced tree then gets the normal clean_tree walk and clean_file
+#   writes it out with lxml's incremental writer, so peak memory is about
+#   the page without its scripts/styles plus the output rather than
+#   the page plus two copies of it.
+#
+
+from typing import BinaryIO, Dict, Iterable, List, Set, Union
+from itertools import chain
+from lxml import html, etree
+import re
+
+from transform.html_cleaner import HtmlCleaner
+
+# what lxml.html.fromstring treats as a full document, anything else is a fragment
+_full_html = re.compile(rb"^\s*<(?:html|!doctype)", re.I)
+
+# raw text elements, libxml2 only looks for their end tag in them
+_raw_text_end: Dict[str, re.Pattern] = {
+    "script": re.compile(rb"</script", re.I),
+    "style": re.compile(rb"</style", re.I),
+}
+
+# bytes below 0x40 are always a whole character in utf-8, latin-1 and the
+# cjk multibyte encodings (trail bytes are >= 0x40), so we can cut there
+_whole_char = re.compile(rb"[\x01-\x3f]")
+
+def _skip_raw_text(prev: bytes, chunk: bytes, end_tag: re.Pattern) -> bytes:
+    " drop the part of chunk that is inside an open script/style "
+
+    # utf-16/32 and iso-2022 (escape sequences) are fed as they are
+    if b"\0" in chunk or b"\x1b" in chunk: return chunk
+
+    # an end tag split between the chunks
+    x = end_tag.search(prev[-16:] + chunk[:16])
+    if x != None and x.start() < len(prev[-16:]): return chunk
+
+    x = end_tag.search(chunk)
+    if x != None:
+        end = x.start()
+    else:
+        # keep the end of the chunk, it could be the start of the end tag
+        end = len(chunk) - 16
+        while end > 0 and chunk[end] >= 0x40: end -= 1
+    if end <= 0: return chunk
+    x = _whole_char.search(chunk, 0, end)
+    if x == None: return chunk
+    return chunk[:x.start()] + chunk[end:]
+
+
+def _in_removed(elem: html.Element, tags: Set[str]) -> bool:
+    " the element is inside a removed element "
+    elem = elem.getparent()
+    while elem != None:
+        if elem.tag in tags: return True
+        elem = elem.getparent()
+    return False
+
+def _has_ago(elem: html.Element) -> bool:
+    " what the twitter cluster check looks for in the last element "
+    return b"> ago" in html.tostring(elem, with_tail=False)
+
+def _empty(elem: html.Element, ago: bool):
+    " leave a placeholder for the walk to remove, with its tail "
+    elem.text = " ago" if ago else None
+    for child in list(elem):
+        elem.remove(child)
+
+def _free_open(elem: html.Element):
+    " free what has been parsed so far inside an element that is still open "
+    while True:
+        elem.text = None
+        if len(elem) == 0: return
+        for child in elem[:-1]:
+            elem.remove(child)
+        elem = elem[-1]
+        elem.tail = None
+
+
+class StreamingHtmlCleaner(HtmlCleaner):
+    """ HtmlCleaner that drops removed subtrees while parsing """
+
+    chunk_size = 64 * 1024
+
+    def parse_chunks(self, chunks: Iterable[bytes]) -> html.Element:
+        " parse a full html document fed in chunks, without the removed tags "
+
+        tags = [*self.rules.remove_tags, etree.Comment, etree.ProcessingInstruction]
+        parser = etree.HTMLPullParser(events=("start", "end", "comment", "pi"), tag=tags)
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+
+        remove_tags = set(self.rules.remove_tags)
+        opened: List[html.Element] = []
+        ago: Set[html.Element] = set()
+        raw_elem, skip, prev = None, None, b""
+
+        def closed(elem: html.Element):
+            if not isinstance(elem.tag, str) or not _in_removed(elem, remove_tags):
+                if not _has_ago(elem): _empty(elem, elem in ago)
+            ago.discard(elem)
+
+        for chunk in chunks:
+            # the twitter cluster check needs to know if the part that is
+            # skipped or freed had "> ago" in it
+            if raw_elem != None:
+                x = _raw_text_end[raw_elem.tag].search(chunk)
+                if b"> ago" in prev[-4:] + chunk[:x.start() if x != None else len(chunk)]:
+                    ago.add(opened[0])
+
+            parser.feed(chunk if skip == None else _skip_raw_text(prev, chunk, skip))
+            for event, elem in parser.read_events():
+                if event == "start":
+                    opened.append(elem)
+                    continue
+                if event == "end": opened.remove(elem)
+                closed(elem)
+            if len(opened) > 0:
+                if _has_ago(opened[0]): ago.add(opened[0])
+                _free_open(opened[0])
+
+            # skip the next chunk if we are still in the same script/style
+            # and this one didn't have anything like its end tag
+            elem = opened[-1] if len(opened) > 0 else None
+            end_tag = _raw_text_end.get(elem.tag) if elem != None else None
+            if end_tag != None and elem == raw_elem and end_tag.search(chunk) == None:
+                skip = end_tag
+            else:
+                skip = None
+            raw_elem = elem if end_tag != None else None
+            prev = chunk
+
+        doc = parser.close()
+        for event, elem in parser.read_events():
+            if event != "start": closed(elem)
+        return doc
+
+    def parse(self, content: Union[bytes,str]) -> html.Element:
+        " parse a page for clean_tree, fragments and str are parsed as a whole "
+        if type(content) != bytes or _full_html.match(content) == None:
+            return super().parse(content)
+
+        n = self.chunk_size
+        return self.parse_chunks(content[i:i + n] for i in range(0, len(content), n))
+
+    def parse_file(self, f: BinaryIO) -> html.Element:
+        " parse a page from a binary file a chunk at a time "
+        first = f.read(self.chunk_size)
+        if _full_html.match(first) == None:
+            return super().parse(first + f.read())
+
+        rest = iter(lambda: f.read(self.chunk_size), b"")
+        return self.parse_chunks(chain([first], rest))
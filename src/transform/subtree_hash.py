@@ -0,0 +1,226 @@
+#
+# Subtree Hash
+#
+#   a Merkle hash of every element of a clean page that has children:
+#   the hash of its tag, attributes, text and tail, the fields of its
+#   children without children and the hashes of the others. two
+#   elements with the same hash have the same markup, tail included.
+#   runs of children without children (rows of a long list, the spans
+#   of a code listing) are hashed too, in groups of up to 32.
+#
+#   what the extracter adds for an element only depends on its subtree,
+#   so SubtreeIndex keeps, for each hashed element (or run) it processed,
+#   in document order, its hash and how many link rows, tables and
+#   content divs the extract had before and after it. it is kept per
+#   key next to the extract it describes, so when the page changes the
+#   extracter can copy what unchanged subtrees added to the previous
+#   extract and only process the rest.
+#
+#   single elements without children are not hashed on their own: they
+#   are cheaper to extract again than to look up.
+#
+#   subtree_keys gives every element a key, for matching the elements of
+#   two versions of a page (see tree_diff.py).
+#
+
+from typing import Dict, List, Tuple
+from lxml import html
+import hashlib
+import json
+import time
+
+from shared.util import content_hash
+
+# number of link rows, tables and content divs in the extract
+Counts = Tuple[int, int, int]
+
+# leaves hashed together
+run_size = 32
+# shorter runs are part of their parent's record
+min_run_size = 8
+
+
+def _record(elem: html.Element) -> str:
+    " tag, text, tail and attributes "
+    tag = elem.tag
+    if type(tag) != str: tag = "#" + type(elem).__name__
+    attrs = elem.items()
+    if attrs:
+        return "\x02".join([tag, elem.text or "", elem.tail or "", "\x02".join(["\x02".join(x) for x in attrs])])
+    return "\x02".join([tag, elem.text or "", elem.tail or ""])
+
+def _hash(parts: List[str]) -> str:
+    return hashlib.blake2b("\x01".join(parts).encode("utf-8", "surrogatepass"), digest_size=8).hexdigest()
+
+
+class SubtreeHashes:
+    """ hashes of the elements with children and of the runs of leaves of a page """
+
+    __slots__ = ("elements", "runs")
+
+    def __init__(self, root: html.Element):
+        self.elements: Dict[html.Element, str] = {}
+        # (first child, number of children, hash) of the hashed runs of an element
+        self.runs: Dict[html.Element, List[Tuple[int, int, str]]] = {}
+        if len(root) > 0: self._build(root)
+
+    def _end_run(self, elem: html.Element, parts: List[str], run: List[str], first: int):
+        if len(run) >= min_run_size:
+            h = _hash(run)
+            x = self.runs.get(elem)
+            if x == None: 
+                x = []
+                self.runs[elem] = x
+            x.append((first, len(run), h))
+            parts.append("\x03" + h)
+        else:
+            parts.extend(run)
+        run.clear()
+
+    def _build(self, root: html.Element):
+        elements = self.elements
+
+        # [element, its remaining children, parts of its record, next child, leaves of the current run, first leaf]
+        stack = [[root, iter(root), [_record(root)], 0, [], 0]]
+        while len(stack) > 0:
+            top = stack[-1]
+            elem, children, parts, i, run = top[0], top[1], top[2], top[3], top[4]
+            for ch in children:
+                i += 1
+                if len(ch) == 0:
+                    if len(run) == 0: top[5] = i - 1
+                    run.append(_record(ch))
+                    if len(run) == run_size: self._end_run(elem, parts, run, top[5])
+                else:
+                    if len(run) > 0: self._end_run(elem, parts, run, top[5])
+                    top[3] = i
+                    stack.append([ch, iter(ch), [_record(ch)], 0, [], 0])
+                    break
+            else:
+                if len(run) > 0: self._end_run(elem, parts, run, top[5])
+                stack.pop()
+                h = _hash(parts)
+                elements[elem] = h
+                if len(stack) > 0: stack[-1][2].append("\x03" + h)
+
+
+def subtree_keys(root: html.Element, deadline: float = None) -> Dict[html.Element, str]:
+    """ a key for every element below root (root included) 
+
+    the Merkle hash of the elements with children and the fields of
+    the others. elements with the same key have the same markup.
+    returns None if it is still running at deadline (a perf_counter time).
+    """
+    keys = {}
+    if len(root) == 0:
+        keys[root] = _record(root)
+        return keys
+
+    # (element, its remaining children, parts of its record)
+    stack = [(root, iter(root), [_record(root)])]
+    while len(stack) > 0:
+        elem, children, parts = stack[-1]
+        for ch in children:
+            if len(ch) == 0:
+                k = _record(ch)
+                keys[ch] = k
+                parts.append(k)
+            else:
+                stack.append((ch, iter(ch), [_record(ch)]))
+                break
+        else:
+            stack.pop()
+            h = "\x03" + _hash(parts)
+            keys[elem] = h
+            if len(stack) > 0: stack[-1][2].append(h)
+            if deadline != None and time.perf_counter() > deadline: return None
+    return keys
+
+
+class SubtreeIndex:
+    """ hash and extract counts of the processed elements of a page, in document order """
+
+    __slots__ = ("hashes", "ends", "starts", "stops", "extract_hash", "_positions")
+
+    # bump when the extract output changes, older indexes are ignored
+    version = 1
+
+    def __init__(self):
+        self.hashes: List[str] = []
+        # index after the last entry in each subtree
+        self.ends: List[int] = []
+        # counts when the subtree starts and stops
+        self.starts: List[Counts] = []
+        self.stops: List[Counts] = []
+
+        # content_hash of the extract the counts are for
+        self.extract_hash: str = None
+
+        self._positions: Dict[str, int] = None
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def begin(self, h: str, counts: Counts) -> int:
+        " start the entry for an element, returns its position "
+        self.hashes.append(h)
+        self.ends.append(-1)
+        self.starts.append(counts)
+        self.stops.append(None)
+        return len(self.hashes) - 1
+
+    def end(self, i: int, counts: Counts):
+        " close the entry of an element after its subtree "
+        self.ends[i] = len(self.hashes)
+        self.stops[i] = counts
+
+    def copy_entries(self, other: "SubtreeIndex", i: int, counts: Counts):
+        " add the entries of other's subtree at i, moved to start at counts "
+        start, end = other.starts[i], other.ends[i]
+        d0, d1, d2 = counts[0] - start[0], counts[1] - start[1], counts[2] - start[2]
+        offset = len(self.hashes) - i
+        self.hashes.extend(other.hashes[i:end])
+        self.ends.extend([x + offset for x in other.ends[i:end]])
+        self.starts.extend([(a + d0, b + d1, c + d2) for a, b, c in other.starts[i:end]])
+        self.stops.extend([(a + d0, b + d1, c + d2) for a, b, c in other.stops[i:end]])
+
+    def find(self, h: str) -> int:
+        " position of an entry with hash h, -1 if there is none "
+        if self._positions == None:
+            positions = {}
+            for i, x in enumerate(self.hashes):
+                if not x in positions: positions[x] = i
+            self._positions = positions
+        return self._positions.get(h, -1)
+
+    def to_bytes(self) -> bytes:
+        x = {
+            "version": SubtreeIndex.version,
+            "extract_hash": self.extract_hash,
+            "hashes": self.hashes,
+            "ends": self.ends,
+            "counts": [list(a) + list(b) for a, b in zip(self.starts, self.stops)]
+        }
+        return json.dumps(x, separators=(",", ":")).encode()
+
+    @staticmethod
+    def from_bytes(content: bytes) -> "SubtreeIndex":
+        " read an index, None if it is missing, broken or from another version "
+        if content == None or len(content) == 0: return None
+        try:
+            x = json.loads(content)
+            if x.get("version") != SubtreeIndex.version: return None
+            index = SubtreeIndex()
+            index.extract_hash = x["extract_hash"]
+            index.hashes = x["hashes"]
+            index.ends = x["ends"]
+            index.starts = [tuple(c[0:3]) for c in x["counts"]]
+            index.stops = [tuple(c[3:6]) for c in x["counts"]]
+        except (ValueError, KeyError, TypeError, IndexError):
+            return None
+        if len(index.ends) != len(index.hashes) or len(index.starts) != len(index.hashes): return None
+        return index
+
+    def matches(self, extract_content: bytes) -> bool:
+        " if the index is for this extract "
+        return self.extract_hash != None and self.extract_hash == content_hash(extract_content)
@@ -0,0 +1,165 @@
+#
+# Table Columns
+#
+#   the rows of an extracted table (ContentTable.rows) as typed columns.
+#
+#   the cells are parsed as numbers all at once (one regex over all the
+#   cells of the tables of a page with pandas, not one call per cell):
+#
+#     "1,234"          -> 1234
+#     "12.5%"          -> 12.5 (percent)
+#     "1,234 (12.5%)"  -> 1234, and 12.5 in the column's percents
+#
+#   a column where every cell is a number (or a placeholder like "-" or
+#   "N/A") is int, float or percent, the others are text. the first row
+#   is the header if it is all <th> or it is all text and the rows after
+#   it have numbers.
+#
+
+from typing import Dict, List, Tuple, Union
+import numpy as np
+import pandas as pd
+
+NUMBER_PATTERN = (r"^\s*([-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|[-+]?\.\d+)\s*(%)?"
+    + r"\s*(?:\(\s*([-+]?\d+(?:\.\d+)?)\s*%\s*\))?\s*$")
+
+# cells that mean "no value"
+MISSING_VALUES = ["", "-", "--", "*", "n/a", "na", "none", "tbd", "pending"]
+
+
+class ParsedCells:
+    " numbers parsed out of a list of cells "
+
+    __slots__ = ("numbers", "percents", "is_missing", "is_number", "has_percent", "has_point")
+
+    def __init__(self, cells: List[str]):
+        if len(cells) == 0: cells = [None]
+        s = pd.Series(cells, dtype=object)
+        m = s.str.extract(NUMBER_PATTERN, expand=True)
+        self.numbers = pd.to_numeric(m[0].str.replace(",", "", regex=False), errors="coerce").to_numpy(dtype=float)
+        self.percents = pd.to_numeric(m[2], errors="coerce").to_numpy(dtype=float)
+        self.is_number = ~np.isnan(self.numbers)
+        self.is_missing = (s.isna() | s.str.strip().str.lower().isin(MISSING_VALUES)).to_numpy(dtype=bool)
+        self.has_percent = m[1].notna().to_numpy(dtype=bool)
+        self.has_point = m[0].str.contains(".", regex=False).fillna(False).to_numpy(dtype=bool)
+
+
+def _as_list(values: np.ndarray, mask: np.ndarray, as_int: bool) -> List:
+    " values as python numbers, None where mask is False "
+    x = np.nan_to_num(values).astype(np.int64) if as_int else values
+    return [v if m else None for v, m in zip(x.tolist(), mask.tolist())]
+
+def _columns(rows: List[List[str]]) -> List[List[str]]:
+    " the cells of rows by column, short rows padded with None "
+    n_cols = max((len(r) for r in rows), default=0)
+    return [[r[i] if i < len(r) else None for r in rows] for i in range(n_cols)]
+
+def read_tables(tables: List[Tuple[List[List[str]], str, bool]]) -> List["TableColumns"]:
+    " (rows, caption, has_header) of the tables of a page as TableColumns, parsing all their cells at once "
+    if len(tables) == 0: return []
+    cells = [_columns(rows) for rows, _, _ in tables]
+    parsed = ParsedCells([x for t in cells for col in t for x in col])
+    result = []
+    offset = 0
+    for (rows, caption, has_header), t in zip(tables, cells):
+        result.append(TableColumns(rows, caption, has_header, parsed, offset))
+        offset += sum(len(col) for col in t)
+    return result
+
+
+class TableColumns:
+    """ a table as named, typed columns """
+
+    __slots__ = ("caption", "names", "types", "values", "percents", "numbers")
+
+    def __init__(self, rows: List[List[str]], caption: str = None, has_header: bool = None,
+            parsed: ParsedCells = None, offset: int = 0):
+        " parsed is for the cells of several tables (see read_tables), this table's start at offset "
+        self.caption = caption if caption != "" else None
+        self.names: List[str] = []
+        self.types: List[str] = []
+        # name -> values (int, float, str or None)
+        self.values: Dict[str, List] = {}
+        # name -> the "(x%)" after the numbers, for the columns that have them
+        self.percents: Dict[str, List] = {}
+        # name -> parsed numbers (nan if missing) of the numeric columns, for FieldRules
+        self.numbers: Dict[str, np.ndarray] = {}
+
+        cells = _columns(rows)
+        n_cols, n_rows = len(cells), len(rows)
+        if n_cols == 0: return
+
+        # column by column
+        if parsed == None: parsed, offset = ParsedCells([x for col in cells for x in col]), 0
+        shape = (n_cols, n_rows)
+        def part(x: np.ndarray) -> np.ndarray:
+            return x[offset:offset + n_cols * n_rows].reshape(shape)
+        numbers, percents = part(parsed.numbers), part(parsed.percents)
+        is_number, is_missing = part(parsed.is_number), part(parsed.is_missing)
+        has_percent, has_point = part(parsed.has_percent), part(parsed.has_point)
+
+        if has_header == None:
+            first_is_text = not (is_number[:, 0] | is_missing[:, 0]).any()
+            has_header = first_is_text and n_rows > 1 and is_number[:, 1:].any()
+        start = 1 if has_header and n_rows > 0 else 0
+
+        for i in range(n_cols):
+            name = cells[i][0] if start == 1 else None
+            name = self._unique_name(name, i)
+
+            present = ~is_missing[i, start:]
+            col_numbers = numbers[i, start:]
+            if not present.any():
+                kind = "empty"
+            elif (is_number[i, start:] | ~present).all():
+                col_percent, col_point = has_percent[i, start:][present], has_point[i, start:][present]
+                integral = (np.nan_to_num(col_numbers) % 1 == 0).all()
+                if col_percent.all():
+                    kind = "percent"
+                elif not col_point.any() and not col_percent.any() and integral:
+                    kind = "int"
+                else:
+                    kind = "float"
+            else:
+                kind = "text"
+
+            self.names.append(name)
+            self.types.append(kind)
+            if kind == "text" or kind == "empty":
+                self.values[name] = [x.strip() if x != None and p else None for x, p in zip(cells[i][start:], present)]
+                continue
+
+            mask = present & is_number[i, start:]
+            self.values[name] = _as_list(col_numbers, mask, kind == "int")
+            self.numbers[name] = np.where(mask, col_numbers, np.nan)
+            col_percents = percents[i, start:]
+            if (~np.isnan(col_percents)).any():
+                self.percents[name] = _as_list(col_percents, ~np.isnan(col_percents), False)
+
+    def _unique_name(self, name: Union[str, None], i: int) -> str:
+        name = name.strip() if name != None else ""
+        if name == "": name = f"column {i + 1}"
+        if not name in self.names: return name
+        n = 2
+        while f"{name} {n}" in self.names: n += 1
+        return f"{name} {n}"
+
+    def __len__(self) -> int:
+        " number of rows "
+        return len(self.values[self.names[0]]) if len(self.names) > 0 else 0
+
+    def labels(self) -> List[str]:
+        " the first text column, what the rows are about (e.g. Total, Deaths) "
+        for n, t in zip(self.names, self.types):
+            if t == "text": return self.values[n]
+        return None
+
+    def to_dict(self) -> Dict:
+        x = {
+            "caption": self.caption,
+            "columns": self.names,
+            "types": self.types,
+            "data": self.values
+        }
+        if len(self.percents) > 0: x["percents"] = self.percents
+        return x
@@ -0,0 +1,169 @@
+#
+# TextIndex
+#
+#   the text of every subtree of a clean page, so the extracter doesn't
+#   walk nested subtrees again for each element (that was quadratic on
+#   deeply nested pages).
+#
+#     link_text(elem)  -- the element's text, the link text of each child and
+#                         its tail, separated by spaces (HtmlExtracter links)
+#     child_text(elem) -- the text and tails of everything below the element,
+#                         without what is inside tables and iframes, separated
+#                         by spaces (ContentText)
+#     child_text_marked(elem) -- if any piece of child_text matches the mark
+#                         regex. the mark can't match across a space.
+#
+#   the first query for an element indexes its whole subtree in one pass
+#   and every element in it is answered from that. the extracter asks
+#   for parents before children, so each element is indexed once and
+#   subtrees that are never asked about (no text) are never indexed.
+#   link text and child text are indexed separately and elements
+#   without children (most links) are answered directly.
+#
+#   link text is one string per pass and each element has a slice of it.
+#   child text is a list of stripped pieces per segment (tables and
+#   iframes start a new one) and each element has a range of it, with
+#   a running count of the pieces that match the mark.
+#
+
+from typing import Dict, List, Tuple
+from lxml import html, etree
+import re
+
+# their content isn't part of their parents' child text
+_own_segment = frozenset(["table", "iframe"])
+
+
+class TextSegment:
+    " stripped text pieces and a running count of the marked ones "
+
+    __slots__ = ("pieces", "marked")
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.marked: List[int] = [0]
+
+
+class LinkText:
+    " the link text of one indexed subtree "
+
+    __slots__ = ("text",)
+
+    def __init__(self):
+        self.text = ""
+
+
+class TextIndex:
+    """ text of every subtree, indexed on first use """
+
+    __slots__ = ("mark", "_link", "_child")
+
+    def __init__(self, mark: re.Pattern = None):
+        self.mark = mark
+        self._link: Dict[html.Element, Tuple[LinkText, int, int]] = {}
+        self._child: Dict[html.Element, Tuple[TextSegment, int, int]] = {}
+
+    def _build_links(self, root: html.Element):
+        link_text = LinkText()
+        links = self._link
+
+        parts: List[str] = []
+        n = 0
+        starts: List[int] = []
+
+        for event, elem in etree.iterwalk(root, events=("start", "end")):
+            if event == "start":
+                # the space is taken back if the element has no link text
+                if len(starts) > 0:
+                    parts.append(" ")
+                    n += 1
+                starts.append(n)
+                t = elem.text
+                if t != None:
+                    t = t.strip()
+                    if t != "":
+                        parts.append(t)
+                        n += len(t)
+            else:
+                start = starts.pop()
+                t = elem.tail
+                if t != None:
+                    t = t.strip()
+                    if t != "":
+                        parts.append(" ")
+                        parts.append(t)
+                        n += 1 + len(t)
+                links[elem] = (link_text, start, n)
+                if n == start and len(starts) > 0:
+                    parts.pop()
+                    n -= 1
+
+        link_text.text = "".join(parts)
+
+    def _build_children(self, root: html.Element):
+        search = self.mark.search if self.mark != None else None
+        children = self._child
+
+        seg = TextSegment()
+        # (segment of its children, first piece) of each open element
+        stack = [(seg, 0)]
+
+        for event, elem in etree.iterwalk(root, events=("start", "end")):
+            if event == "start":
+                if elem is root: continue
+                t = elem.text
+                if t != None:
+                    t = t.strip()
+                    if t != "":
+                        seg.pieces.append(t)
+                        seg.marked.append(seg.marked[-1] + (1 if search != None and search(t) != None else 0))
+                if elem.tag in _own_segment: seg = TextSegment()
+                stack.append((seg, len(seg.pieces)))
+            else:
+                seg, first = stack.pop()
+                if not elem.tag in _own_segment:
+                    children[elem] = (seg, first, len(seg.pieces))
+                if len(stack) == 0: break
+
+                seg = stack[-1][0]
+                t = elem.tail
+                if t != None:
+                    t = t.strip()
+                    if t != "":
+                        seg.pieces.append(t)
+                        seg.marked.append(seg.marked[-1] + (1 if search != None and search(t) != None else 0))
+
+    def link_text(self, elem: html.Element) -> str:
+        " text, children's link text and tail of an element "
+        x = self._link.get(elem)
+        if x == None:
+            if len(elem) == 0:
+                t, tail = elem.text, elem.tail
+                t = t.strip() if t != None else ""
+                tail = tail.strip() if tail != None else ""
+                return t + " " + tail if tail != "" else t
+            self._build_links(elem)
+            x = self._link[elem]
+        link_text, start, end = x
+        return link_text.text[start:end]
+
+    def _child_range(self, elem: html.Element) -> Tuple[TextSegment, int, int]:
+        if len(elem) == 0: return None
+        if not elem in self._child:
+            if elem.tag in _own_segment: return None
+            self._build_children(elem)
+        return self._child.get(elem)
+
+    def child_text(self, elem: html.Element) -> str:
+        " text below an element, without the content of tables/iframes "
+        x = self._child_range(elem)
+        if x == None: return ""
+        seg, i, j = x
+        return " ".join(seg.pieces[i:j])
+
+    def child_text_marked(self, elem: html.Element) -> bool:
+        " if a piece of child_text matches the mark "
+        x = self._child_range(elem)
+        if x == None: return False
+        seg, i, j = x
+        return seg.marked[j] > seg.marked[i]
@@ -0,0 +1,239 @@
+#
+# Tree Diff
+#
+#   what changed between two versions of a clean page, element by element.
+#
+#   every element of both trees gets a key (subtree_keys: a Merkle hash,
+#   or the fields of a leaf), so identical subtrees are skipped without
+#   looking inside them. for two elements that differ, their own fields
+#   are compared and their children are lined up:
+#
+#     1. the common prefix and suffix of identical children,
+#     2. identical children in the middle, in order (anchors),
+#     3. between anchors, children with the same tag are paired and
+#        compared the same way, the rest were removed or added.
+#
+#   each element is looked at once, so the time is linear in the size
+#   of the pages. the ops are capped (max_ops) and the keys and the walk
+#   stop after max_seconds, the result is marked as truncated then (with
+#   no ops if the keys weren't done).
+#
+#   ops (paths are XPaths in the new page, in the old one for removes):
+#     {"op": "text"|"tail", "path", "old", "new"}
+#     {"op": "attrib", "path", "name", "old", "new"}
+#     {"op": "add"|"remove", "path", "text"}
+#     {"op": "replace", "path", "old", "new"}      (the root tags differ)
+#
+
+from typing import Dict, List, Tuple
+from lxml import html
+import time
+
+from transform.subtree_hash import subtree_keys
+
+
+def _short(s: str, n: int) -> str:
+    if s == None: return None
+    s = " ".join(s.split())
+    return s if len(s) <= n else s[:n] + " ..."
+
+def _tag(elem: html.Element) -> str:
+    tag = elem.tag
+    return tag if type(tag) == str else "#" + type(elem).__name__
+
+
+class TreeDiffResult:
+    """ the ops between two pages """
+
+    __slots__ = ("ops", "changed", "added", "removed", "truncated", "elapsed")
+
+    def __init__(self):
+        self.ops: List[Dict] = []
+        self.changed = 0
+        self.added = 0
+        self.removed = 0
+        self.truncated = False
+        self.elapsed = 0.0
+
+    def summary(self) -> str:
+        " e.g. '2 changed, 1 added' "
+        parts = []
+        if self.changed > 0: parts.append(f"{self.changed} changed")
+        if self.added > 0: parts.append(f"{self.added} added")
+        if self.removed > 0: parts.append(f"{self.removed} removed")
+        if self.truncated: 
+            parts.append("truncated")
+        elif len(parts) == 0: 
+            parts.append("same")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "summary": self.summary(),
+            "changed": self.changed, "added": self.added, "removed": self.removed,
+            "truncated": self.truncated,
+            "ops": self.ops
+        }
+
+
+class TreeDiff:
+    """ diff two versions of a clean page """
+
+    __slots__ = ("max_ops", "max_seconds", "max_text",
+        "_old_keys", "_new_keys", "_old_tree", "_new_tree", "_result")
+
+    def __init__(self, max_ops: int = 200, max_seconds: float = 2.0, max_text: int = 120):
+        self.max_ops = max_ops
+        self.max_seconds = max_seconds
+        self.max_text = max_text
+
+    def diff(self, old_root: html.Element, new_root: html.Element) -> TreeDiffResult:
+        " the ops that turn old_root into new_root "
+
+        start = time.perf_counter()
+        deadline = start + self.max_seconds
+
+        result = TreeDiffResult()
+        self._result = result
+        self._old_tree, self._new_tree = old_root.getroottree(), new_root.getroottree()
+        try:
+            old_keys = subtree_keys(old_root, deadline)
+            new_keys = subtree_keys(new_root, deadline) if old_keys != None else None
+            if new_keys == None:
+                result.truncated = True
+                return result
+            self._old_keys, self._new_keys = old_keys, new_keys
+
+            if _tag(old_root) != _tag(new_root):
+                self._add_op({ "op": "replace", "path": self._new_path(new_root),
+                    "old": _tag(old_root), "new": _tag(new_root) })
+                result.changed += 1
+                return result
+
+            stack = [(old_root, new_root)]
+            while len(stack) > 0:
+                if len(result.ops) >= self.max_ops or time.perf_counter() > deadline:
+                    result.truncated = True
+                    break
+                a, b = stack.pop()
+                if old_keys[a] == new_keys[b]: continue
+
+                self._compare_fields(a, b)
+                pairs = self._match_children(a, b)
+                pairs.reverse()
+                stack.extend(pairs)
+        finally:
+            self._old_keys, self._new_keys, self._old_tree, self._new_tree, self._result = None, None, None, None, None
+            result.elapsed = time.perf_counter() - start
+        return result
+
+    def _new_path(self, elem: html.Element) -> str:
+        return self._new_tree.getpath(elem)
+
+    def _add_op(self, op: Dict):
+        self._result.ops.append(op)
+
+    def _compare_fields(self, a: html.Element, b: html.Element):
+        " text, tail and attributes of two paired elements "
+        result = self._result
+        n = self.max_text
+
+        changed = False
+        for name, x, y in (("text", a.text, b.text), ("tail", a.tail, b.tail)):
+            if (x or "") != (y or ""):
+                self._add_op({ "op": name, "path": self._new_path(b), "old": _short(x, n), "new": _short(y, n) })
+                changed = True
+        if a.attrib != b.attrib:
+            old_attrib, new_attrib = dict(a.attrib), dict(b.attrib)
+            for name in sorted(set(old_attrib) | set(new_attrib)):
+                x, y = old_attrib.get(name), new_attrib.get(name)
+                if x != y:
+                    self._add_op({ "op": "attrib", "path": self._new_path(b), "name": name,
+                        "old": _short(x, n), "new": _short(y, n) })
+                    changed = True
+        if changed: result.changed += 1
+
+    def _text(self, elem: html.Element) -> str:
+        " the start of the text of a subtree "
+        n = self.max_text
+        parts = [f"<{_tag(elem)}>"]
+        size = 0
+        for t in elem.itertext(with_tail=False):
+            t = t.strip()
+            if t == "": continue
+            parts.append(t)
+            size += len(t) + 1
+            if size > n: break
+        return _short(" ".join(parts), n)
+
+    def _removed(self, elem: html.Element):
+        self._add_op({ "op": "remove", "path": self._old_tree.getpath(elem), "text": self._text(elem) })
+        self._result.removed += 1
+
+    def _added(self, elem: html.Element):
+        self._add_op({ "op": "add", "path": self._new_path(elem), "text": self._text(elem) })
+        self._result.added += 1
+
+    def _match_children(self, a: html.Element, b: html.Element) -> List[Tuple[html.Element, html.Element]]:
+        """ line up the children of two paired elements
+
+        adds ops for the removed and added children, returns the pairs
+        that are not identical.
+        """
+        old_keys, new_keys = self._old_keys, self._new_keys
+        old, new = list(a), list(b)
+        n, m = len(old), len(new)
+
+        # common prefix and suffix
+        s = 0
+        while s < n and s < m and old_keys[old[s]] == new_keys[new[s]]: s += 1
+        e = 0
+        while e < n - s and e < m - s and old_keys[old[n - 1 - e]] == new_keys[new[m - 1 - e]]: e += 1
+        old, new = old[s:n - e], new[s:m - e]
+        if len(old) == 0 and len(new) == 0: return []
+
+        # identical children, in order
+        positions: Dict[str, List[int]] = {}
+        for i, x in enumerate(old):
+            k = old_keys[x]
+            p = positions.get(k)
+            if p == None:
+                positions[k] = [i]
+            else:
+                p.append(i)
+        next_position: Dict[str, int] = {}
+        anchors: List[Tuple[int, int]] = []
+        last = -1
+        for j, y in enumerate(new):
+            k = new_keys[y]
+            p = positions.get(k)
+            if p == None: continue
+            q = next_position.get(k, 0)
+            while q < len(p) and p[q] <= last: q += 1
+            next_position[k] = q + 1
+            if q < len(p):
+                last = p[q]
+                anchors.append((last, j))
+        anchors.append((len(old), len(new)))
+
+        # the children between anchors: pair by tag, in order
+        pairs = []
+        i0, j0 = 0, 0
+        for i1, j1 in anchors:
+            gap_old = old[i0:i1]
+            used = [False] * len(gap_old)
+            p = 0
+            for y in new[j0:j1]:
+                tag = _tag(y)
+                q = p
+                while q < len(gap_old) and _tag(gap_old[q]) != tag: q += 1
+                if q < len(gap_old):
+                    used[q] = True
+                    pairs.append((gap_old[q], y))
+                    p = q + 1
+                else:
+                    self._added(y)
+            for x, is_used in zip(gap_old, used):
+                if not is_used: self._removed(x)
+            i0, j0 = i1 + 1, j1 + 1
+        return pairs
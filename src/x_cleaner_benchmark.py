@@ -0,0 +1,166 @@
+#
+# Cleaner Benchmark
+#
+#   throughput of HtmlCleaner on large pages.
+#
+#   reads formatted pages (e.g. the raw cache) or generates SharePoint-like
+#   pages (deep nesting, guid ids, lots of layout attributes) and reports
+#   MB/s and ms per page for the tree walk alone and for clean() end to end.
+#
+#   --memory N generates a dashboard page with N MB of inline json/script
+#   (like the ArcGIS/Tableau pages) and reports the peak memory of
+#   clean_file() for each backend, each one in a fresh process.
+#
+#   usage: python x_cleaner_benchmark.py [<dir of html files or file list>] [--largest N] [--synthetic N] [--memory N]
+#
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter, SUPPRESS as argparse_suppress
+from typing import List
+import subprocess
+import tempfile
+import resource
+import random
+import time
+import json
+import sys
+import os
+
+from loguru import logger
+from lxml import html
+
+from __init__ import check_path
+check_path()
+
+from transform.html_cleaner import HtmlCleaner
+from transform.cleaner_backends import CLEANER_BACKENDS, make_cleaner
+
+
+def list_files(path: str) -> List[str]:
+    " html files in a directory, or the files listed in a text file "
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(".html"))
+    with open(path) as f:
+        return [x.strip() for x in f if x.strip() != ""]
+
+def make_sharepoint_page(depth: int, width: int, seed: int) -> bytes:
+    " a page shaped like the SharePoint state sites: deeply nested web parts "
+    rnd = random.Random(seed)
+
+    def node(d: int) -> str:
+        if d == 0: return f"<span class='ms-rteFontSize-2'>Cases {rnd.randint(0, 9999)}</span>"
+        guid = "%08x_%04x_%04x_%04x_%012x" % (rnd.getrandbits(32), rnd.getrandbits(16),
+            rnd.getrandbits(16), rnd.getrandbits(16), rnd.getrandbits(48))
+        siblings = "".join(f"<div style='display:none'><span> </span><a href='#skip' tabindex='{i}'> link {i} </a></div>" for i in range(width - 1))
+        return f"<div id='ctl00_{guid}' class='ms-webpart-zone' data-zone='{d}' aria-hidden='false'>" + \
+            f"{node(d - 1)}{siblings}<!-- web part --><script>var x = {d};</script></div>"
+
+    body = "".join(node(depth) for _ in range(20))
+    return f"<html><head><title>SharePoint</title></head><body>{body}</body></html>".encode()
+
+def make_dashboard_page(mb: float, seed: int) -> bytes:
+    " a page shaped like the ArcGIS/Tableau dashboards: a little html and a lot of inline json "
+    rnd = random.Random(seed)
+
+    def blob(n: int) -> str:
+        rows = []
+        size = 0
+        while size < n:
+            x = json.dumps({"OBJECTID": len(rows), "County": f"County {rnd.randint(0, 99)}",
+                "Cases": rnd.randint(0, 99999), "Deaths": rnd.randint(0, 999), "Updated": 1588550400000})
+            rows.append(x)
+            size += len(x) + 1
+        return "[" + ",".join(rows) + "]"
+
+    n = int(mb * 1e6 / 3)
+    parts = ["<html><head><title>Dashboard</title>",
+        f"<script>window.__config = {blob(n)};</script>",
+        "<style>" + ".c { color: red; }\n" * (n // 20) + "</style></head><body>",
+        "<div class='summary'><h1>COVID-19 Cases</h1><table><tr><td>Cases</td><td>1,234</td></tr></table></div>",
+        f"<script type='application/json' id='data'>{blob(n)}</script>",
+        "<noscript><div>This dashboard needs javascript.</div></noscript>",
+        "<p>Updated daily</p></body></html>"]
+    return "".join(parts).encode()
+
+def peak_rss_kb() -> int:
+    " peak resident memory of this process. ru_maxrss survives fork/exec so use VmHWM where there is one "
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for x in f:
+                if x.startswith("VmHWM:"): return int(x.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure_child(backend: str, fn: str):
+    " peak memory of one clean_file in this process, printed as json "
+    cleaner = make_cleaner(backend)
+    base = peak_rss_kb()
+    with open(fn, "rb") as f_in, open(os.devnull, "wb") as f_out:
+        ok = cleaner.clean_file(f_in, f_out)
+    peak = peak_rss_kb()
+    print(json.dumps({"ok": ok, "kb": peak - base}))
+
+def run_memory(mb: float):
+    content = make_dashboard_page(mb, 0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fn = os.path.join(temp_dir, "dashboard.html")
+        with open(fn, "wb") as f:
+            f.write(content)
+        out_size = len(HtmlCleaner().clean(content))
+
+        logger.info(f"dashboard page: {len(content) / 1e6:.1f} MB in, {out_size / 1e3:.1f} KB out")
+        for backend in CLEANER_BACKENDS:
+            p = subprocess.run([sys.executable, __file__, "--child", backend, fn], capture_output=True, check=True)
+            x = json.loads(p.stdout.decode().strip().splitlines()[-1])
+            logger.info(f"  {backend}: peak +{x['kb'] / 1e3:.1f} MB")
+
+def run(label: str, pages: List[bytes]):
+    total_mb = sum(len(x) for x in pages) / 1e6
+
+    walk_secs = 0.0
+    for content in pages:
+        doc = html.fromstring(content)
+        start = time.process_time()
+        HtmlCleaner().clean_tree(doc)
+        walk_secs += time.process_time() - start
+
+    start = time.process_time()
+    for content in pages:
+        HtmlCleaner().clean(content)
+    total_secs = time.process_time() - start
+
+    logger.info(f"{label}: {len(pages)} pages, {total_mb:.1f} MB")
+    logger.info(f"  tree walk: {walk_secs:.3f}s, {total_mb / max(walk_secs, 1e-9):.1f} MB/s, {1000 * walk_secs / len(pages):.1f} ms/page")
+    logger.info(f"  clean():   {total_secs:.3f}s, {total_mb / max(total_secs, 1e-9):.1f} MB/s, {1000 * total_secs / len(pages):.1f} ms/page")
+
+def main():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="directory of html files, or a text file listing them")
+    parser.add_argument("--largest", type=int, default=30, help="only use the N largest files")
+    parser.add_argument("--synthetic", type=int, default=10, help="number of generated SharePoint-like pages")
+    parser.add_argument("--memory", type=float, default=0, help="MB of inline json for the peak memory check")
+    parser.add_argument("--child", nargs=2, metavar=("BACKEND", "FILE"), help=argparse_suppress)
+    args = parser.parse_args()
+
+    if args.child != None:
+        measure_child(*args.child)
+        return
+
+    logger.remove()
+    logger.add(lambda msg: print(msg, end=""), level="INFO", format="{message}")
+
+    if args.path != None:
+        files = sorted(list_files(args.path), key=os.path.getsize, reverse=True)[:args.largest]
+        pages = []
+        for fn in files:
+            with open(fn, "rb") as f:
+                pages.append(f.read())
+        run(f"largest {len(pages)} files", pages)
+
+    if args.synthetic > 0:
+        pages = [make_sharepoint_page(200, 8, i) for i in range(args.synthetic)]
+        run("SharePoint-like", pages)
+
+    if args.memory > 0:
+        run_memory(args.memory)
+
+if __name__ == "__main__":
+    main()
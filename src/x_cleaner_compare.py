@@ -0,0 +1,92 @@
+#
+# Cleaner Compare
+#
+#   differential test of two cleaner backends on an archived raw/ folder.
+#
+#   every page is cleaned with both backends (with the page's cleaner
+#   rules) and any page where the output differs is reported with the
+#   start of a unified diff. also reports the cpu time of each backend.
+#
+#   usage: python x_cleaner_compare.py <raw dir> [-a python] [-b stream] [--out <dir for full diffs>]
+#
+#   exits with 1 if any page differs.
+#
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from typing import List
+import difflib
+import time
+import sys
+import os
+
+from loguru import logger
+from lxml import html
+
+from __init__ import check_path
+check_path()
+
+from shared.directory_cache import DirectoryCache
+from transform.change_list import ChangeList
+from transform.cleaner_rules import read_cleaner_rules_file
+from transform.cleaner_backends import CLEANER_BACKENDS, make_cleaner
+
+
+def diff_lines(a: bytes, b: bytes, name: str, a_label: str, b_label: str) -> List[str]:
+    a = (a if a != None else b"").decode(errors="replace").splitlines(keepends=True)
+    b = (b if b != None else b"").decode(errors="replace").splitlines(keepends=True)
+    return list(difflib.unified_diff(a, b, f"{name} ({a_label})", f"{name} ({b_label})"))
+
+def main():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("raw_dir", help="raw folder of the archive (e.g. <base_dir>/raw)")
+    parser.add_argument("-a", dest="backend_a", default="python", choices=list(CLEANER_BACKENDS.keys()))
+    parser.add_argument("-b", dest="backend_b", default="stream", choices=list(CLEANER_BACKENDS.keys()))
+    parser.add_argument("--out", dest="out_dir", default=None, help="write the full diff of each page here")
+    parser.add_argument("--lines", type=int, default=20, help="diff lines to show per page")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    cache_raw = DirectoryCache(args.raw_dir)
+    change_list = ChangeList(cache_raw)
+    if cache_raw.exists("change_list.json"): change_list.load()
+    rule_book = read_cleaner_rules_file()
+
+    keys = sorted(x for x in cache_raw.list_html_files() if not x in ["index.html", "google_sheet.html"])
+
+    secs = { args.backend_a: 0.0, args.backend_b: 0.0 }
+    differ = []
+    for key in keys:
+        content = cache_raw.read(key)
+        item = change_list.get_item(key)
+        rules = rule_book.for_page(key, item.url if item != None else None)
+
+        results = {}
+        for backend in [args.backend_a, args.backend_b]:
+            cleaner = make_cleaner(backend, rules=rules)
+            start = time.process_time()
+            results[backend] = cleaner.clean(content)
+            secs[backend] += time.process_time() - start
+
+        a, b = results[args.backend_a], results[args.backend_b]
+        if a == b: continue
+
+        differ.append(key)
+        lines = diff_lines(a, b, key, args.backend_a, args.backend_b)
+        print(f"=== {key} differs")
+        print("".join(lines[:args.lines]), end="")
+        if len(lines) > args.lines: print(f"... {len(lines) - args.lines} more lines")
+        if args.out_dir != None:
+            os.makedirs(args.out_dir, exist_ok=True)
+            with open(os.path.join(args.out_dir, key.replace(".html", ".diff")), "w", encoding="utf-8") as f:
+                f.write("".join(lines))
+
+    print()
+    print(f"{len(keys)} pages, {len(differ)} differ")
+    for backend, x in secs.items():
+        print(f"  {backend}: {x:.2f}s cpu, {1000 * x / max(len(keys), 1):.1f} ms/page")
+    if len(differ) > 0: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
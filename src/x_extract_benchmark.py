@@ -0,0 +1,233 @@
+#
+# Extract Benchmark
+#
+#   cpu time of the text lookups the extracter does (link text and
+#   ContentText child text) the old recursive way and with TextIndex,
+#   and checks that both give the same strings. also reports extract()
+#   end to end.
+#
+#   reads clean pages (e.g. the clean cache) and/or generates nested pages
+#   with text at every level, where the old way was quadratic.
+#
+#   with --incremental it changes the text of one element of each page and
+#   times extract() against extract_indexed() with the previous extract
+#   (both after parsing), checking that they give the same bytes.
+#
+#   usage: python x_extract_benchmark.py [<dir of clean html files or file list>] [--largest N] [--nested DEPTH] [--incremental]
+#
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from typing import List, Tuple
+import random
+import time
+import os
+
+from loguru import logger
+from lxml import html
+
+from __init__ import check_path
+check_path()
+
+from transform.change_list import ChangeItem
+from transform.html_extracter import HtmlExtracter
+from transform.content_text import ContentText, case_pattern
+from transform.text_index import TextIndex
+from transform.subtree_hash import SubtreeIndex
+from shared.util import content_hash
+
+
+def list_files(path: str) -> List[str]:
+    " html files in a directory, or the files listed in a text file "
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(".html"))
+    with open(path) as f:
+        return [x.strip() for x in f if x.strip() != ""]
+
+# -- the text functions before TextIndex
+
+def old_extract_text(elem: html.Element) -> str:
+    t = elem.text
+    t = t.strip() if t != None else ""
+    for ch in elem:
+        tx = old_extract_text(ch)
+        if tx != "":
+            t += " "
+            t += tx
+    tx = elem.tail
+    tx = tx.strip() if tx != None else ""
+    if tx != "":
+        t += " "
+        t += tx
+    return t
+
+def old_extract_child(root: html.Element, elem: html.Element) -> str:
+    if elem.tag == "table": return ""
+    if elem.tag == "iframe": return ""
+    if len(root) == 0:
+        t1 = root.text
+        t3 = root.tail
+        t1 = t1.strip() if t1 != None else ""
+        t3 = t3.strip() if t3 != None else ""
+        return (t1 + " " + t3).strip()
+
+    result = ""
+    for ch in elem:
+        t1 = ch.text
+        t2 = old_extract_child(root, ch) if len(ch) > 0 else ""
+        t3 = ch.tail
+        t1 = t1.strip() if t1 != None else ""
+        t3 = t3.strip() if t3 != None else ""
+        if t1 != "": result += " " + t1
+        if t2 != "": result += " " + t2
+        if t3 != "": result += " " + t3
+    return result.strip()
+
+def queries(doc: html.Element) -> Tuple[List[html.Element], List[html.Element]]:
+    " the elements the extracter asks about: links and elements with text, not inside tables "
+    links, texts = [], []
+    stack = [doc]
+    while len(stack) > 0:
+        elem = stack.pop()
+        if elem.tag == "table": continue
+        if elem.tag == "a" or elem.tag == "iframe":
+            if elem.attrib.get("href") != None: links.append(elem)
+        else:
+            text, tail = elem.text, elem.tail
+            if (text != None and text.replace("\n", "").strip() != "") or \
+               (tail != None and tail.replace("\n", "").strip() != ""):
+                texts.append(elem)
+        stack.extend(reversed(elem))
+    return links, texts
+
+def make_nested_page(depth: int) -> bytes:
+    " nested divs with text at every level, the worst case for the old lookups "
+    inner = "<p>Total cases 1,234</p>"
+    for i in range(depth):
+        inner = f"<div>level {i} <a href='https://example.com/{i}'>link {i}</a>{inner} after {i}</div>"
+    return f"<html><body>{inner}</body></html>".encode()
+
+def run(label: str, pages: List[bytes]):
+    total_mb = sum(len(x) for x in pages) / 1e6
+
+    old_secs, new_secs, n = 0.0, 0.0, 0
+    for content in pages:
+        doc = html.fromstring(content)
+        links, texts = queries(doc)
+        n += len(links) + len(texts)
+
+        # like process_element: contains_data() for every element with text
+        # (with empty text/tail it only looks at the child text) and the
+        # child text of the ones that have data
+        start = time.process_time()
+        old = [old_extract_text(x) for x in links]
+        for x in texts:
+            s = old_extract_child(x, x)
+            old.append(s if case_pattern.search(s) else None)
+        old_secs += time.process_time() - start
+
+        start = time.process_time()
+        index = TextIndex(case_pattern)
+        new = [index.link_text(x) for x in links]
+        for x in texts:
+            if len(x) == 0:
+                s = old_extract_child(x, x)
+                new.append(s if case_pattern.search(s) else None)
+            else:
+                new.append(index.child_text(x) if index.child_text_marked(x) else None)
+        new_secs += time.process_time() - start
+
+        if old != new: raise Exception(f"{label}: text lookups differ")
+
+        # and through ContentText
+        index = TextIndex(case_pattern)
+        for i, x in enumerate(texts):
+            ct = ContentText(x, "", "", index)
+            if (ct.child_text if ct.contains_data() else None) != old[len(links) + i]:
+                raise Exception(f"{label}: ContentText differs")
+
+    start = time.process_time()
+    for content in pages:
+        item = ChangeItem()
+        item.name = label
+        HtmlExtracter().extract(content, item)
+    extract_secs = time.process_time() - start
+
+    logger.info(f"{label}: {len(pages)} pages, {total_mb:.1f} MB, {n} lookups")
+    logger.info(f"  old text lookups: {old_secs:.3f}s, {1000 * old_secs / len(pages):.1f} ms/page")
+    logger.info(f"  TextIndex:        {new_secs:.3f}s, {1000 * new_secs / len(pages):.1f} ms/page")
+    logger.info(f"  extract():        {extract_secs:.3f}s, {1000 * extract_secs / len(pages):.1f} ms/page")
+
+def change_one_text(content: bytes, rnd: random.Random) -> bytes:
+    " the page with a number added to the text of a random element, None if nothing has text "
+    doc = html.fromstring(content)
+    elems = [x for x in doc.iter() if type(x.tag) == str and x.text != None and x.text.strip() != ""]
+    if len(elems) == 0: return None
+    elem = rnd.choice(elems)
+    elem.text += " 1"
+    return html.tostring(doc)
+
+def run_incremental(label: str, pages: List[bytes]):
+    rnd = random.Random(1)
+
+    full_secs, incremental_secs, n, copied = 0.0, 0.0, 0, 0
+    for content in pages:
+        new_content = change_one_text(content, rnd)
+        if new_content == None: continue
+        n += 1
+
+        item = ChangeItem()
+        item.name = label
+
+        extracter = HtmlExtracter()
+        previous_content = html.tostring(extracter.extract_indexed(html.fromstring(content), item), pretty_print=True)
+        previous = extracter.subtree_index
+        previous.extract_hash = content_hash(previous_content)
+
+        doc = html.fromstring(new_content)
+        start = time.process_time()
+        expected = html.tostring(HtmlExtracter().extract_tree(doc, item), pretty_print=True)
+        full_secs += time.process_time() - start
+
+        doc = html.fromstring(new_content)
+        start = time.process_time()
+        extracter = HtmlExtracter()
+        x = html.tostring(extracter.extract_indexed(doc, item, previous, previous_content), pretty_print=True)
+        incremental_secs += time.process_time() - start
+        copied += extracter.copied
+
+        if x != expected: raise Exception(f"{label}: incremental extract differs")
+
+    logger.info(f"{label}: {n} pages with one changed text, {copied} copied subtrees")
+    logger.info(f"  extract:             {full_secs:.3f}s, {1000 * full_secs / n:.1f} ms/page")
+    logger.info(f"  incremental extract: {incremental_secs:.3f}s, {1000 * incremental_secs / n:.1f} ms/page")
+
+def main():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="directory of clean html files, or a text file listing them")
+    parser.add_argument("--largest", type=int, default=30, help="only use the N largest files")
+    parser.add_argument("--nested", type=int, default=400, help="depth of the generated nested page (0 for none)")
+    parser.add_argument("--incremental", action="store_true", help="time incremental extracts instead")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(lambda msg: print(msg, end=""), level="INFO", format="{message}", filter="__main__")
+
+    if args.path != None:
+        files = sorted(list_files(args.path), key=os.path.getsize, reverse=True)[:args.largest]
+        pages = []
+        for fn in files:
+            with open(fn, "rb") as f:
+                pages.append(f.read())
+        if args.incremental:
+            run_incremental(f"largest {len(pages)} files", pages)
+        else:
+            run(f"largest {len(pages)} files", pages)
+
+    if args.nested > 0:
+        if args.incremental:
+            run_incremental(f"nested {args.nested}", [make_nested_page(args.nested)])
+        else:
+            run(f"nested {args.nested}", [make_nested_page(args.nested)])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#
+# Transform Benchmark
+#
+#   cpu time per page for format -> clean -> extract, run the old way
+#   (each stage parses the bytes of the previous one) and through
+#   PageTransform (one shared tree), and checks that both give the
+#   same bytes.
+#
+#   the converter is left out: it reads the extract bytes either way.
+#
+#   usage: python x_transform_benchmark.py <dir of html files or file list> [--repeat N]
+#
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from typing import List, Tuple
+import statistics
+import time
+import os
+
+from loguru import logger
+
+from __init__ import check_path
+check_path()
+
+from transform.change_list import ChangeItem
+from transform.html_formater import HtmlFormater
+from transform.html_cleaner import HtmlCleaner
+from transform.html_extracter import HtmlExtracter
+from transform.page_transform import PageTransform
+
+
+def list_files(path: str) -> List[str]:
+    " html files in a directory, or the files listed in a text file "
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(".html"))
+    with open(path) as f:
+        return [x.strip() for x in f if x.strip() != ""]
+
+def run_old(xurl: str, content: bytes, item: ChangeItem) -> Tuple[bytes, bytes, bytes]:
+    " the pipeline before PageTransform, including the second (discarded) format "
+    raw = HtmlFormater().format(xurl, content)
+    clean = HtmlCleaner().clean(raw)
+    HtmlFormater().format(xurl, raw)
+    extract = HtmlExtracter().extract(clean, item)
+    return raw, clean, extract
+
+def run_new(xurl: str, content: bytes, item: ChangeItem) -> Tuple[bytes, bytes, bytes]:
+    page = PageTransform(xurl)
+    raw = page.format(content)
+    clean = page.clean()
+    extract = page.extract(item)
+    return raw, clean, extract
+
+def time_pages(fn, pages: List[Tuple[str, bytes]], repeat: int) -> Tuple[List[float], List]:
+    times, results = [], []
+    for name, content in pages:
+        best = None
+        for _ in range(repeat):
+            item = ChangeItem()
+            item.name = name
+            item.url = "http://example.com/" + name
+            start = time.process_time()
+            x = fn(item.url, content, item)
+            secs = time.process_time() - start
+            if best == None or secs < best: best = secs
+        times.append(best)
+        results.append(x)
+    return times, results
+
+def describe(label: str, times: List[float]):
+    times = sorted(times)
+    p95 = times[int(round(0.95 * (len(times) - 1)))]
+    logger.info(f"  {label}: total {sum(times):.3f}s, median {statistics.median(times)*1000:.2f}ms, p95 {p95*1000:.2f}ms per page")
+
+def main():
+    parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="directory of html files, or a text file listing them")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per page, the fastest is kept")
+    args = parser.parse_args()
+
+    pages = []
+    for fn in list_files(args.path):
+        with open(fn, "rb") as f:
+            pages.append((os.path.basename(fn), f.read()))
+    logger.info(f"{len(pages)} pages")
+
+    old_times, old_results = time_pages(run_old, pages, args.repeat)
+    new_times, new_results = time_pages(run_new, pages, args.repeat)
+
+    describe("old", old_times)
+    describe("new", new_times)
+    logger.info(f"  speedup: {sum(old_times) / max(sum(new_times), 1e-9):.2f}x")
+
+    diffs = [name for (name, _), a, b in zip(pages, old_results, new_results) if a != b]
+    if len(diffs) > 0:
+        logger.error(f"{len(diffs)} pages differ: {diffs[:10]}")
+    else:
+        logger.info("  output is identical")
+
+if __name__ == "__main__":
+    main()
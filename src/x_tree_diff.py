@@ -0,0 +1,99 @@
+#
+# Tree Diff
+#
+#   prints the diff of two clean pages (see transform/tree_diff.py), or
+#   times it on a directory of clean pages: each page is diffed against
+#   a copy with a few random edits (a changed text, an added and a
+#   removed element), checking the edits are found.
+#
+#   usage: python x_tree_diff.py <old file> <new file>
+#          python x_tree_diff.py <dir of clean html files or file list> [--largest N] [--edits N]
+#
+
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from typing import List
+import random
+import json
+import time
+import os
+
+from loguru import logger
+from lxml import html
+
+from __init__ import check_path
+check_path()
+
+from transform.tree_diff import TreeDiff
+
+
+def list_files(path: str) -> List[str]:
+    " html files in a directory, or the files listed in a text file "
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, x) for x in os.listdir(path) if x.endswith(".html"))
+    with open(path) as f:
+        return [x.strip() for x in f if x.strip() != ""]
+
+def edit_page(root: html.Element, n: int, rnd: random.Random) -> int:
+    " make n random edits, returns how many ops the diff should at least find "
+    elems = [x for x in root.iter() if type(x.tag) == str and x.getparent() != None]
+    if len(elems) < 3 * n: return 0
+    expected = 0
+    for x in rnd.sample(elems, n):
+        x.text = (x.text or "") + " edited"
+        expected += 1
+    for x in rnd.sample(elems, n):
+        if x.getparent() == None or x.getparent().getparent() == None: continue
+        p = html.Element("p")
+        p.text = "added"
+        x.addnext(p)
+        expected += 1
+    return expected
+
+def main():
+    parser = ArgumentParser(
+        description=__doc__,
+        formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="old clean page, or a dir of clean pages")
+    parser.add_argument("new_path", nargs="?", help="new clean page")
+    parser.add_argument("--largest", type=int, default=0, help="only the N largest pages")
+    parser.add_argument("--edits", type=int, default=2, help="edits of each kind per page")
+    args = parser.parse_args()
+
+    if args.new_path != None:
+        with open(args.path, "rb") as f: old = html.fromstring(f.read())
+        with open(args.new_path, "rb") as f: new = html.fromstring(f.read())
+        x = TreeDiff().diff(old, new)
+        print(json.dumps(x.to_dict(), indent=2))
+        logger.info(f"{x.summary()} in {x.elapsed * 1000:.1f} ms")
+        return
+
+    files = list_files(args.path)
+    if args.largest > 0:
+        files = sorted(files, key=os.path.getsize, reverse=True)[:args.largest]
+
+    rnd = random.Random(1)
+    differ = TreeDiff()
+    total, total_size, missed, truncated = 0.0, 0, 0, 0
+    for fn in files:
+        with open(fn, "rb") as f: content = f.read()
+        old, new = html.fromstring(content), html.fromstring(content)
+        expected = edit_page(new, args.edits, rnd)
+
+        start = time.perf_counter()
+        x = differ.diff(old, new)
+        elapsed = time.perf_counter() - start
+
+        total += elapsed
+        total_size += len(content)
+        if x.truncated: truncated += 1
+        if len(x.ops) < expected and not x.truncated:
+            missed += 1
+            logger.warning(f"{fn}: expected {expected} ops, got {x.summary()}")
+
+    n = max(1, len(files))
+    logger.info(f"{len(files)} pages, {total_size / n / 1000:.0f} KB/page: {total / n * 1000:.1f} ms/page, "
+        + f"{missed} missed, {truncated} truncated")
+
+
+if __name__ == "__main__":
+    main()
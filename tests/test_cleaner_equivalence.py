@@ -0,0 +1,65 @@
+#
+# the cleaner must give the same bytes as before for the pages in cleaner_corpus.
+#
+#   each <name>.html has the expected output next to it in <name>.clean.html
+#   (generated by the recursive cleaner)
+#
+import os
+import glob
+
+from src import check_path
+check_path()
+
+from lxml import html, etree
+from transform.html_cleaner import HtmlCleaner
+from transform.cleaner_backends import CLEANER_BACKENDS, make_cleaner
+
+corpus_dir = os.path.join(os.path.dirname(__file__), "cleaner_corpus")
+
+def corpus_files():
+    for fn in sorted(glob.glob(os.path.join(corpus_dir, "*.html"))):
+        if fn.endswith(".clean.html"): continue
+        yield fn, fn.replace(".html", ".clean.html")
+
+# ------------------------------------------------
+def test_corpus():
+    for fn, fn_expected in corpus_files():
+        with open(fn, "rb") as f:
+            content = f.read()
+        with open(fn_expected, "rb") as f:
+            expected = f.read()
+
+        for backend in CLEANER_BACKENDS:
+            cleaner = make_cleaner(backend)
+            actual = cleaner.clean(content)
+            assert actual == expected, f"{os.path.basename(fn)} changed ({backend})"
+
+            # str in, str out
+            actual = cleaner.clean(content.decode())
+            assert actual == expected.decode(), f"{os.path.basename(fn)} changed ({backend}, str)"
+
+# ------------------------------------------------
+def test_deep_tree():
+    " deeper than the recursion limit "
+
+    depth = 5000
+    doc = html.fromstring("<html><body></body></html>")
+    elem = doc[0]
+    for _ in range(depth):
+        elem = etree.SubElement(elem, "div", {"class": "x"})
+        elem = etree.SubElement(elem, "span", {"style": "y"})
+    elem.text = "deep"
+    etree.SubElement(doc[0], "div")
+
+    cleaner = HtmlCleaner()
+    cleaner.clean_tree(doc)
+
+    content = html.tostring(doc)
+    assert content.count(b"<div>") == depth
+    assert content.count(b"<span>") == depth
+    assert b"deep" in content
+
+
+if __name__ == "__main__":
+    test_corpus()
+    test_deep_tree()
@@ -0,0 +1,69 @@
+#
+# per-location and per-host cleaner rules
+#
+from src import check_path
+check_path()
+
+from transform.html_cleaner import HtmlCleaner
+from transform.cleaner_rules import CleanerRuleBook, read_cleaner_rules_file, page_names
+
+config = {
+    "locations": {
+        "AZ": {
+            "remove_elements": [ { "tag": "div", "attrib": "id", "match": "^uvTab$" } ]
+        },
+        "NJ_data": {
+            "attrib_rewrites": [ { "attrib": "id", "match": "^[0-9a-f]{13}$", "set": "[hex]" } ]
+        },
+    },
+    "hosts": {
+        "www.cdph.ca.gov": { "remove_attribs": ["web-part-name"] }
+    }
+}
+
+page = b'''<html><body>
+<div id="uvTab"><a href="#">Feedback</a></div>
+<div id="5e751d54b5c94" web-part-name="x"><p>Cases</p></div>
+</body></html>'''
+
+def clean(key: str, url: str = None) -> bytes:
+    book = CleanerRuleBook(config)
+    cleaner = HtmlCleaner(rules=book.for_page(key, url))
+    return cleaner.clean(page)
+
+# ------------------------------------------------
+def test_page_names():
+    assert page_names("CA_data.html") == ["CA_data", "CA"]
+    assert page_names("CA.html") == ["CA"]
+
+def test_default():
+    x = clean("WA.html")
+    assert b"uvTab" in x
+    assert b"5e751d54b5c94" in x
+    assert b"web-part-name" in x
+
+def test_location():
+    x = clean("AZ_data.html")
+    assert not b"uvTab" in x
+    x = clean("NJ_data.html")
+    assert b'id="[hex]"' in x
+    x = clean("NJ.html")
+    assert b"5e751d54b5c94" in x
+
+def test_host():
+    x = clean("CA.html", "https://www.cdph.ca.gov/Programs/CID/DCDC/Pages/Immunization/ncov2019.aspx")
+    assert not b"web-part-name" in x
+    assert b"uvTab" in x
+
+def test_rules_file():
+    " the checked in rules file must load "
+    book = read_cleaner_rules_file()
+    book.for_page("AZ.html", "https://www.azdhs.gov/")
+
+
+if __name__ == "__main__":
+    test_page_names()
+    test_default()
+    test_location()
+    test_host()
+    test_rules_file()
@@ -0,0 +1,82 @@
+#
+# tests for DataPipeline's fetch loop with a stand-in fetch, no network
+#
+import os
+import shutil
+import tempfile
+import pandas as pd
+
+from src import check_path
+check_path()
+
+from data_pipeline import DataPipeline, DataPipelineConfig
+from shared.json_store import JsonStore
+
+URL = "https://example.gov/covid"
+RAW = b"<html><body><p>Cases 123</p></body></html>"
+CLEAN = b"<html><body><p>Cases 123</p></body></html>"
+VALIDATORS = { "etag": '"v1"', "last_modified": "Mon, 01 Jun 2020 10:00:00 GMT", "url": URL }
+
+class StandInSource:
+    " one location with a main page "
+
+    def __init__(self):
+        self.name = "test"
+        self.subfolder = ""
+        self.df = pd.DataFrame([{ "location": "P1", "source_name": "test", "main_page": URL, "data_page": "" }])
+
+def make_pipeline(base: str) -> DataPipeline:
+    flags = { "trace": False, "capture_image": False, "rerun_now": True, "headless": True }
+    pipeline = DataPipeline(DataPipelineConfig(base, os.path.join(base, "temp"), flags))
+    pipeline.get_scan_sources = lambda: [StandInSource()]
+    return pipeline
+
+def read_pages(base: str):
+    result = {}
+    for d in ["raw", "clean", "extract", "convert"]:
+        work_dir = os.path.join(base, d)
+        if not os.path.isdir(work_dir): continue
+        for fn in sorted(os.listdir(work_dir)):
+            if not fn.startswith("P"): continue
+            path = os.path.join(work_dir, fn)
+            with open(path, "rb") as f:
+                result[(d, fn)] = (f.read(), os.stat(path).st_mtime_ns)
+    return result
+
+# ------------------------------------------------
+def test_not_modified():
+    " a 304 records the page as unchanged and keeps its files and validators "
+
+    base = tempfile.mkdtemp()
+    try:
+        pipeline = make_pipeline(base)
+        pipeline.cache_raw.write("P1.html", RAW)
+        pipeline.cache_clean.write("P1.html", CLEAN)
+        pipeline.http_validators.set("P1.html", dict(VALIDATORS))
+        pipeline.save_state()
+        before = read_pages(base)
+
+        sent = []
+        def fetch(url: str, cache_info: dict):
+            sent.append((url, dict(cache_info)))
+            return None, 304
+        pipeline.url_manager.fetch = fetch
+
+        pipeline.process()
+
+        # the conditional GET carried the saved validators
+        assert sent == [(URL, VALIDATORS)]
+
+        item = pipeline.change_list.get_item("P1.html")
+        assert item.status == "unchanged" and item.msg == "not modified"
+
+        validators = JsonStore(pipeline.cache_raw, "http_validators.json")
+        assert validators.get("P1.html") == VALIDATORS
+
+        assert read_pages(base) == before
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    test_not_modified()
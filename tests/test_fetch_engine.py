@@ -0,0 +1,205 @@
+#
+# tests for FetchEngine with a stand-in fetch, no network
+#
+import tracemalloc
+import threading
+import time
+
+from src import check_path
+check_path()
+
+from sources.fetch_engine import FetchEngine, FetchTask, merge_duplicate_urls, canonical_url
+
+PAGE_SIZE = 1_000_000
+
+def make_plan(n_pages: int, n_followers: int = 0):
+    " n_pages pages on 10 hosts, each listed 1 + n_followers times "
+    tasks = []
+    for i in range(n_pages):
+        url = f"https://host{i % 10}.gov/page{i}"
+        for j in range(1 + n_followers):
+            tasks.append(FetchTask(f"P{i}_{j}.html", f"P{i}", "test", url))
+    return tasks
+
+def test_release_keeps_memory_flat():
+    " a run over a large plan only holds the pages in flight "
+
+    def fetch(task: FetchTask):
+        return bytes(PAGE_SIZE), 200
+
+    tasks = make_plan(200, n_followers=1)
+    plan, saved = merge_duplicate_urls(tasks)
+    assert saved == 200
+
+    engine = FetchEngine(max_workers=4, max_per_host=2)
+    tracemalloc.start()
+    try:
+        cnt = 0
+        for task in engine.run(plan, fetch):
+            assert len(task.content) == PAGE_SIZE
+            cnt += 1
+            task.release()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert cnt == 400
+    assert all(t.content == None for t in tasks)
+    print(f"peak memory for 200 pages of {PAGE_SIZE * 1e-6:.0f} MB: {peak * 1e-6:.1f} MB")
+    assert peak < 20 * PAGE_SIZE, f"peak memory is {peak * 1e-6:.1f} MB"
+
+def test_per_host_limit():
+    " never more than max_per_host fetches to a host, or max_workers in all "
+
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+    peak_total = [0]
+    def fetch(task: FetchTask):
+        with lock:
+            active[task.host] = active.get(task.host, 0) + 1
+            peak[task.host] = max(peak.get(task.host, 0), active[task.host])
+            peak_total[0] = max(peak_total[0], sum(active.values()))
+        time.sleep(0.02)
+        with lock:
+            active[task.host] -= 1
+        return b"page", 200
+
+    # 3 hosts with 8 pages each
+    tasks = [FetchTask(f"P{i}.html", f"P{i}", "test", f"https://host{i % 3}.gov/page{i}") for i in range(24)]
+    engine = FetchEngine(max_workers=5, max_per_host=2)
+    done = [t.key for t in engine.run(tasks, fetch)]
+
+    assert sorted(done) == sorted(t.key for t in tasks)
+    assert max(peak.values()) == 2, peak
+    assert peak_total[0] <= 5
+    assert all(t.status == 200 and t.content == b"page" for t in tasks)
+
+def test_skip_blocked_host():
+    " once a host is blocked, its tasks that haven't started come back skipped "
+
+    fetched = []
+    blocked = set()
+    def fetch(task: FetchTask):
+        fetched.append(task.key)
+        if task.host == "bad.gov": raise Exception("timeout")
+        return b"page", 200
+
+    tasks = [FetchTask(f"B{i}.html", f"B{i}", "test", f"https://bad.gov/page{i}") for i in range(5)]
+    tasks += [FetchTask(f"G{i}.html", f"G{i}", "test", f"https://good.gov/page{i}") for i in range(5)]
+    # a follower of a skipped page is skipped too
+    follower = FetchTask("B4_data.html", "B4", "test", "https://bad.gov/page4")
+    tasks, _ = merge_duplicate_urls(tasks + [follower])
+
+    engine = FetchEngine(max_workers=1, max_per_host=1)
+    results = []
+    for t in engine.run(tasks, fetch, lambda host: host in blocked):
+        results.append(t)
+        if t.error != None: blocked.add(t.host)
+
+    assert len(results) == 11
+    bad = [t for t in results if t.host == "bad.gov"]
+    assert len([t for t in bad if t.error != None]) == 1
+    assert len([t for t in bad if t.skipped]) == 5
+    assert follower.skipped and follower.primary != None
+    assert not any(t.skipped for t in results if t.host == "good.gov")
+    assert len([k for k in fetched if k.startswith("B")]) == 1
+
+def test_cancel():
+    " fetches that haven't started are cancelled when the caller stops "
+
+    fetched = []
+    def fetch(task: FetchTask):
+        fetched.append(task.key)
+        time.sleep(0.02)
+        return b"page", 200
+
+    tasks = [FetchTask(f"P{i}.html", f"P{i}", "test", f"https://host{i}.gov/page") for i in range(50)]
+    engine = FetchEngine(max_workers=2, max_per_host=1)
+    results = engine.run(tasks, fetch)
+    first = next(results)
+    assert first.status == 200
+    results.close()
+
+    # the running ones finish, nothing new starts
+    cnt = len(fetched)
+    time.sleep(0.1)
+    assert len(fetched) == cnt
+    assert cnt <= 3, cnt
+    assert sum(1 for t in tasks if t.status == None) >= 47
+
+def test_canonical_url():
+    same = [
+        "https://dph.georgia.gov/covid-19-daily-status-report",
+        "http://dph.georgia.gov/covid-19-daily-status-report/",
+        "https://DPH.Georgia.gov:443/covid-19-daily-status-report#top",
+        "https://dph.georgia.gov/covid-19-daily-status-report?utm_source=twitter&fbclid=x",
+        "https://www.google.com/url?q=https://dph.georgia.gov/covid-19-daily-status-report&sa=D",
+    ]
+    for url in same:
+        assert canonical_url(url) == "dph.georgia.gov/covid-19-daily-status-report", url
+
+    assert canonical_url("https://a.gov/data?b=2&a=1") == canonical_url("https://a.gov/data?a=1&b=2")
+    assert canonical_url("https://a.gov:8080/data") == "a.gov:8080/data"
+    assert canonical_url("https://a.gov/data?a=1") != canonical_url("https://a.gov/data?a=2")
+    assert canonical_url(None) == ""
+
+    # hash-routed dashboards are different pages in a browser
+    abc, xdef = "https://a.gov/index.html#/abc", "https://a.gov/index.html#/def"
+    assert canonical_url(abc) == canonical_url(xdef)
+    assert canonical_url(abc, keep_fragment=True) != canonical_url(xdef, keep_fragment=True)
+    assert canonical_url(abc, keep_fragment=True) == "a.gov/index.html#/abc"
+    assert canonical_url("http://a.gov/index.html/#/abc", keep_fragment=True) == "a.gov/index.html#/abc"
+    assert canonical_url("https://a.gov/index.html", keep_fragment=True) == "a.gov/index.html"
+
+def test_merge_duplicate_urls():
+    def task(key: str, url: str, cache_info=None) -> FetchTask:
+        t = FetchTask(key, key.split(".")[0], "test", url)
+        t.cache_info = cache_info
+        return t
+
+    ga = task("GA.html", "https://dph.georgia.gov/status", { "etag": '"1"' })
+    ga_data = task("GA_data.html", "http://dph.georgia.gov/status/", { "etag": '"1"' })
+    al = task("AL.html", "https://al.gov/index.html#/abc")
+    al_data = task("AL_data.html", "https://al.gov/index.html#/def")
+
+    tasks, saved = merge_duplicate_urls([ga, ga_data, al, al_data])
+    assert saved == 2
+    assert tasks == [ga, al]
+    assert ga.followers == [ga_data] and al.followers == [al_data]
+    # same validators -> still sent
+    assert ga.cache_info == { "etag": '"1"' }
+
+    # the browser keeps the fragment
+    for t in [ga, ga_data, al, al_data]: t.followers = []
+    tasks, saved = merge_duplicate_urls([ga, ga_data, al, al_data], keep_fragment=True)
+    assert saved == 1
+    assert tasks == [ga, al, al_data]
+
+def test_merge_validator_conflict():
+    " a 304 for one key's validators would be wrong for the other, so none are sent "
+    a = FetchTask("GA.html", "GA", "test", "https://dph.georgia.gov/status")
+    a.cache_info = { "etag": '"1"', "last_modified": "Mon, 01 Jun 2020 10:00:00 GMT" }
+    b = FetchTask("GA_data.html", "GA", "test", "https://dph.georgia.gov/status")
+    b.cache_info = { "etag": '"2"' }
+    tasks, saved = merge_duplicate_urls([a, b])
+    assert saved == 1 and tasks == [a]
+    assert a.cache_info == {}
+    # the follower's own validators are left alone
+    assert b.cache_info == { "etag": '"2"' }
+
+    # a follower with no validators (no clean file) is a conflict too
+    a.cache_info, a.followers = { "etag": '"1"' }, []
+    b.cache_info = {}
+    tasks, _ = merge_duplicate_urls([a, b])
+    assert a.cache_info == {}
+
+
+if __name__ == "__main__":
+    test_canonical_url()
+    test_merge_duplicate_urls()
+    test_merge_validator_conflict()
+    test_release_keeps_memory_flat()
+    test_per_host_limit()
+    test_skip_blocked_host()
+    test_cancel()
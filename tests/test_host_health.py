@@ -0,0 +1,82 @@
+#
+# tests for the per-host circuit breaker with a fixed clock
+#
+import tempfile
+from datetime import datetime, timedelta
+import pytz
+
+from src import check_path
+check_path()
+
+from shared.directory_cache import DirectoryCache
+from shared import udatetime
+from sources.host_health import HostHealth, is_host_failure, FAILURE_THRESHOLD, BASE_BACKOFF, MAX_BACKOFF
+
+HOST = "bad.gov"
+
+def open_for(health: HostHealth, xnow: datetime) -> timedelta:
+    " how long the circuit is open from xnow "
+    _, open_until = health.get_status(HOST)
+    return udatetime.from_json(open_until) - xnow
+
+def test_threshold():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        health = HostHealth(DirectoryCache(cache_dir))
+        xnow = datetime(2020, 6, 1, 12, tzinfo=pytz.utc)
+
+        for i in range(FAILURE_THRESHOLD - 1):
+            health.record_failure(HOST, "timeout", xnow)
+            assert not health.is_open(HOST, xnow)
+        health.record_failure(HOST, "timeout", xnow)
+        assert health.is_open(HOST, xnow)
+        assert open_for(health, xnow) == BASE_BACKOFF
+        assert not health.is_open("good.gov", xnow)
+
+        # fetches that were running when it opened don't extend it
+        health.record_failure(HOST, "timeout", xnow + timedelta(minutes=1))
+        assert open_for(health, xnow) == BASE_BACKOFF
+        assert health.get_status(HOST)[0] == FAILURE_THRESHOLD + 1
+
+        # a success closes it and forgets the failures
+        health.record_success(HOST)
+        assert not health.is_open(HOST, xnow)
+        assert health.get_status(HOST) == (0, None)
+
+def test_backoff_doubles_to_cap():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        health = HostHealth(DirectoryCache(cache_dir))
+        xnow = datetime(2020, 6, 1, 12, tzinfo=pytz.utc)
+
+        for i in range(FAILURE_THRESHOLD):
+            health.record_failure(HOST, "HTTP status 503", xnow)
+
+        backoffs = [open_for(health, xnow)]
+        for i in range(7):
+            # the probe after the backoff fails again -> open right away, twice as long
+            xnow += backoffs[-1]
+            assert not health.is_open(HOST, xnow)
+            health.record_failure(HOST, "HTTP status 503", xnow)
+            assert health.is_open(HOST, xnow)
+            backoffs.append(open_for(health, xnow))
+
+        mins = [int(x.total_seconds() / 60) for x in backoffs]
+        assert mins == [30, 60, 120, 240, 480, 720, 720, 720], mins
+        assert backoffs[-1] == MAX_BACKOFF
+
+        # and it carries across runs
+        health.save()
+        health = HostHealth(DirectoryCache(cache_dir))
+        assert health.is_open(HOST, xnow)
+
+def test_is_host_failure():
+    assert is_host_failure(None, Exception("timeout"))
+    assert is_host_failure(999, None)
+    assert is_host_failure(503, None)
+    assert not is_host_failure(200, None)
+    assert not is_host_failure(404, None)
+
+
+if __name__ == "__main__":
+    test_threshold()
+    test_backoff_doubles_to_cap()
+    test_is_host_failure()
@@ -0,0 +1,69 @@
+#
+# the converter turns extracted tables into typed columns and known fields
+#
+import json
+
+from src import check_path
+check_path()
+
+from transform.html_converter import HtmlConverter
+from transform.field_rules import FieldRuleBook
+from transform.table_columns import TableColumns
+
+ga_rules = FieldRuleBook({ "locations": { "GA": [
+    { "field": "positive", "table": 0, "row": "^Total$", "column": "^No\\. Cases" },
+    { "field": "deaths", "table": 0, "row": "^Deaths$", "column": "^No\\. Cases" },
+    { "field": "tests", "table": 1, "column": "^Total Tests$", "sum": True }
+]}})
+
+ga_page = b"""<html><body><div id="data" class="data">
+<table><tr><th>COVID-19 Confirmed Cases</th><th>No. Cases (%)</th></tr>
+<tr><td>Total</td><td>1,525 (100%)</td></tr><tr><td>Deaths</td><td>48 (3.15%)</td></tr></table>
+<table><tr><th>Lab</th><th>Total Tests</th></tr>
+<tr><td>Commercial Lab</td><td>5,000</td></tr><tr><td>GPHL</td><td>1,234</td></tr></table>
+</div><div id="links"><table><tr><td>a link</td><td>5</td></tr></table></div></body></html>"""
+
+def convert(key: str, content: bytes):
+    return json.loads(HtmlConverter(rules=ga_rules).convert(key, content, None))
+
+# ------------------------------------------------
+def test_ga():
+    x = convert("GA.html", ga_page)
+    assert (x["positive"], x["deaths"], x["tests"]) == (1525, 48, 6234)
+    assert len(x["tables"]) == 2
+    t = x["tables"][0]
+    assert t["columns"] == ["COVID-19 Confirmed Cases", "No. Cases (%)"]
+    assert t["types"] == ["text", "int"]
+    assert t["percents"] == { "No. Cases (%)": [100.0, 3.15] }
+
+def test_generic():
+    page = b"""<html><body><div id="data"><table>
+    <tr><td>County</td><td>Cases</td><td>Deaths</td><td>Rate</td><td>Share</td></tr>
+    <tr><td>A</td><td>12</td><td>-</td><td>1.5</td><td>10%</td></tr>
+    <tr><td>B</td><td>1,200</td><td>3</td><td>2</td><td>90%</td></tr>
+    <tr><td>Total</td><td>1,212</td><td>3</td><td>N/A</td><td>100%</td></tr></table></div></body></html>"""
+    x = convert("XX.html", page)
+    t = x["tables"][0]
+    assert t["types"] == ["text", "int", "int", "float", "percent"]
+    assert t["data"]["Cases"] == [12, 1200, 1212]
+    assert t["data"]["Deaths"] == [None, 3, 3]
+    assert t["data"]["Rate"] == [1.5, 2.0, None]
+    # no rules for XX, the default ones use the total row
+    assert x["positive"] == 1212 and x["deaths"] == 3 and not "tests" in x
+
+def test_no_tables():
+    x = convert("XX.html", b"<html><body><div id='data'></div><p>Cases: 12</p></body></html>")
+    assert x["error"] == "no tables"
+
+def test_header():
+    t = TableColumns([["1", "2"], ["3", "4"]])
+    assert t.names == ["column 1", "column 2"] and t.values["column 1"] == [1, 3]
+    t = TableColumns([["Name", "Name"], ["x", "4"]])
+    assert t.names == ["Name", "Name 2"] and t.types == ["text", "int"]
+
+
+if __name__ == "__main__":
+    test_ga()
+    test_generic()
+    test_no_tables()
+    test_header()
@@ -0,0 +1,91 @@
+#
+# tests for the Prometheus text format written by shared.metrics
+#
+import os
+import tempfile
+
+from src import check_path
+check_path()
+
+from shared.metrics import MetricsRegistry
+
+def make_registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+
+    fetches = registry.counter("test_fetches_total", "fetches by host", ("host", "status"))
+    fetches.inc(host="a.gov", status=200)
+    fetches.inc(2, host="a.gov", status=200)
+    fetches.inc(0.5, host='b "x"\\y\nz', status=304)
+
+    size = registry.gauge("test_cache_bytes", "bytes in memory")
+    size.set(1024)
+    size.set(1536)
+
+    ratio = registry.gauge("test_ratio", "a fraction", ("kind",))
+    ratio.set(0.25, kind="x")
+
+    secs = registry.histogram("test_seconds", "time to fetch", buckets=(1, 5))
+    secs.observe(0.5)
+    secs.observe(3)
+    secs.observe(10)
+    return registry
+
+# ------------------------------------------------
+def test_render():
+    lines = make_registry().render().split("\n")
+    assert lines[-1] == ""
+
+    assert lines[:5] == [
+        "# HELP test_fetches_total fetches by host",
+        "# TYPE test_fetches_total counter",
+        'test_fetches_total{host="a.gov",status="200"} 3',
+        'test_fetches_total{host="b \\"x\\"\\\\y\\nz",status="304"} 0.5',
+        "# HELP test_cache_bytes bytes in memory",
+    ]
+    assert lines[5:11] == [
+        "# TYPE test_cache_bytes gauge",
+        "test_cache_bytes 1536",
+        "# HELP test_ratio a fraction",
+        "# TYPE test_ratio gauge",
+        'test_ratio{kind="x"} 0.25',
+        "# HELP test_seconds time to fetch",
+    ]
+    assert lines[11:-1] == [
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="1"} 1',
+        'test_seconds_bucket{le="5"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 13.5",
+        "test_seconds_count 3",
+    ]
+
+def test_bad_labels():
+    registry = MetricsRegistry()
+    fetches = registry.counter("test_fetches_total", "fetches by host", ("host",))
+    for labels in [{}, { "status": 200 }, { "host": "a.gov", "status": 200 }]:
+        try:
+            fetches.inc(**labels)
+            assert False, f"no error for {labels}"
+        except Exception as ex:
+            assert "expects labels" in str(ex)
+
+    try:
+        fetches.inc(-1, host="a.gov")
+        assert False, "counter went down"
+    except Exception as ex:
+        assert "cannot go down" in str(ex)
+
+def test_write_textfile():
+    registry = make_registry()
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "scanner.prom")
+        registry.write_textfile(path)
+        with open(path) as f:
+            assert f.read() == registry.render()
+        assert os.listdir(work_dir) == ["scanner.prom"]
+
+
+if __name__ == "__main__":
+    test_render()
+    test_bad_labels()
+    test_write_textfile()
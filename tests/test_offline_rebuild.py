@@ -0,0 +1,68 @@
+#
+# rebuilding with a process pool must write the same files as a serial rebuild
+#
+import os
+import glob
+import shutil
+import tempfile
+
+from src import check_path
+check_path()
+
+from shared.directory_cache import DirectoryCache
+from transform.change_list import ChangeItem
+from transform.cleaner_rules import CleanerRuleBook
+from transform.offline_rebuild import RebuildContext, rebuild_pages, format_seconds
+
+corpus_dir = os.path.join(os.path.dirname(__file__), "cleaner_corpus")
+
+def make_context(base: str) -> RebuildContext:
+    raw = DirectoryCache(os.path.join(base, "raw"))
+    for fn in glob.glob(os.path.join(corpus_dir, "*.html")):
+        if fn.endswith(".clean.html"): continue
+        shutil.copy(fn, raw.work_dir)
+    return RebuildContext(raw, DirectoryCache(os.path.join(base, "clean")),
+        DirectoryCache(os.path.join(base, "extract")), DirectoryCache(os.path.join(base, "convert")),
+        "python", CleanerRuleBook())
+
+def make_item(key: str) -> ChangeItem:
+    item = ChangeItem()
+    item.name = key
+    item.url = "https://example.com/" + key
+    return item
+
+def rebuild(base: str, jobs: int):
+    ctx = make_context(base)
+    keys = ctx.cache_raw.list_html_files()
+    rebuild_pages("clean", ctx, [(key, make_item(key)) for key in keys], jobs)
+    rebuild_pages("extract", ctx, [(key, make_item(key)) for key in keys], jobs)
+
+def read_all(base: str):
+    result = {}
+    for d in ["raw", "clean", "extract"]:
+        for fn in sorted(os.listdir(os.path.join(base, d))):
+            with open(os.path.join(base, d, fn), "rb") as f:
+                result[(d, fn)] = f.read()
+    return result
+
+# ------------------------------------------------
+def test_same_as_serial():
+    base = tempfile.mkdtemp()
+    try:
+        rebuild(os.path.join(base, "serial"), 1)
+        rebuild(os.path.join(base, "pool"), 3)
+        serial, pool = read_all(os.path.join(base, "serial")), read_all(os.path.join(base, "pool"))
+        assert len([k for k in serial if k[0] == "extract"]) > 0
+        assert serial == pool
+    finally:
+        shutil.rmtree(base)
+
+def test_format_seconds():
+    assert format_seconds(5) == "0:05"
+    assert format_seconds(309) == "5:09"
+    assert format_seconds(3909) == "1:05:09"
+
+
+if __name__ == "__main__":
+    test_same_as_serial()
+    test_format_seconds()
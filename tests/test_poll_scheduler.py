@@ -0,0 +1,85 @@
+#
+# tests for PollScheduler with a fixed clock
+#
+import tempfile
+import pytz
+from datetime import datetime, timedelta
+
+from src import check_path
+check_path()
+
+from shared.directory_cache import DirectoryCache
+from shared import udatetime
+from sources.poll_scheduler import PollScheduler, MIN_INTERVAL, WINDOW_MINS
+
+class FakeItem:
+    def __init__(self, name: str, updated: datetime, checked: datetime):
+        self.name = name
+        self.updated = updated
+        self.checked = checked
+
+class FakeChangeList:
+    def __init__(self, items):
+        self._lookup = { x.name: x for x in items }
+
+    def get_item(self, name: str):
+        return self._lookup.get(name)
+
+def eastern(day: int, hour: int, minute: int = 0) -> datetime:
+    return udatetime.eastern_tz.localize(datetime(2020, 6, day, hour, minute)).astimezone(pytz.utc)
+
+def make_scheduler(cache_dir: str) -> PollScheduler:
+    " GA changes every day around 5pm "
+    scheduler = PollScheduler(DirectoryCache(cache_dir))
+    for day in range(1, 5):
+        scheduler.record(FakeItem("GA.html", eastern(day, 17, day), None))
+    return scheduler
+
+def test_next_due_before_window():
+    " the scanner wakes up when the window opens, not at the next regular run "
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scheduler = make_scheduler(cache_dir)
+
+        xnow = eastern(5, 12)
+        item = FakeItem("GA.html", eastern(4, 17, 4), eastern(5, 11, 50))
+        interval, reason = scheduler.get_interval("GA.html", xnow)
+        assert reason != "update window"
+
+        # it needs two changes in the window, the second earliest was at 5:02pm
+        dt = scheduler.next_due(FakeChangeList([item]), xnow)
+        assert dt == eastern(5, 17, 2) - timedelta(minutes=WINDOW_MINS), dt
+        _, reason = scheduler.get_interval("GA.html", dt)
+        assert reason == "update window"
+
+        # a minute before, it wasn't open yet
+        _, reason = scheduler.get_interval("GA.html", dt - timedelta(minutes=1))
+        assert reason != "update window"
+
+def test_next_due_in_window():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scheduler = make_scheduler(cache_dir)
+
+        xnow = eastern(5, 16, 30)
+        item = FakeItem("GA.html", eastern(4, 17, 4), eastern(5, 16, 20))
+        dt = scheduler.next_due(FakeChangeList([item]), xnow)
+        assert dt == item.checked + MIN_INTERVAL
+
+        # just checked when the window opens -> not before MIN_INTERVAL
+        xnow = eastern(5, 16, 10)
+        item.checked = eastern(5, 16, 9)
+        dt = scheduler.next_due(FakeChangeList([item]), xnow)
+        assert dt == item.checked + MIN_INTERVAL
+
+def test_next_due_learning():
+    " no window without enough history "
+    with tempfile.TemporaryDirectory() as cache_dir:
+        scheduler = PollScheduler(DirectoryCache(cache_dir))
+        scheduler.record(FakeItem("GA.html", eastern(1, 17), None))
+        item = FakeItem("GA.html", eastern(1, 17), eastern(5, 11, 50))
+        assert scheduler.next_due(FakeChangeList([item]), eastern(5, 12)) == None
+
+
+if __name__ == "__main__":
+    test_next_due_before_window()
+    test_next_due_in_window()
+    test_next_due_learning()
@@ -0,0 +1,48 @@
+#
+# the rebuild manifest decides which outputs are out of date
+#
+import shutil
+import tempfile
+
+from src import check_path
+check_path()
+
+from shared.directory_cache import DirectoryCache
+from transform.rebuild_manifest import RebuildManifest, stage_version
+from transform.cleaner_rules import CleanerRuleBook
+
+# ------------------------------------------------
+def test_manifest():
+    work_dir = tempfile.mkdtemp()
+    try:
+        cache = DirectoryCache(work_dir)
+        v = stage_version("extract", "AZ.html", "google-states")
+        m = RebuildManifest("extract", cache)
+        assert not m.has_entry("AZ.html")
+        m.record("AZ.html", "h1", v)
+        m.save()
+
+        m = RebuildManifest("extract", cache)
+        assert m.is_current("AZ.html", "h1", v)
+        assert not m.is_current("AZ.html", "h2", v)
+        assert not m.is_current("AZ.html", "h1", stage_version("extract", "AZ.html", "other"))
+
+        m.record("AZ.html", None, v)
+        assert not m.has_entry("AZ.html")
+    finally:
+        shutil.rmtree(work_dir)
+
+def test_versions():
+    assert stage_version("clean") == stage_version("clean")
+    assert stage_version("clean") != stage_version("extract")
+
+    book = CleanerRuleBook({ "locations": { "AZ": { "remove_tags": ["span"] } } })
+    az, ca = book.for_page("AZ.html"), book.for_page("CA.html")
+    assert az.fingerprint != ca.fingerprint
+    assert ca.fingerprint == CleanerRuleBook().for_page("CA.html").fingerprint
+    assert stage_version("clean", "python", az.fingerprint) != stage_version("clean", "python", ca.fingerprint)
+
+
+if __name__ == "__main__":
+    test_manifest()
+    test_versions()
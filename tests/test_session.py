@@ -0,0 +1,78 @@
+#
+# benchmark for the shared http session.  should be a unit test
+#
+#   runs a local stand-in server that charges a fixed delay for every
+#   new connection (like a TCP + TLS handshake to a far away .gov site)
+#   and compares a bare requests.get per fetch with the pooled session.
+#
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from src import check_path
+check_path()
+
+from shared.util import get_session, configure_session, fetch_with_requests
+
+HANDSHAKE_SECS = 0.05
+PAGE = b"<html><body>" + b"<div>Cases 123</div>" * 100 + b"</body></html>"
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        time.sleep(HANDSHAKE_SECS)
+        super().setup()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def time_fetches(fetch, url: str, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        content, status = fetch(url)
+        assert status == 200 and content == PAGE
+    return (time.perf_counter() - start) / n
+
+def test_session_reuse():
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}/page"
+    n = 20
+
+    def bare_get(url: str):
+        resp = requests.get(url, verify=False, timeout=30)
+        return resp.content, resp.status_code
+
+    configure_session(pool_maxsize=2)
+    try:
+        bare_secs = time_fetches(bare_get, url, n)
+        pooled_secs = time_fetches(fetch_with_requests, url, n)
+    finally:
+        server.shutdown()
+
+    print(f"bare requests.get: {bare_secs*1000:.1f} ms/fetch")
+    print(f"pooled session:    {pooled_secs*1000:.1f} ms/fetch")
+    print(f"speedup:           {bare_secs/pooled_secs:.1f}x")
+
+    # only the first pooled fetch pays for the handshake
+    assert pooled_secs < bare_secs
+
+
+if __name__ == "__main__":
+    test_session_reuse()
@@ -0,0 +1,71 @@
+#
+# tests for SpecializedCapture sharing the fetch workers' browser pool
+#
+#   uses a stand-in for CaptiveBrowser so no real browser is started.
+#
+import tempfile
+import threading
+
+from src import check_path
+check_path()
+
+import capture.browser_pool
+from capture.browser_pool import BrowserPool
+from specialized_capture import SpecializedCapture
+
+class FakeBrowser:
+
+    def __init__(self, headless: bool = True, browser: str = "firefox"):
+        self.navigation_count = 0
+
+    def navigate(self, url: str) -> bool:
+        self.navigation_count += 1
+        return True
+
+    def wait_until_ready(self, max_secs: float = 5.0, quiet_secs: float = 0.0):
+        pass
+
+    def screenshot(self, path: str, full_page: bool = False):
+        # no image, screenshot stops after giving the browser back
+        return None
+
+    def is_alive(self) -> bool:
+        return True
+
+    def memory_usage(self) -> float:
+        return None
+
+    def close(self):
+        pass
+
+def test_screenshot_gives_browser_back():
+    " with one browser, a fetch worker can still get it after a screenshot "
+
+    real_browser = capture.browser_pool.CaptiveBrowser
+    capture.browser_pool.CaptiveBrowser = FakeBrowser
+    try:
+        pool = BrowserPool(size=1, max_navigations=2)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            c = SpecializedCapture(temp_dir, temp_dir, pool)
+            c.screenshot("az_tableau", "Arizona Main Page", "http://localhost/az")
+
+            got = []
+            worker = threading.Thread(target=lambda: got.append(pool.acquire()), daemon=True)
+            worker.start()
+            worker.join(5.0)
+            assert len(got) == 1, "the capture kept the only browser"
+            pool.release(got[0])
+
+            # the pool recycles it by navigation count, like the workers' browsers
+            first = got[0]
+            c.screenshot("az_tableau", "Arizona Main Page", "http://localhost/az")
+            with pool.borrow() as captive:
+                assert captive != first
+            c.close()
+        pool.close()
+    finally:
+        capture.browser_pool.CaptiveBrowser = real_browser
+
+
+if __name__ == "__main__":
+    test_screenshot_gives_browser_back()
@@ -0,0 +1,79 @@
+#
+# tests for read_streamed_response with a stand-in response
+#
+from src import check_path
+check_path()
+
+from shared import util
+from shared.util import read_streamed_response, content_hash, configure_session
+
+class FakeResponse:
+    " serves content in chunks and counts how many were read "
+
+    def __init__(self, content: bytes, content_length: bool = True):
+        self.content = content
+        self.headers = { "Content-Length": str(len(content)) } if content_length else {}
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.content), chunk_size):
+            self.chunks_read += 1
+            yield self.content[i:i + chunk_size]
+
+PAGE = b"<html><body>" + b"<div>Cases 123</div>\r\n" * 5000 + b"</body></html>"
+
+def test_hash():
+    assert util.session_config["max_size"] > len(PAGE)
+    resp = FakeResponse(PAGE)
+    content, xhash, msg = read_streamed_response(resp, False)
+    assert msg == None
+    assert content == PAGE
+    assert xhash == content_hash(PAGE)
+
+    # the hash is of the content without carriage returns
+    content, xhash, msg = read_streamed_response(FakeResponse(PAGE), True)
+    assert content == PAGE.replace(b"\r", b"")
+    assert xhash == content_hash(content)
+
+def test_size_cap():
+    max_size, chunk_size = util.session_config["max_size"], util.session_config["chunk_size"]
+    configure_session(max_size=50_000, chunk_size=4096)
+    try:
+        # too big by Content-Length -> nothing is read
+        resp = FakeResponse(PAGE)
+        content, xhash, msg = read_streamed_response(resp, False)
+        assert content == None and xhash == None
+        assert msg.startswith("Response is larger than")
+        assert resp.chunks_read == 0
+
+        # no Content-Length -> stops once it goes over
+        resp = FakeResponse(PAGE, content_length=False)
+        content, xhash, msg = read_streamed_response(resp, False)
+        assert content == None and xhash == None
+        assert msg.startswith("Response is larger than")
+        assert resp.chunks_read == 50_000 // 4096 + 1
+        assert resp.chunks_read < len(PAGE) // 4096
+    finally:
+        configure_session(max_size=max_size, chunk_size=chunk_size)
+
+def test_bad_marker():
+    " a block page is given up on at the first chunk "
+    marker, expected = util.bad_content_markers[0]
+    blocked = b"<html><body>" + marker + b"</body></html>" + b"<!-- padding -->" * 20000
+    resp = FakeResponse(blocked, content_length=False)
+    content, xhash, msg = read_streamed_response(resp, False)
+    assert msg == expected
+    assert resp.chunks_read == 1
+    assert blocked.startswith(content) and len(content) < len(blocked)
+    assert xhash == content_hash(content)
+
+    # a marker past the window isn't looked for
+    late = b"<html><body>" + b"<div>Cases 123</div>" * 2000 + marker + b"</body></html>"
+    content, xhash, msg = read_streamed_response(FakeResponse(late), False)
+    assert msg == None and content == late
+
+
+if __name__ == "__main__":
+    test_hash()
+    test_size_cap()
+    test_bad_marker()
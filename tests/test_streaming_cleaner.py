@@ -0,0 +1,60 @@
+#
+# the streaming cleaner must give the same bytes as HtmlCleaner for any chunk size
+#
+import io
+
+from src import check_path
+check_path()
+
+from transform.html_cleaner import HtmlCleaner
+from transform.streaming_cleaner import StreamingHtmlCleaner
+
+script = "var s = 'é中文 </scriptx> </SCR' + \"ipt>\"; // <!-- x\n" * 200
+
+page = ("<html><head><meta charset='utf-8'><script>" + script + "</script>tail é<title>é</title></head>" +
+    "<body><style>" + "a { b: c } é\n" * 200 + "</StYlE >after<!-- </script> -->" +
+    "<div class='x' data-y='1'><noscript><p>no js</p></noscript><p>kept é</p></div>" +
+    "<script>" + script + "</script ><p>x</p></body></html>").encode()
+
+# ------------------------------------------------
+def test_chunks():
+    expected = HtmlCleaner().clean(page)
+    assert b"kept" in expected and not b"var s" in expected
+
+    for n in [5, 17, 64, 1000, 65536]:
+        cleaner = StreamingHtmlCleaner()
+        cleaner.chunk_size = n
+        assert cleaner.clean(page) == expected, f"chunk size {n}"
+
+def test_clean_file():
+    expected = HtmlCleaner().clean(page)
+
+    cleaner = StreamingHtmlCleaner()
+    cleaner.chunk_size = 100
+    f_out = io.BytesIO()
+    assert cleaner.clean_file(io.BytesIO(page), f_out)
+    assert f_out.getvalue() == expected
+
+def test_fragment():
+    " not a full document, parsed like html.fromstring "
+    content = b"<div><p class='x'>a</p><script>b</script></div>"
+    assert StreamingHtmlCleaner().clean(content) == HtmlCleaner().clean(content)
+
+def test_twitter_cluster():
+    " the script/style next to the span are emptied while parsing, the walk must still see them "
+    content = (b"<html><body><div><div><span><a href=\"https://twitter.com/x\">x</a></span><script>1</script>" +
+        b"<style>x</style></div><div><a>3h</a> ago</div></div></body></html>")
+    expected = (b"<html><body><div><div><span><a href=\"https://twitter.com/x\">x</a></span></div>" +
+        b"<div><a>3h</a> ago</div></div></body></html>")
+    assert HtmlCleaner().clean(content) == expected
+    for n in [5, 64, 65536]:
+        cleaner = StreamingHtmlCleaner()
+        cleaner.chunk_size = n
+        assert cleaner.clean(content) == expected, f"chunk size {n}"
+
+
+if __name__ == "__main__":
+    test_chunks()
+    test_clean_file()
+    test_fragment()
+    test_twitter_cluster()
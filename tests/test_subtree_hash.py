@@ -0,0 +1,75 @@
+#
+# an extract that copies unchanged subtrees from the previous one must be
+# the same as a full extract
+#
+from src import check_path
+check_path()
+
+from lxml import html
+
+from transform.change_list import ChangeItem
+from transform.html_extracter import HtmlExtracter
+from transform.subtree_hash import SubtreeHashes, SubtreeIndex
+from shared.util import content_hash
+
+rows = "".join(f"<li>{i} cases <a href='https://example.com/{i}'>link {i}</a></li>" for i in range(50))
+page = f"""<html><body><div id='top'><p>Total cases: <b>1,234</b></p>
+<table><tr><td>County</td><td>Cases</td></tr><tr><td>A</td><td>12</td></tr></table></div>
+<ul>{rows}</ul><div><span>x</span><span>y</span></div>
+{"".join(f"<span>leaf {i} case</span>" for i in range(40))}</body></html>"""
+
+def make_item() -> ChangeItem:
+    item = ChangeItem()
+    item.name = "test"
+    item.source = "test"
+    return item
+
+def extract(content: str, previous: SubtreeIndex = None, previous_content: bytes = None):
+    extracter = HtmlExtracter()
+    doc = extracter.extract_indexed(html.fromstring(content), make_item(), previous, previous_content)
+    out = html.tostring(doc, pretty_print=True)
+    extracter.subtree_index.extract_hash = content_hash(out)
+    return out, extracter
+
+def full_extract(content: str) -> bytes:
+    return HtmlExtracter().extract(content.encode(), make_item())
+
+# ------------------------------------------------
+def test_hashes():
+    a = html.fromstring(page)
+    b = html.fromstring(page.replace("1,234", "1,235"))
+    ha, hb = SubtreeHashes(a), SubtreeHashes(b)
+    assert ha.elements[a] != hb.elements[b]
+    assert ha.elements[a.find(".//ul")] == hb.elements[b.find(".//ul")]
+    assert ha.elements[a.find(".//div")] != hb.elements[b.find(".//div")]
+    # the 40 spans after div, ul and div, in runs of up to 32
+    assert [(first, n) for first, n, _ in ha.runs[a.find("body")]] == [(3, 32), (35, 8)]
+
+def test_incremental():
+    out, e = extract(page)
+    assert out == full_extract(page)
+    assert e.changed == None
+
+    for new_page in [page.replace("1,234", "1,235"), page.replace("<li>7 cases", "<li>7 more cases"),
+            page.replace("leaf 20", "leaf 21"), page.replace("<li>3 cases", "<li>3 cases</li><li>new case"),
+            page.replace("<p>Total", "<p id='x'>Total"), page.replace("<td>12</td>", "<td>13</td>")]:
+        previous = SubtreeIndex.from_bytes(e.subtree_index.to_bytes())
+        new_out, e2 = extract(new_page, previous, out)
+        assert new_out == full_extract(new_page)
+        assert e2.copied > 0 and len(e2.changed) > 0
+
+    new_out, e2 = extract(page.replace("1,234", "1,235"), e.subtree_index, out)
+    assert e2.changed == ["/html/body/div[1]/p"]
+
+def test_stale_index():
+    " an index for another extract is not used "
+    out, e = extract(page)
+    new_out, e2 = extract(page.replace("1,234", "1,235"), e.subtree_index, out + b" ")
+    assert e2.copied == 0 and e2.changed == None
+    assert new_out == full_extract(page.replace("1,234", "1,235"))
+
+
+if __name__ == "__main__":
+    test_hashes()
+    test_incremental()
+    test_stale_index()
@@ -0,0 +1,64 @@
+#
+# TextIndex gives the same strings as the recursive extract_text/__extract_child did
+#   (including the leading/double spaces of the link text)
+#
+from src import check_path
+check_path()
+
+from lxml import html, etree
+from transform.text_index import TextIndex
+from transform.content_text import ContentText, case_pattern
+
+page = "<div id='d'> Total <span></span><b> 12 </b> cases <a href='x'><i></i>link</a> after " + \
+    "<table><tr><td>in table</td></tr></table> tail <p><iframe>frame</iframe> x</p></div>"
+
+expected = {
+    #  tag      link text                                           child text
+    "div":    ("Total 12 cases   link after   in table tail  frame x", "12 cases link after tail frame x"),
+    "span":   ("", ""),
+    "b":      ("12 cases", "12 cases"),
+    "a":      ("  link after", "link"),
+    "i":      (" link", "link"),
+    "table":  ("  in table tail", ""),
+    "tr":     (" in table", "in table"),
+    "td":     ("in table", "in table"),
+    "p":      (" frame x", "frame x"),
+    "iframe": ("frame x", ""),
+}
+
+# ------------------------------------------------
+def test_page():
+    doc = html.fromstring(page)
+    index = TextIndex(case_pattern)
+    for elem in doc.iter():
+        link_text, child_text = expected[elem.tag]
+        ct = ContentText(elem, "", "", index)
+        assert index.link_text(elem) == link_text, elem.tag
+        assert ct.child_text == child_text, elem.tag
+        assert (ct.contains_data() == True) == (case_pattern.search(child_text) != None), elem.tag
+
+def test_order():
+    " children first, then their parents "
+    doc = html.fromstring(page)
+    index = TextIndex(case_pattern)
+    for elem in reversed(list(doc.iter())):
+        link_text, child_text = expected[elem.tag]
+        assert index.link_text(elem) == link_text, elem.tag
+        assert ContentText(elem, "", "", index).child_text == child_text, elem.tag
+
+def test_deep():
+    " deeper than the recursion limit "
+    doc = html.fromstring("<div></div>")
+    elem = doc
+    for i in range(5000):
+        elem = etree.SubElement(elem, "div")
+        elem.text = "case"
+    index = TextIndex(case_pattern)
+    assert index.child_text_marked(doc)
+    assert len(index.link_text(doc).split()) == 5000
+
+
+if __name__ == "__main__":
+    test_page()
+    test_order()
+    test_deep()
@@ -0,0 +1,54 @@
+#
+# the tree diff of two versions of a page
+#
+from src import check_path
+check_path()
+
+from lxml import html
+
+from transform.tree_diff import TreeDiff
+
+rows = "".join(f"<li>row {i}</li>" for i in range(20))
+page = f"""<html><body><div id='top'><p>Total cases: <b>1,234</b></p></div>
+<ul>{rows}</ul><p class='note'>updated daily</p></body></html>"""
+
+def diff(a: str, b: str, **kwargs):
+    return TreeDiff(**kwargs).diff(html.fromstring(a), html.fromstring(b))
+
+# ------------------------------------------------
+def test_same():
+    x = diff(page, page)
+    assert x.ops == [] and x.summary() == "same"
+
+def test_text():
+    x = diff(page, page.replace("1,234", "1,235"))
+    assert x.ops == [{"op": "text", "path": "/html/body/div/p/b", "old": "1,234", "new": "1,235"}]
+    assert x.summary() == "1 changed"
+
+def test_attrib():
+    x = diff(page, page.replace("class='note'", "class='old'"))
+    assert [(op["op"], op["path"], op["name"]) for op in x.ops] == [("attrib", "/html/body/p", "class")]
+
+def test_add_remove():
+    x = diff(page, page.replace("<li>row 5</li>", "<li>row 5</li><li>new row</li>"))
+    assert x.ops == [{"op": "add", "path": "/html/body/ul/li[7]", "text": "<li> new row"}]
+
+    x = diff(page, page.replace("<li>row 5</li>", ""))
+    assert x.ops == [{"op": "remove", "path": "/html/body/ul/li[6]", "text": "<li> row 5"}]
+
+    x = diff(page, page.replace("<div id='top'>", "<div id='top'><h2>Cases</h2>"))
+    assert x.summary() == "1 added"
+
+def test_limits():
+    other = page.replace("row", "line")
+    x = diff(page, other, max_ops=5)
+    assert x.truncated and len(x.ops) == 5
+    assert x.summary().endswith("truncated")
+
+
+if __name__ == "__main__":
+    test_same()
+    test_text()
+    test_attrib()
+    test_add_remove()
+    test_limits()
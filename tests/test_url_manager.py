@@ -0,0 +1,74 @@
+#
+# tests for the conditional GET validators kept by UrlManager
+#
+#   runs a local stand-in server whose ETag can be changed or dropped
+#   between fetches.
+#
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from src import check_path
+check_path()
+
+from sources.url_manager import UrlManager
+
+PAGE = b"<html><body>" + b"<div>Cases 123</div>" * 100 + b"</body></html>"
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # headers sent with the next 200
+    validators = {}
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(PAGE)))
+        for n, v in StandInHandler.validators.items():
+            self.send_header(n, v)
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_validators_dropped():
+    " a 200 without an ETag clears the one saved by the last run "
+
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}/page"
+    try:
+        with tempfile.TemporaryDirectory() as spill_dir:
+            StandInHandler.validators = { "ETag": '"v1"', "Last-Modified": "Mon, 01 Jun 2020 10:00:00 GMT" }
+            manager = UrlManager(spill_dir=spill_dir)
+            cache_info = {}
+            content, status = manager.fetch(url, cache_info)
+            assert status == 200 and content == PAGE
+            assert cache_info["etag"] == '"v1"'
+            assert cache_info["last_modified"] == "Mon, 01 Jun 2020 10:00:00 GMT"
+
+            # next run: the server stopped sending validators
+            StandInHandler.validators = {}
+            manager = UrlManager(spill_dir=spill_dir)
+            content, status = manager.fetch(url, cache_info)
+            assert status == 200 and content == PAGE
+            assert not "etag" in cache_info
+            assert not "last_modified" in cache_info
+
+            # a repeat in the same run gives the same answer
+            repeat_info = { "etag": '"stale"' }
+            content, status = manager.fetch(url, repeat_info)
+            assert status == 200 and content == PAGE
+            assert not "etag" in repeat_info
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_validators_dropped()